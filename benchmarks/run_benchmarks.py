@@ -0,0 +1,288 @@
+"""
+Benchmark suite of the KNN paths
+
+Measures the end-to-end latency (median of the repeats), the throughput (queries or
+rows per second) and the peak memory (tracemalloc: Python and NumPy allocations, the
+Aer C++ memory is not included) of:
+    -   classical_fit: KnnModel.fit on a synthetic dataset
+    -   classical_predict: KnnModel.predict_batch, k nearest neighbours or all the dataset
+    -   exact: QuantumKnnModel analytic probabilities
+    -   circuit_build: initial states and KNN circuits of a query batch
+    -   transpile: transpilation of the KNN circuits of a batch (no cache)
+    -   sampler_local: Sampler on the noiseless Aer simulator (parameterized circuit)
+    -   sampler_fake_hardware: Sampler on a noisy fake backend
+for a grid of dataset sizes, query batch sizes and shots.
+
+The results are written as JSON, compared with a baseline file and the script exits
+with status 1 when a case is slower than its baseline by more than the threshold.
+Baselines are machine dependent, update them on the machine running the comparison.
+
+Usage:
+-----
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --quick --threshold 0.5
+    python benchmarks/run_benchmarks.py --update-baseline
+"""
+
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+# Add the repository root and the quantum machine learning examples to the PYTHONPATH
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(ROOT_DIR / "src" / "quantum_machine_learning"))
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+RATINGS = np.arange(1.0, 4.5 + 0.25, 0.5)
+
+# name -> list of parameter sets, (default grid, quick grid)
+GRIDS = {
+    "classical_fit": (
+        [{"rows": 1_000}, {"rows": 100_000}],
+        [{"rows": 1_000}],
+    ),
+    "classical_predict": (
+        [{"rows": 1_000, "batch": 1_000, "k": None}, {"rows": 100_000, "batch": 1_000, "k": 5},
+         {"rows": 100_000, "batch": 100_000, "k": 5}],
+        [{"rows": 1_000, "batch": 100, "k": None}, {"rows": 1_000, "batch": 100, "k": 5}],
+    ),
+    "exact": (
+        [{"batch": 1_000}, {"batch": 100_000}],
+        [{"batch": 1_000}],
+    ),
+    "circuit_build": (
+        [{"batch": 10}, {"batch": 100}],
+        [{"batch": 10}],
+    ),
+    "transpile": (
+        [{"batch": 10}, {"batch": 50}],
+        [{"batch": 5}],
+    ),
+    "sampler_local": (
+        [{"batch": 10, "shots": 100}, {"batch": 10, "shots": 1_000}, {"batch": 100, "shots": 1_000}],
+        [{"batch": 10, "shots": 100}],
+    ),
+    "sampler_fake_hardware": (
+        [{"batch": 10, "shots": 1_000}],
+        [{"batch": 5, "shots": 100}],
+    ),
+}
+
+
+def synthetic_queries(size: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).choice(RATINGS, size=(size, 2))
+
+
+def write_dataset(path: Path, rows: int, seed: int = 1) -> Path:
+    """Synthetic dataset csv (empty header row, option_1, option_2, choice)"""
+    options = synthetic_queries(rows, seed)
+    choices = np.where(options[:, 0] >= options[:, 1], 1, 2)
+    with open(path, "w") as file:
+        file.write(",,\n")
+        np.savetxt(file, np.column_stack((options, choices)), fmt="%g", delimiter=",")
+    return path
+
+
+def fake_backend():
+    from qiskit_ibm_runtime.fake_provider import FakeManilaV2
+    return FakeManilaV2()
+
+
+"""
+Cases
+-----
+Each case prepares its inputs and returns (run, items): run() is the measured call
+and items the number of queries (or rows) it processes.
+"""
+
+
+def classical_fit(workdir: Path, rows: int):
+    from ml_knn import KnnModel
+    db_path = write_dataset(workdir / f"dataset_{rows}.csv", rows)
+    return lambda: KnnModel().fit(db_path), rows
+
+
+def classical_predict(workdir: Path, rows: int, batch: int, k):
+    from ml_knn import KnnModel
+    model = KnnModel()
+    model.fit(write_dataset(workdir / f"dataset_{rows}.csv", rows))
+    queries = synthetic_queries(batch)
+    return lambda: model.predict_batch(queries, k=k), batch
+
+
+def exact(workdir: Path, batch: int):
+    from qc_ml_knn import QuantumKnnModel
+    model = QuantumKnnModel()
+    model.fit(write_dataset(workdir / "dataset_2.csv", 2))
+    queries = synthetic_queries(batch)
+    return lambda: model.exact_probabilities(None, queries), batch
+
+
+def circuit_build(workdir: Path, batch: int):
+    from qc_ml_knn import QuantumKnnModel
+    model = QuantumKnnModel()
+    model.fit(write_dataset(workdir / "dataset_2.csv", 2))
+    queries = synthetic_queries(batch)
+
+    def run():
+        return [model.knn_quantum_circuit(state) for state in model.compute_initial_states(None, queries)]
+    return run, batch
+
+
+def transpile(workdir: Path, batch: int):
+    from qc_ml_knn import QuantumKnnModel
+    from utils.save_account import transpile_circuits
+    model = QuantumKnnModel()
+    model.fit(write_dataset(workdir / "dataset_2.csv", 2))
+    circuits = [
+        model.knn_quantum_circuit(state)
+        for state in model.compute_initial_states(None, synthetic_queries(batch))
+    ]
+    backend = fake_backend()
+    return lambda: transpile_circuits(circuits, backend, num_processes=1, use_cache=False), batch
+
+
+def _sampler_case(workdir: Path, backend, batch: int, shots: int):
+    from qc_ml_knn import QuantumKnnModel
+    model = QuantumKnnModel(use_result_cache=False)
+    model.fit(write_dataset(workdir / "dataset_2.csv", 2))
+    model.transpile_parameterized_circuit(backend) # transpiled once, outside of the measure
+    queries = synthetic_queries(batch)
+    return lambda: model.predict_batch(None, queries, backend=backend, shots=shots, encoder="ry_tree"), batch
+
+
+def sampler_local(workdir: Path, batch: int, shots: int):
+    from qiskit_aer import AerSimulator
+    return _sampler_case(workdir, AerSimulator(seed_simulator=42), batch, shots)
+
+
+def sampler_fake_hardware(workdir: Path, batch: int, shots: int):
+    return _sampler_case(workdir, fake_backend(), batch, shots)
+
+
+CASES = {
+    "classical_fit": classical_fit,
+    "classical_predict": classical_predict,
+    "exact": exact,
+    "circuit_build": circuit_build,
+    "transpile": transpile,
+    "sampler_local": sampler_local,
+    "sampler_fake_hardware": sampler_fake_hardware,
+}
+
+
+def case_id(name: str, params: dict) -> str:
+    return f"{name}[{','.join(f'{key}={value}' for key, value in sorted(params.items()))}]"
+
+
+def measure(run, items: int, repeats: int = 5) -> dict:
+    """
+    Latency and throughput over the repeats (after one warm-up call), peak memory
+    in one more call with tracemalloc on; the output of run() is discarded
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    latency = float(np.median(latencies))
+    return {
+        "latency_s": latency,
+        "min_latency_s": min(latencies),
+        "throughput": items / latency if latency > 0 else None,
+        "items": items,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def environment() -> dict:
+    import qiskit
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "qiskit": qiskit.__version__,
+    }
+
+
+def run_suite(names=None, quick: bool = False, repeats: int = 5) -> dict:
+    """
+    :param names: cases to run, by default all of them
+    :param quick: small grid, e.g. for CI smoke runs
+    :return: {"environment": {...}, "results": {case id: measures}}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="qc_benchmarks_") as workdir:
+        for name in names or CASES:
+            for params in GRIDS[name][1 if quick else 0]:
+                run, items = CASES[name](Path(workdir), **params)
+                results[case_id(name, params)] = {"name": name, "params": params, **measure(run, items, repeats)}
+                print(f"{case_id(name, params)}: {results[case_id(name, params)]['latency_s']*1e3:.3f} ms")
+    return {"environment": environment(), "results": results}
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.25) -> list:
+    """
+    :param threshold: allowed relative increase of the latency
+    :return: [(case id, baseline latency, latency)] of the regressed cases,
+    cases missing from the baseline are ignored
+    """
+    regressions = []
+    for key, measures in results["results"].items():
+        reference = baseline["results"].get(key)
+        if reference is not None and measures["latency_s"] > reference["latency_s"] * (1 + threshold):
+            regressions.append((key, reference["latency_s"], measures["latency_s"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the KNN paths")
+    parser.add_argument("--cases", nargs="*", choices=list(CASES), default=None, help="cases to run")
+    parser.add_argument("--quick", action="store_true", help="small parameter grid")
+    parser.add_argument("--repeats", type=int, default=5, help="measured calls per case")
+    parser.add_argument("--output", type=Path, default=None, help="JSON results file")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="JSON baseline file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative latency increase")
+    parser.add_argument("--update-baseline", action="store_true", help="write the results into the baseline")
+    args = parser.parse_args()
+
+    results = run_suite(args.cases, args.quick, args.repeats)
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.update_baseline:
+        # the cases of other grids (e.g. --quick) already in the baseline are kept
+        if args.baseline.exists():
+            results["results"] = {**json.loads(args.baseline.read_text())["results"], **results["results"]}
+        args.baseline.write_text(json.dumps(results, indent=2))
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"No baseline {args.baseline}, nothing compared")
+        return
+    regressions = compare(results, json.loads(args.baseline.read_text()), args.threshold)
+    for key, reference, latency in regressions:
+        print(f"REGRESSION {key}: {reference*1e3:.3f} ms -> {latency*1e3:.3f} ms")
+    if regressions:
+        sys.exit(1)
+    print(f"No regression above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,30 @@
 """This code is taken from Estimator Example from EstimatorV2 Class docstring"""
 
 import os
+import sys
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from qiskit.circuit.library import RealAmplitudes
 from qiskit.quantum_info import SparsePauliOp
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
-from qiskit_ibm_runtime import QiskitRuntimeService, EstimatorV2 as Estimator
-
-token  = os.getenv('IBM_QUANTUM_TOKEN') 
-service = QiskitRuntimeService(channel="ibm_quantum", token=token)
-backend = service.least_busy(operational=True, simulator=False)
+from qiskit_ibm_runtime import EstimatorV2 as Estimator
+from utils.result_cache import CachedEstimator
+from utils.save_account import transpile_circuit
+from utils.job_manager import run_job
+from utils.transpile_cache import DEFAULT_CACHE_DIR
 
 psi = RealAmplitudes(num_qubits=2, reps=2)
 hamiltonian = SparsePauliOp.from_list([("II", 1), ("IZ", 2), ("XI", 3)])
 theta = [0, 1, 1, 2, 3, 5]
 
-pm = generate_preset_pass_manager(backend=backend, optimization_level=1)
-isa_psi = pm.run(psi)
+# the backend of the previous runs and the cached ISA circuit are reused, see utils/save_account.py
+backend, isa_psi = transpile_circuit(psi, operational=True, simulator=False)
 isa_observables = hamiltonian.apply_layout(isa_psi.layout)
 
-estimator = Estimator(mode=backend)
+estimator = CachedEstimator(Estimator(mode=backend)) # same circuit on the same calibration: cached result
 
 # calculate [ <psi(theta1)|hamiltonian|psi(theta)> ]
-job = estimator.run([(isa_psi, isa_observables, [theta])])
-job_id = job.job_id()
-job_status = job.status()
-print(job_id)
-print(job_status)
-pub_result = job.result()[0]
-print(f"Expectation values: {pub_result.data.evs}")
\ No newline at end of file
+# polled by the job manager, an interrupted run retrieves the journaled job instead of submitting again
+pub_result = run_job(
+    estimator, [(isa_psi, isa_observables, [theta])], journal_path=DEFAULT_CACHE_DIR / "journals" / "estimator_example.jsonl"
+)[0]
+print(f"Expectation values: {pub_result['evs']}")
@@ -1,9 +1,13 @@
 import os
+import sys
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from qiskit import QuantumCircuit
 from qiskit.quantum_info import SparsePauliOp
-from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 from qiskit_ibm_runtime import EstimatorV2 as Estimator
-from qiskit_ibm_runtime import QiskitRuntimeService
+from utils.save_account import transpile_circuit
+from utils.job_manager import run_job
+from utils.transpile_cache import DEFAULT_CACHE_DIR
  
 
 # Create a new circuit with two qubits
@@ -25,13 +29,9 @@ qc.draw("mpl")
 observables_labels = ["IZ", "IX", "ZI", "XI", "ZZ", "XX"]
 observables = [SparsePauliOp(label) for label in observables_labels]
 
-token  = os.getenv('IBM_QUANTUM_TOKEN') # getting the custom env variable that stores my IBM token
-service = QiskitRuntimeService(channel="ibm_quantum", token=token)
-backend = service.least_busy(simulator=False, operational=True)
- 
 # Convert to an ISA circuit and layout-mapped observables.
-pm = generate_preset_pass_manager(backend=backend, optimization_level=1)
-isa_circuit = pm.run(qc)
+# The backend of the previous runs and the cached ISA circuit are reused, see utils/save_account.py
+backend, isa_circuit = transpile_circuit(qc, simulator=False, operational=True)
  
 isa_circuit.draw("mpl", idle_wires=False)
 
@@ -46,17 +46,10 @@ mapped_observables = [
 ]
  
 # One pub, with one circuit to run against five different observables.
-job = estimator.run([(isa_circuit, mapped_observables)])
- 
-# Use the job ID to retrieve your job data later
-print(f">>> Job ID: {job.job_id()}")
-print(f">>> Job status: {job.status()}")
-
-# This is the result of the entire submission.  You submitted one Pub,
-# so this contains one inner result (and some metadata of its own).
-#job_result = job.result()
- 
-# This is the result from our single pub, which had six observables,
-# so contains information on all six.
-pub_result = job.result()[0]
-print(f"Expectation values: {pub_result.data.evs}")
\ No newline at end of file
+# The job is polled by the job manager (its ID is printed) and recorded in the journal:
+# a run interrupted while the job is queued retrieves it instead of submitting again.
+# The result of our single pub, which had six observables, contains information on all six.
+pub_result = run_job(
+    estimator, [(isa_circuit, mapped_observables)], journal_path=DEFAULT_CACHE_DIR / "journals" / "ibm_hello_world.jsonl"
+)[0]
+print(f"Expectation values: {pub_result['evs']}")
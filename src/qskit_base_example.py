@@ -1,8 +1,12 @@
+import argparse
 import sys 
 import os
 # Add the parent directory to the PYTHONPATH 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from utils.save_account import save_account, get_first_available_backend,transpile_circuit
+from utils.result_cache import CachedEstimator
+from utils.aer_engine import AerEngine
+from utils.job_manager import run_job
 import numpy as np
 from qiskit import QuantumCircuit, transpile
 from qiskit.primitives import StatevectorSampler, StatevectorEstimator
@@ -12,9 +16,13 @@ from qiskit_ibm_runtime import QiskitRuntimeService, EstimatorOptions, Estimator
 from qiskit_ibm_runtime.options.resilience_options import ResilienceOptionsV2
 
 
-def main():
+def main(local: bool = False, threads: int | None = None, journal_path=None):
     """
     Example from https://github.com/Qiskit/qiskit
+
+    :param local: run on the local Aer simulator instead of the least busy backend
+    :param threads: OpenMP threads of the Aer simulator, by default all the cores
+    :param journal_path: JSON lines journal of the job (see utils/job_manager.py)
     """
     
 
@@ -31,20 +39,28 @@ def main():
     print(f"The operators strings:\n{operator}")
 
     # 3. Optimize the problem
-    backend, qc_transpiled = transpile_circuit(qc_example)
+    if local:
+        engine = AerEngine(processes=1, threads=threads)
+        backend, qc_transpiled = transpile_circuit(qc_example, backend=engine.backend())
+    else:
+        backend, qc_transpiled = transpile_circuit(qc_example)
     operator_transpiled = operator.apply_layout(layout=qc_transpiled.layout)
 
     # 4. Execute on the Backend
-    estimator = Estimator(mode=backend)
-    job  = estimator.run([(qc_transpiled, operator_transpiled)])
-    job_id = job.job_id()
-    job_status = job.status()
-    print(job_id)
-    print(job_status)
-    pub_result = job.result()[0]
-    print(f"Expectation values: {pub_result.data.evs}")
+    if local:
+        estimator = engine.estimator()
+    else:
+        estimator = CachedEstimator(Estimator(mode=backend)) # same circuit on the same calibration: cached result
+    # polled by the job manager, with a journal an interrupted run retrieves the job
+    pub_result = run_job(estimator, [(qc_transpiled, operator_transpiled)], journal_path=journal_path)[0]
+    print(f"Expectation values: {pub_result['evs']}")
 
 
     # TODO: run on quantum computer following https://github.com/Qiskit/qiskit-ibm-runtime
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Qiskit base example")
+    parser.add_argument("--local", action="store_true", help="run on the local Aer simulator")
+    parser.add_argument("--threads", type=int, default=None, help="OpenMP threads of the Aer simulator")
+    parser.add_argument("--journal", default=None, help="journal of the job, resumed after an interruption")
+    args = parser.parse_args()
+    main(local=args.local, threads=args.threads, journal_path=args.journal)
@@ -0,0 +1,106 @@
+"""
+Parameterized amplitude encoding
+
+circuit.initialize(state) synthesizes a new state preparation for every state
+vector, hence every query needs a full transpilation. Here the state preparation
+is a fixed tree of uniformly controlled RY rotations (Mottonen et al., 2004
+"Transformation of quantum states using uniformly controlled rotations")
+whose angles are circuit Parameters. The circuit is transpiled once and each
+query only binds its angles.
+
+Tree for 4 qubits (Q3,Q2,Q1,Q0), state index = Q3Q2Q1Q0:
+    level 0: RY on Q3, splits the norm between the halves Q3=0 and Q3=1
+    level 1: RY on Q2 uniformly controlled by Q3 (2 angles)
+    level 2: RY on Q1 uniformly controlled by Q3,Q2 (4 angles)
+    level 3: RY on Q0 uniformly controlled by Q3,Q2,Q1 (8 angles)
+15 angles in total. On the last level the angles keep the sign of the amplitudes,
+hence any real state vector can be encoded.
+
+Each uniformly controlled RY with k controls is decomposed into 2^k RY and 2^k CX
+following the Gray code of the control states, the RY angles are obtained from
+the rotation angles alpha with the linear transformation theta = M^-1 alpha
+(computed with NumPy for all the queries at once).
+"""
+
+
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import ParameterVector
+
+
+def gray_code(i: int) -> int:
+    return i ^ (i >> 1)
+
+
+def number_of_angles(num_qubits: int) -> int:
+    return 2**num_qubits - 1
+
+
+def _changed_control(i: int, num_controls: int) -> int:
+    """Index of the control bit flipping between gray(i) and gray(i+1), cyclic"""
+    if i == 2**num_controls - 1:
+        return num_controls - 1
+    return (gray_code(i) ^ gray_code(i + 1)).bit_length() - 1
+
+
+def _uniformly_controlled_ry(circuit: QuantumCircuit, thetas, controls: list, target: int):
+    if not controls:
+        circuit.ry(thetas[0], target)
+        return
+    for i in range(2**len(controls)):
+        circuit.ry(thetas[i], target)
+        circuit.cx(controls[_changed_control(i, len(controls))], target)
+
+
+def _angles_transformation(num_controls: int) -> np.ndarray:
+    """
+    M^-1 where alpha = M theta and M[j, i] = (-1)^(j . gray(i)), "." being the bitwise
+    dot product: after i CX the target has been flipped by the controls in gray(i).
+    M is orthogonal up to the factor 2^k hence M^-1 = M^T / 2^k
+    """
+    size = 2**num_controls
+    rows = np.array([gray_code(i) for i in range(size)])
+    columns = np.arange(size)
+    dot = np.vectorize(lambda x: bin(x).count("1"))(rows[:, None] & columns[None, :])
+    matrix = (-1.0)**dot
+    return matrix / size
+
+
+def amplitude_encoding_circuit(num_qubits: int = 4, name: str = "theta") -> QuantumCircuit:
+    """
+    Returns the state preparation circuit with number_of_angles(num_qubits) RY angles
+    stored in a ParameterVector; bind them with encoding_angles().
+    """
+    thetas = ParameterVector(name, number_of_angles(num_qubits))
+    circuit = QuantumCircuit(num_qubits)
+    offset = 0
+    for target in reversed(range(num_qubits)):
+        controls = list(range(target + 1, num_qubits))
+        size = 2**len(controls)
+        _uniformly_controlled_ry(circuit, thetas[offset:offset + size], controls, target)
+        offset += size
+    return circuit
+
+
+def encoding_angles(states) -> np.ndarray:
+    """
+    Computes the circuit angles encoding each state vector (vectorized over the rows).
+
+    :param states: real state vectors, shape (2^n,) or (number of states, 2^n)
+    :return: array of shape (number of states, 2^n - 1) in the parameters order
+    of amplitude_encoding_circuit()
+    """
+    states = np.atleast_2d(np.asarray(states, dtype=np.float64))
+    num_states, dimension = states.shape
+    num_qubits = dimension.bit_length() - 1
+    angles = []
+    for target in reversed(range(num_qubits)):
+        blocks = states.reshape(num_states, 2**(num_qubits - 1 - target), 2, 2**target)
+        if target == 0:
+            alphas = 2*np.arctan2(blocks[:, :, 1, 0], blocks[:, :, 0, 0])
+        else:
+            norms = np.linalg.norm(blocks, axis=3)
+            alphas = 2*np.arctan2(norms[:, :, 1], norms[:, :, 0])
+        transformation = _angles_transformation(num_qubits - 1 - target)
+        angles.append(alphas @ transformation.T)
+    return np.concatenate(angles, axis=1)
@@ -1,28 +1,138 @@
+import os
+import sys
 from pathlib import Path
-import pandas as pd
+import numpy as np
 from math import sqrt
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utils.instrumentation import span, count
+
+"""
+pandas is imported by the functions reading the csv file, not at module import:
+the modules importing data_processing (e.g. ml_knn) do not pay its import time
+until a dataset is read.
+"""
+
 
 def get_dataset(db_path):  # TODO:move to common module
-    df = pd.read_csv(db_path)
+    import pandas as pd
+    with span("csv_load"):
+        df = pd.read_csv(db_path)
+    count("rows_read", len(df))
     dataset = df.values.tolist()
     print(f"The Dataset:\n{dataset}")
     return dataset
 
 
+def load_training_array(db_path) -> np.ndarray:
+    """
+    Reads the dataset into a float64 array (option_1, option_2, choice) without printing it
+    """
+    import pandas as pd
+    with span("csv_load"):
+        rows = pd.read_csv(db_path).to_numpy(dtype=np.float64)
+    count("rows_read", len(rows))
+    return rows
+
+
 def normalize_dataset(dataset: list):
-    for i in range(len(dataset)):
-        base = sqrt(dataset[i][0]**2 + dataset[i][1]**2)
-        dataset[i][0] = dataset[i][0]/base
-        dataset[i][1] = dataset[i][1]/base
-        vector_length = sqrt((dataset[i][0])**2 + (dataset[i][1])**2)
-        print(f"Vector {i + 1} length after normalization: {vector_length}")
+    with span("normalization", rows=len(dataset)):
+        for i in range(len(dataset)):
+            base = sqrt(dataset[i][0]**2 + dataset[i][1]**2)
+            dataset[i][0] = dataset[i][0]/base
+            dataset[i][1] = dataset[i][1]/base
+            vector_length = sqrt((dataset[i][0])**2 + (dataset[i][1])**2)
+            print(f"Vector {i + 1} length after normalization: {vector_length}")
     return dataset
 
 def normalize_test_set(test_set: list):
-    base = sqrt(test_set[0]**2 + test_set[1]**2)
-    test_set[0] = test_set[0]/base
-    test_set[1] = test_set[1]/base
-    vector_length = sqrt((test_set[0])**2 + (test_set[1])**2)
+    with span("normalization", rows=1):
+        base = sqrt(test_set[0]**2 + test_set[1]**2)
+        test_set[0] = test_set[0]/base
+        test_set[1] = test_set[1]/base
+        vector_length = sqrt((test_set[0])**2 + (test_set[1])**2)
     print(f"Normalized test points:\n{test_set[0]}\n{test_set[1]}")
     print(f"test set euclidian vector length: {vector_length}")
-    return test_set
\ No newline at end of file
+    return test_set
+
+def normalize_points(points) -> np.ndarray:
+    """
+    Vectorized version of normalize_test_set for many query points at once:
+    every (option_1, option_2) row is projected onto the unit circle.
+
+    :param points: a single point [x, y] or a sequence of points [[x, y], ...]
+    :return: float64 array of shape (number of points, 2)
+    """
+    with span("normalization"):
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))[:, :2]
+        return points / np.linalg.norm(points, axis=1, keepdims=True)
+
+
+"""
+Streaming ingestion
+-------------------
+For datasets larger than the memory the csv file is read in fixed-size chunks of
+float64 arrays (option_1, option_2, choice), each chunk is normalized with NumPy and
+optionally written into a memory-mapped .npy file. Peak memory depends only on the
+chunk size and nothing is printed per row.
+"""
+
+
+def iter_dataset_chunks(db_path, chunk_size: int = 100_000):
+    """
+    Yields the dataset rows as float64 arrays of shape (at most chunk_size, 3)
+    """
+    import pandas as pd
+    with pd.read_csv(db_path, usecols=[0, 1, 2], dtype=np.float64, chunksize=chunk_size) as reader:
+        chunks = iter(reader)
+        while True:
+            # only the read is timed, not the consumer of the chunk
+            with span("csv_load", chunk_size=chunk_size):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            count("rows_read", len(chunk))
+            yield chunk.to_numpy()
+
+
+def normalize_array(rows: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of normalize_dataset: the (option_1, option_2) columns are
+    projected onto the unit circle in place, other columns (the choice) are kept.
+    """
+    with span("normalization", rows=len(rows)):
+        rows[:, :2] /= np.linalg.norm(rows[:, :2], axis=1, keepdims=True)
+    return rows
+
+
+def iter_normalized_chunks(db_path, chunk_size: int = 100_000):
+    for chunk in iter_dataset_chunks(db_path, chunk_size):
+        yield normalize_array(chunk)
+
+
+def count_rows(db_path) -> int:
+    """Number of non empty data rows of the csv file (header excluded), read line by line"""
+    with open(db_path, "rb") as file:
+        next(file, None)
+        return sum(1 for line in file if line.strip())
+
+
+def normalize_dataset_to_npy(db_path, npy_path, chunk_size: int = 100_000) -> np.ndarray:
+    """
+    Streams the normalized dataset into a .npy file, one chunk at a time.
+
+    :param db_path: path of the dataset csv file
+    :param npy_path: path of the .npy file to write
+    :param chunk_size: number of rows read and normalized at a time
+    :return: the written array, memory-mapped read-only
+    """
+    rows = np.lib.format.open_memmap(
+        npy_path, mode="w+", dtype=np.float64, shape=(count_rows(db_path), 3)
+    )
+    start = 0
+    for chunk in iter_normalized_chunks(db_path, chunk_size):
+        rows[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    rows.flush()
+    del rows
+    return np.load(npy_path, mmap_mode="r")
@@ -0,0 +1,60 @@
+"""
+Precomputed predictions for the finite rating domain
+
+Reviews are half-star values between 1 and 4.5 (see the ml_knn.py docstring), hence
+there are only 8 x 8 possible queries (option_1, option_2). For a fitted training set
+all of them are evaluated in one batched pass and online prediction becomes an array
+lookup. The table stores the fingerprint of the training set it was computed on, the
+models drop it when they are fitted again.
+"""
+
+
+import hashlib
+import numpy as np
+
+RATING_VALUES = np.arange(1.0, 4.5 + 0.25, 0.5) # 1, 1.5, ..., 4.5
+
+
+def training_fingerprint(training) -> str:
+    return hashlib.sha256(np.ascontiguousarray(training).tobytes()).hexdigest()
+
+
+class RatingLookupTable:
+    """
+    P(1)/P(0) of every (option_1, option_2) pair of the rating grid
+    """
+
+    def __init__(self, predict, fingerprint: str, values=RATING_VALUES):
+        """
+        :param predict: callable queries -> array of shape (number of queries, 2),
+        called once with the whole grid and later for the queries outside of it
+        :param fingerprint: training_fingerprint of the training set
+        :param values: sorted, evenly spaced rating values
+        """
+        self.predict = predict
+        self.fingerprint = fingerprint
+        self.values = np.asarray(values, dtype=np.float64)
+        self.step = self.values[1] - self.values[0]
+        grid = np.stack(np.meshgrid(self.values, self.values, indexing="ij"), axis=-1).reshape(-1, 2)
+        self.table = np.asarray(predict(grid)).reshape(len(self.values), len(self.values), 2)
+
+    def is_valid(self, training) -> bool:
+        return training_fingerprint(training) == self.fingerprint
+
+    def lookup(self, queries) -> np.ndarray:
+        """
+        :param queries: sequence of query points [[option_1, option_2], ...]
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0);
+        queries outside the grid are computed with predict
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float64))[:, :2]
+        positions = np.rint((queries - self.values[0]) / self.step).astype(np.int64)
+        on_grid = (
+            np.all((positions >= 0) & (positions < len(self.values)), axis=1)
+            & np.all(np.isclose(self.values[np.clip(positions, 0, len(self.values) - 1)], queries), axis=1)
+        )
+        probabilities = np.empty((len(queries), 2))
+        probabilities[on_grid] = self.table[positions[on_grid, 0], positions[on_grid, 1]]
+        if not on_grid.all():
+            probabilities[~on_grid] = self.predict(queries[~on_grid])
+        return probabilities
@@ -39,20 +39,74 @@ test    3.5      2         ?
 """
 
 
-from data_processing import get_dataset, normalize_dataset, normalize_test_set
+import numpy as np
+from data_processing import (
+    get_dataset,
+    normalize_dataset,
+    normalize_test_set,
+    normalize_points,
+    load_training_array,
+    iter_normalized_chunks
+)
+from model_artifact import save_artifact, load_artifact, source_description
+from lookup_table import RATING_VALUES, RatingLookupTable, training_fingerprint
+from utils.instrumentation import span
 
 
 class KnnModel:
 
-    def __init__(self, db_path, test):
+    def __init__(self, db_path=None, test=None):
         self.db_path: str = db_path
         self.test: list = test
+        self.index: AngleIndex | None = None
+        self.training: np.ndarray | None = None # normalized (option_1, option_2, choice) rows
+        self.lookup_table: RatingLookupTable | None = None
 
-    def decision(self, weight):
-        # ML model taking a decision
-        largest = max(weight)
-        index_of_largest = weight.index(largest)
-        decision = f"Option {index_of_largest+1} is better"
+    def fit(self, db_path=None, artifact_path=None):
+        """
+        Reads and normalizes the dataset once (streaming, see data_processing) and
+        sorts it by angle (see AngleIndex); afterwards predict_batch only touches the queries.
+
+        :param db_path: dataset csv file, by default the one given to the constructor
+        :param artifact_path: if given, directory where the fitted model is saved (see load)
+        """
+        self.db_path = db_path if db_path is not None else self.db_path
+        self.training = np.concatenate(list(iter_normalized_chunks(self.db_path)))
+        with span("index_build", rows=len(self.training)):
+            self.index = AngleIndex(self.training[:, :2], self.training[:, 2])
+        self.lookup_table = None # computed on the previous training set
+        if artifact_path is not None:
+            save_artifact(
+                artifact_path,
+                "KnnModel",
+                {
+                    "training": self.training,
+                    "index_angles": self.index.angles,
+                    "index_order": self.index.order,
+                },
+                source_description(self.db_path),
+            )
+        return self
+
+    @classmethod
+    def load(cls, artifact_path, test=None):
+        """
+        Returns the model saved by fit(artifact_path=...), its arrays are memory-mapped
+        """
+        arrays, metadata = load_artifact(artifact_path, "KnnModel")
+        model = cls(metadata["source"]["path"], test)
+        model.training = arrays["training"]
+        model.index = AngleIndex.from_sorted(
+            arrays["index_angles"], arrays["index_order"], model.training[:, 2]
+        )
+        return model
+
+    def decision(self, weight, labels):
+        # ML model taking a decision: the normalized weights of the points of each
+        # label are summed (P(1) and P(0)), label 1 is option 1, any other label option 2
+        p1 = sum(w for w, label in zip(weight, labels) if label == 1)
+        option = 1 if p1 >= sum(weight) - p1 else 2
+        decision = f"Option {option} is better"
         return decision
     
     def compute_weights(self, dataset, test):
@@ -82,7 +136,7 @@ class KnnModel:
         """
         weight = []
         print(f"Distances:")
-        for i in range(len(test)):
+        for i in range(len(dataset)):
             squared_euclidean_distance = (test[0]-dataset[i][0])**2 + (test[1]-dataset[i][1])**2
             weight.append(1 - 0.25*squared_euclidean_distance)
             print(f"from point {i}: {squared_euclidean_distance} with weight of {weight[i]}")
@@ -100,13 +154,214 @@ class KnnModel:
         print(f"Sum of normalized weights is {sum}")
         return weight
 
+    def precompute(self, k: int | None = None, values=RATING_VALUES) -> RatingLookupTable:
+        """
+        Evaluates every query of the rating grid in one batched pass (see lookup_table.py),
+        afterwards predict_lookup is an array lookup. Fitting again drops the table.
+
+        :param k: number of nearest neighbours voting, None for all the dataset
+        :param values: the possible ratings
+        """
+        if self.training is None:
+            self.fit()
+        self.lookup_table = RatingLookupTable(
+            lambda queries: self.predict_batch(queries, k), training_fingerprint(self.training), values
+        )
+        return self.lookup_table
+
+    def predict_lookup(self, queries) -> np.ndarray:
+        """
+        predict_batch from the precomputed table, queries outside the rating grid
+        are computed (see precompute)
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0)
+        """
+        if self.lookup_table is None:
+            raise ValueError("No lookup table: call precompute() first")
+        return self.lookup_table.lookup(queries)
+
+    def build_angle_index(self):
+        """
+        Sorts the training points by angle once (see AngleIndex), afterwards
+        predict_batch with k neighbours uses binary search instead of scanning the dataset.
+        """
+        if self.training is None:
+            dataset = load_training_array(self.db_path)
+            self.index = AngleIndex(normalize_points(dataset[:, :2]), dataset[:, 2])
+        else:
+            self.index = AngleIndex(self.training[:, :2], self.training[:, 2])
+        return self.index
+
+    def predict_batch(self, queries, k: int | None = None) -> np.ndarray:
+        """
+        Vectorized KNN on the whole dataset for many queries at once
+        (see the functions below), nothing is printed.
+
+        :param queries: sequence of query points [[option_1, option_2], ...]
+        :param k: number of nearest neighbours voting, None for all the dataset
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0)
+        """
+        with span("knn_predict", queries=len(queries), k=k):
+            if k is not None and self.index is not None:
+                return self.index.probabilities(queries, k)
+            if self.training is not None:
+                return knn_probabilities(self.training[:, :2], self.training[:, 2], queries, k)
+            dataset = load_training_array(self.db_path) # csv_load and normalization are child spans
+            return knn_probabilities(normalize_points(dataset[:, :2]), dataset[:, 2], queries, k)
+
     def run(self):
         dataset = get_dataset(self.db_path)
         dataset = normalize_dataset(dataset)
         test = normalize_test_set(self.test)
-        weight = self.compute_weights(dataset, test)
-        weight = self.weights_normalization(weight)
-        print(self.decision(weight))
+        with span("knn_predict", queries=1):
+            weight = self.compute_weights(dataset, test)
+            weight = self.weights_normalization(weight)
+        print(self.decision(weight, [row[2] for row in dataset]))
+
+
+"""
+Vectorized engine
+-----------------
+The same steps of KnnModel computed with NumPy as (queries x training points) matrices:
+squared distances, weights = 1 - sqd/4, normalized weights and the probabilities of
+each label. Label 1 is option 1, any other label is option 2 (P(0) in the quantum model).
+"""
+
 
+def squared_distances(training: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    """
+    :param training: normalized training points, shape (n, 2)
+    :param queries: normalized query points, shape (q, 2)
+    :return: squared euclidean distances, shape (q, n)
+    """
+    # |x - y|^2 = |x|^2 + |y|^2 - 2 x.y
+    sqd = (
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        + np.einsum("ij,ij->i", training, training)[None, :]
+        - 2*queries @ training.T
+    )
+    return np.maximum(sqd, 0)
 
 
+def weight_matrix(training: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    return 1 - 0.25*squared_distances(training, queries)
+
+
+def normalize_weights(weights: np.ndarray) -> np.ndarray:
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+
+def check_k(k: int):
+    """Raises ValueError unless at least one neighbour votes (k <= 0 gives nan rows)"""
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+
+
+def top_k(weights: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k largest weights of each row (nearest neighbours first), shape (q, k)
+    """
+    check_k(k)
+    k = min(k, weights.shape[1])
+    indices = np.argpartition(-weights, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(weights, indices, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(indices, order, axis=1)
+
+
+def knn_probabilities(training, labels, queries, k: int | None = None) -> np.ndarray:
+    """
+    :param training: normalized training points, shape (n, 2)
+    :param labels: training labels, shape (n,)
+    :param queries: query points (not normalized), shape (q, 2)
+    :param k: number of nearest neighbours voting, None for all the training points
+    :return: array of shape (q, 2) with the columns P(1) and P(0)
+    """
+    if k is not None:
+        check_k(k) # before computing the weight matrix
+    weights = weight_matrix(np.asarray(training, dtype=np.float64), normalize_points(queries))
+    is_option_1 = np.asarray(labels) == 1
+    if k is not None:
+        indices = top_k(weights, k)
+        weights = np.take_along_axis(weights, indices, axis=1)
+        is_option_1 = is_option_1[indices]
+    else:
+        is_option_1 = np.broadcast_to(is_option_1, weights.shape)
+    weights = normalize_weights(weights)
+    p1 = np.where(is_option_1, weights, 0).sum(axis=1)
+    return np.column_stack((p1, 1 - p1))
+
+
+class AngleIndex:
+    """
+    Nearest neighbours index for normalized 2-features data.
+
+    After normalization every point is on the unit circle, hence it is fully
+    described by its angle. For two unit vectors at angular distance d:
+        sqd = 2 - 2cos(d)  and  weight = 1 - sqd/4 = (1 + cos(d))/2
+    the weight decreases with d, so the k nearest neighbours of a query are the
+    k training points closest in angle. They are among the k points on each side of the
+    query position in the sorted angles (with wrap-around at -pi/pi), found with a
+    binary search: O(log n + k) per query instead of O(n).
+    """
+
+    def __init__(self, training: np.ndarray, labels: np.ndarray):
+        """
+        :param training: normalized training points, shape (n, 2)
+        :param labels: training labels, shape (n,)
+        """
+        angles = np.arctan2(training[:, 1], training[:, 0])
+        self.order = np.argsort(angles, kind="stable")
+        self.angles = angles[self.order]
+        self.labels = np.asarray(labels)[self.order]
+
+    @classmethod
+    def from_sorted(cls, angles: np.ndarray, order: np.ndarray, labels: np.ndarray):
+        """
+        Rebuilds a saved index without sorting again
+        :param angles: sorted angles (AngleIndex.angles)
+        :param order: AngleIndex.order
+        :param labels: training labels in the original order
+        """
+        index = cls.__new__(cls)
+        index.angles = angles
+        index.order = order
+        index.labels = np.asarray(labels)[order]
+        return index
+
+    def __len__(self):
+        return len(self.angles)
+
+    def _nearest(self, queries, k: int) -> tuple:
+        """Positions in the sorted angles and weights of the k nearest neighbours"""
+        check_k(k)
+        points = normalize_points(queries)
+        query_angles = np.arctan2(points[:, 1], points[:, 0])
+        n = len(self.angles)
+        k = min(k, n)
+        window = min(2*k, n)
+        positions = np.searchsorted(self.angles, query_angles)
+        candidates = (positions[:, None] - k + np.arange(window)[None, :]) % n
+        distances = np.abs(query_angles[:, None] - self.angles[candidates]) % (2*np.pi)
+        distances = np.minimum(distances, 2*np.pi - distances)
+        nearest = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        weights = (1 + np.cos(np.take_along_axis(distances, nearest, axis=1)))/2
+        return np.take_along_axis(candidates, nearest, axis=1), weights
+
+    def query(self, queries, k: int) -> tuple:
+        """
+        :param queries: query points (not normalized), shape (q, 2)
+        :param k: number of nearest neighbours
+        :return: (indices, weights) both of shape (q, k), nearest first; indices refer
+        to the training points order given to the constructor
+        """
+        positions, weights = self._nearest(queries, k)
+        return self.order[positions], weights
+
+    def probabilities(self, queries, k: int) -> np.ndarray:
+        """
+        :return: array of shape (q, 2) with the columns P(1) and P(0) of the k nearest neighbours
+        """
+        positions, weights = self._nearest(queries, k)
+        is_option_1 = self.labels[positions] == 1
+        weights = normalize_weights(weights)
+        p1 = np.where(is_option_1, weights, 0).sum(axis=1)
+        return np.column_stack((p1, 1 - p1))
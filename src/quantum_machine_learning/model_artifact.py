@@ -0,0 +1,70 @@
+"""
+Fitted model artifacts
+
+A fitted model (see KnnModel.fit and QuantumKnnModel.fit) is saved as a directory:
+    metadata.json   artifact version, model name, source dataset and array names
+    <name>.npy      one NumPy file per precomputed array
+load_artifact() memory-maps the arrays, hence loading is immediate and the
+prediction calls only touch the pages they read.
+"""
+
+
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+
+ARTIFACT_VERSION = 1
+METADATA_FILE = "metadata.json"
+
+
+def source_description(db_path) -> dict:
+    """Identifies the dataset a model has been fitted on"""
+    stat = os.stat(db_path)
+    return {"path": str(Path(db_path).resolve()), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def save_artifact(path, model: str, arrays: dict, source: dict | None = None) -> Path:
+    """
+    :param path: artifact directory, created if needed
+    :param model: name of the model class the arrays belong to
+    :param arrays: name -> array to save
+    :param source: description of the training dataset (see source_description)
+    :return: the artifact directory
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", np.asarray(array))
+    metadata = {
+        "version": ARTIFACT_VERSION,
+        "model": model,
+        "created": time.time(),
+        "source": source,
+        "arrays": sorted(arrays),
+    }
+    # metadata is written last: an interrupted save leaves no loadable artifact
+    with open(path / METADATA_FILE, "w") as file:
+        json.dump(metadata, file, indent=2)
+    return path
+
+
+def load_artifact(path, model: str) -> tuple:
+    """
+    :param path: artifact directory
+    :param model: expected model name
+    :return: (arrays, metadata) where arrays maps each name to a read-only memory-mapped array
+    """
+    path = Path(path)
+    with open(path / METADATA_FILE) as file:
+        metadata = json.load(file)
+    if metadata.get("version") != ARTIFACT_VERSION:
+        raise ValueError(
+            f"Artifact {path} has version {metadata.get('version')}, "
+            f"expected {ARTIFACT_VERSION}: fit the model again"
+        )
+    if metadata.get("model") != model:
+        raise ValueError(f"Artifact {path} contains a {metadata.get('model')} model, not a {model}")
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in metadata["arrays"]}
+    return arrays, metadata
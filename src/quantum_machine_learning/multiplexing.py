@@ -0,0 +1,138 @@
+"""
+Qubit multiplexing
+
+The KNN circuit uses 4 qubits and 2 classical bits, while the backends have
+127 qubits or more. Here many independent KNN circuits are tiled onto disjoint
+connected groups of 4 physical qubits of the backend coupling map, each circuit
+measuring into its own classical register. One execution of the wide circuit
+serves one query per group and the results are demultiplexed per register.
+
+The wide circuit is built from the parameterized encoder (see amplitude_encoding.py):
+group i binds the angles theta_<i>, hence it is transpiled once per backend
+and any number of queries is served by binding more parameter sets.
+"""
+
+
+import numpy as np
+from qiskit import ClassicalRegister, QuantumCircuit, QuantumRegister
+from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+from amplitude_encoding import amplitude_encoding_circuit
+from post_processing import post_selected_bit_counts
+from utils.service_provider import default_service_provider
+
+GROUP_SIZE = 4
+
+
+def _readout_error(target, qubit: int) -> float:
+    try:
+        properties = target["measure"][(qubit,)]
+    except KeyError:
+        return 0.0
+    if properties is None or properties.error is None:
+        return 0.0
+    return properties.error
+
+
+def find_qubit_groups(backend, group_size: int = GROUP_SIZE, max_groups: int | None = None) -> list:
+    """
+    Greedy search of disjoint connected groups of physical qubits.
+    Each group is grown from a free qubit by adding the free neighbour with the lowest
+    readout error; starting qubits are taken in index order, which on heavy-hex and
+    grid devices packs the groups along the rows.
+
+    :param backend: the target backend, its coupling map defines the connectivity
+    :param group_size: number of qubits per group
+    :param max_groups: stop after this number of groups
+    :return: list of groups, each one a list of physical qubit indices
+    """
+    target = default_service_provider().target(backend)
+    coupling_map = target.build_coupling_map()
+    neighbours = {qubit: set() for qubit in range(target.num_qubits)}
+    if coupling_map is not None:
+        for first, second in coupling_map.get_edges():
+            neighbours[first].add(second)
+            neighbours[second].add(first)
+    used = set()
+    groups = []
+    for start in range(target.num_qubits):
+        if start in used:
+            continue
+        group = [start]
+        while len(group) < group_size:
+            frontier = {
+                qubit for member in group for qubit in neighbours[member]
+                if qubit not in used and qubit not in group
+            }
+            if not frontier:
+                break
+            group.append(min(frontier, key=lambda qubit: (_readout_error(target, qubit), qubit)))
+        if len(group) == group_size:
+            groups.append(group)
+            used.update(group)
+            if max_groups is not None and len(groups) == max_groups:
+                break
+    return groups
+
+
+def register_name(group: int) -> str:
+    return f"c{group:03d}"
+
+
+def build_multiplexed_circuit(num_groups: int) -> QuantumCircuit:
+    """
+    num_groups copies of the parameterized KNN circuit on disjoint qubits,
+    group i uses the qubits 4i..4i+3, the register register_name(i) and the angles theta_<i>.
+    (see QuantumKnnModel.parameterized_knn_circuit for the single circuit).
+    """
+    qubits = QuantumRegister(GROUP_SIZE * num_groups, "q")
+    registers = [ClassicalRegister(2, register_name(i)) for i in range(num_groups)]
+    circuit = QuantumCircuit(qubits, *registers)
+    for i, register in enumerate(registers):
+        group = qubits[GROUP_SIZE*i:GROUP_SIZE*(i + 1)]
+        # zero padded names keep the parameters sorted by group
+        circuit.compose(amplitude_encoding_circuit(GROUP_SIZE, name=f"theta_{i:03d}"), group, inplace=True)
+        circuit.h(group[3])
+        circuit.measure(group[3], register[0])
+        circuit.measure(group[0], register[1])
+    return circuit
+
+
+def transpile_multiplexed_circuit(backend, groups: list, optimization_level: int = 1) -> QuantumCircuit:
+    """
+    Transpiles the wide circuit placing group i onto the physical qubits groups[i]
+    """
+    circuit = build_multiplexed_circuit(len(groups))
+    initial_layout = [qubit for group in groups for qubit in group]
+    pass_manager = generate_preset_pass_manager(
+        backend=backend, optimization_level=optimization_level, initial_layout=initial_layout
+    )
+    return pass_manager.run(circuit)
+
+
+def multiplexed_bindings(angles: np.ndarray, num_groups: int) -> np.ndarray:
+    """
+    Packs the angles of the queries (shape (number of queries, 15)) into parameter sets
+    of the wide circuit (shape (number of executions, num_groups*15)); query j runs in
+    execution j // num_groups on group j % num_groups. The last execution is padded
+    with copies of the last query.
+    """
+    num_executions = -(-len(angles) // num_groups)
+    padding = num_executions*num_groups - len(angles)
+    angles = np.concatenate((angles, np.repeat(angles[-1:], padding, axis=0)))
+    return angles.reshape(num_executions, num_groups*angles.shape[1])
+
+
+def demultiplex_post_selected_counts(pub_result, num_queries: int, num_groups: int) -> tuple:
+    """
+    Returns the post-selected (numerator, denominator) of each query from the result of
+    the multiplexed PUB, in the order of multiplexed_bindings, computed on the
+    BitArray of each register (see post_processing.py)
+    """
+    counts = [
+        post_selected_bit_counts(pub_result.data[register_name(group)])
+        for group in range(num_groups)
+    ]
+    # (executions, groups) flattened in C order: query j = execution*num_groups + group
+    numerator = np.stack([numerator for numerator, _ in counts], axis=1).ravel()[:num_queries]
+    denominator = np.stack([denominator for _, denominator in counts], axis=1).ravel()[:num_queries]
+    return numerator, denominator
@@ -0,0 +1,91 @@
+"""
+Post-processing of the KNN circuit measurements
+
+The circuit measures Q3 into the classical bit c0 and Q0 into c1 (see
+QuantumKnnModel.execute_knn_model_on_quantum_computer): P(1) is the probability
+of Q0 = 1 among the shots where Q3 = 0.
+
+post_selected_counts works on a counts dictionary {"c1c0": count}, the other
+functions work directly on the packed BitArray buffers with NumPy: BitArray.array
+has shape (*pub shape, shots, bytes) and stores the bits big-endian, bit b is
+bit b % 8 of the byte -1 - b // 8. No dictionary or bitstring is built,
+whatever the number of shots and parameter sets.
+"""
+
+
+import numpy as np
+
+
+def post_selected_counts(counts: dict) -> tuple:
+    """
+    Returns the numerator and denominator of P(1) from a counts dictionary
+    in the form c1c0 (see execute_knn_model_on_quantum_computer):
+        denominator: shots where Q3 = 0 ("00" and "10")
+        numerator: shots where Q3 = 0 and Q0 = 1 ("10")
+    """
+    numerator = counts.get("10", 0)
+    denominator = counts.get("00", 0) + numerator
+    return numerator, denominator
+
+
+def bit_values(bit_array, bit: int) -> np.ndarray:
+    """Values (0 or 1) of one classical bit for every shot, shape (*pub shape, shots)"""
+    return (bit_array.array[..., -1 - bit // 8] >> (bit % 8)) & 1
+
+
+def post_selected_bit_counts(bit_array, select_bit: int = 0, target_bit: int = 1) -> tuple:
+    """
+    Vectorized post_selected_counts on a BitArray
+
+    :param bit_array: measurements, e.g. pub_result.join_data()
+    :param select_bit: shots are kept when this bit is 0 (c0: Q3)
+    :param target_bit: bit counted in the numerator (c1: Q0)
+    :return: (numerator, denominator) int arrays of the pub shape
+    """
+    selected = bit_values(bit_array, select_bit) == 0
+    denominator = selected.sum(axis=-1)
+    numerator = (selected & (bit_values(bit_array, target_bit) == 1)).sum(axis=-1)
+    return numerator, denominator
+
+
+def joint_bit_counts(bit_array, bits=(0, 1)) -> np.ndarray:
+    """
+    Counts of the joint outcomes of some classical bits, shape (*pub shape, 2**len(bits)):
+    outcome index sum(value of bits[j] << j), e.g. c0 + 2*c1 for the default bits
+    """
+    outcomes = sum(bit_values(bit_array, bit).astype(np.int64) << j for j, bit in enumerate(bits))
+    one_hot = outcomes[..., None] == np.arange(2**len(bits))
+    return one_hot.sum(axis=-2)
+
+
+def joint_conditional_probabilities(joint) -> np.ndarray:
+    """
+    conditional_probabilities from the joint (c0, c1) probabilities or counts of
+    joint_bit_counts, e.g. after readout mitigation:
+    P(1) = p(c1=1, c0=0) / (p(c1=0, c0=0) + p(c1=1, c0=0))
+    """
+    joint = np.reshape(joint, (-1, 4)).astype(np.float64)
+    return conditional_probabilities(joint[:, 2], joint[:, 0] + joint[:, 2])
+
+
+def conditional_probabilities(numerator, denominator) -> np.ndarray:
+    """
+    :return: array of shape (number of queries, 2) with the columns P(1) and P(0),
+    rows without post-selected shots are set to nan
+    """
+    numerator = np.ravel(numerator).astype(np.float64)
+    denominator = np.ravel(denominator).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p1 = np.where(denominator > 0, numerator/denominator, np.nan)
+    return np.column_stack((p1, 1 - p1))
+
+
+def results_post_selected_counts(pub_results) -> tuple:
+    """
+    post_selected_bit_counts of many PUB results concatenated in the order of the
+    PUBs (each one flattened in C order)
+    """
+    counts = [post_selected_bit_counts(pub_result.join_data()) for pub_result in pub_results]
+    numerator = np.concatenate([np.ravel(numerator) for numerator, _ in counts])
+    denominator = np.concatenate([np.ravel(denominator) for _, denominator in counts])
+    return numerator, denominator
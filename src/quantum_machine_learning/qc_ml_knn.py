@@ -3,11 +3,44 @@
 
 import os
 import sys
+from contextlib import contextmanager
+from statistics import NormalDist
+import numpy as np
 from qiskit import QuantumCircuit
-from qiskit_ibm_runtime import SamplerV2 as Sampler
+from qiskit.quantum_info import Statevector
+from qiskit_ibm_runtime import SamplerV2 as Sampler, Batch, Session
 # Add the parent directory to the PYTHONPATH
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-from data_processing import get_dataset, normalize_dataset, normalize_test_set
+from data_processing import (
+    get_dataset,
+    normalize_dataset,
+    normalize_test_set,
+    normalize_points,
+    load_training_array
+)
+from model_artifact import save_artifact, load_artifact, source_description
+from lookup_table import RATING_VALUES, RatingLookupTable, training_fingerprint
+from amplitude_encoding import amplitude_encoding_circuit, encoding_angles
+from multiplexing import (
+    find_qubit_groups,
+    transpile_multiplexed_circuit,
+    multiplexed_bindings,
+    demultiplex_post_selected_counts
+)
+from post_processing import (
+    post_selected_counts,
+    post_selected_bit_counts,
+    conditional_probabilities,
+    results_post_selected_counts,
+    joint_bit_counts,
+    joint_conditional_probabilities
+)
+from utils.save_account import transpile_circuit
+from utils.job_manager import AsyncJobManager, content_key, run_job
+from utils.result_cache import CachedSampler
+from utils.aer_engine import AerEngine, default_aer_engine
+from utils.instrumentation import span, count, job_result
+from utils.readout_mitigation import ReadoutMitigator, measured_qubits
 
 
 """
@@ -171,51 +204,263 @@ To run the script, in CLI enter:
 python src/quantum_machine_learning/qc_ml_knn.py
 """
 
+EXECUTION_MODES = ("job", "batch", "session")
+
+
 class QuantumKnnModel:
     """
     A Machine Learning model trained with IBM quantum computer
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, use_result_cache: bool = True, readout_mitigator: ReadoutMitigator | None = None):
+        """
+        :param use_result_cache: identical submissions (same circuits, parameters, shots,
+        backend and calibration) return the cached result, see utils/result_cache.py.
+        The adaptive and per-shot executions are never cached.
+        :param readout_mitigator: if given, the single job executions and predict_batch
+        correct the readout errors of the measured qubits (see utils/readout_mitigation.py,
+        e.g. default_readout_mitigator()); the calibration is run once per backend
+        calibration and cached
+        """
+        self.use_result_cache = use_result_cache
+        self.readout_mitigator = readout_mitigator
+        self.execution_context = None # runtime Batch or Session, see execution_mode()
+        self.transpiled_circuits: dict = {} # parameterized circuit transpiled per backend name
+        self.training: np.ndarray | None = None # normalized case_1 and case_2 rows
+        self.training_amplitudes: np.ndarray | None = None # first 8 amplitudes (Q3 = 0)
+        self.lookup_table: RatingLookupTable | None = None
+
+    @contextmanager
+    def execution_mode(self, backend, mode: str = "batch", max_time=None):
+        """
+        Groups all the jobs submitted inside the with block:
+            mode="job": independent jobs, each one queued on its own (default outside the block)
+            mode="batch": runtime Batch, the jobs are scheduled together (batch predictions)
+            mode="session": runtime Session, dedicated backend access between jobs
+            (iterative workloads such as execute_adaptive)
+        It also works in local testing mode with fake backends.
+
+        Usage:
+        -----
+            with qc_knn_model.execution_mode(backend, "session"):
+                p1, p2 = qc_knn_model.execute_adaptive(backend, qc_transpiled)
+
+        :param max_time: maximum duration of the batch or session (seconds or e.g. "1h")
+        """
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode {mode}, use one of {EXECUTION_MODES}")
+        if mode == "job":
+            yield backend
+            return
+        context_class = Batch if mode == "batch" else Session
+        with context_class(backend=backend, max_time=max_time) as context:
+            self.execution_context = context
+            try:
+                yield context
+            finally:
+                self.execution_context = None
+
+    def _sampler_mode(self, backend):
+        return self.execution_context if self.execution_context is not None else backend
+
+    def sampler(self, backend):
+        sampler = Sampler(mode=self._sampler_mode(backend))
+        return CachedSampler(sampler) if self.use_result_cache else sampler
+
+    def _post_selected_probabilities(self, backend, circuits, pub_results) -> np.ndarray:
+        """
+        P(1)/P(0) of the PUB results of the circuits, corrected with the readout
+        calibration of the measured qubits of each circuit when mitigation is enabled
+        :return: array of shape (number of queries, 2), PUBs flattened in C order
+        """
+        if self.readout_mitigator is None:
+            return conditional_probabilities(*results_post_selected_counts(pub_results))
+        return np.concatenate([
+            self._joint_probabilities(backend, circuit, joint_bit_counts(pub_result.join_data()))
+            for circuit, pub_result in zip(circuits, pub_results)
+        ])
+
+    def _joint_probabilities(self, backend, circuit, joint) -> np.ndarray:
+        """
+        P(1)/P(0) of the joint (c0, c1) counts of a circuit (see joint_bit_counts),
+        corrected with the readout calibration of its measured qubits when mitigation is enabled
+        """
+        if self.readout_mitigator is not None:
+            calibration = self.readout_mitigator.calibration(
+                backend, measured_qubits(circuit), Sampler(mode=self._sampler_mode(backend))
+            )
+            with span("readout_mitigation"):
+                joint = calibration.apply(joint)
+        return joint_conditional_probabilities(joint)
+
+    @staticmethod
+    def _submit(sampler, pubs, shots: int, queries: int = 1):
+        """sampler.run(pubs, shots=shots) recorded as the job_submission stage"""
+        count("jobs_submitted")
+        count("shots", shots * queries)
+        with span("job_submission", pubs=len(pubs), shots=shots) as submission:
+            job = sampler.run(pubs, shots=shots)
+            submission.set(job_id=job.job_id())
+        return job
+
+    def fit(self, db_path, artifact_path=None):
+        """
+        Reads and normalizes the training cases once and precomputes the training half
+        of the state vector (Q3 = 0, see point 9.), afterwards the state vectors are built
+        from the queries only (pass db_path=None to compute_initial_states and predict_batch).
+
+        :param db_path: path of the training dataset csv file
+        :param artifact_path: if given, directory where the fitted model is saved (see load)
+        """
+        self.training = normalize_points(load_training_array(db_path)[:2, :2])
+        self.training_amplitudes = training_amplitudes(self.training)
+        self.lookup_table = None # computed on the previous training set
+        if artifact_path is not None:
+            save_artifact(
+                artifact_path,
+                "QuantumKnnModel",
+                {"training": self.training, "training_amplitudes": self.training_amplitudes},
+                source_description(db_path),
+            )
+        return self
+
+    @classmethod
+    def load(cls, artifact_path):
+        """
+        Returns the model saved by fit(artifact_path=...), its arrays are memory-mapped
+        """
+        arrays, _ = load_artifact(artifact_path, "QuantumKnnModel")
+        model = cls()
+        model.training = arrays["training"]
+        model.training_amplitudes = arrays["training_amplitudes"]
+        return model
+
+    def precompute(self, method: str = "exact", values=RATING_VALUES, **options) -> RatingLookupTable:
+        """
+        Evaluates every query of the rating grid of the fitted model in one batched
+        predict_batch call (see lookup_table.py), afterwards predict_lookup is an array
+        lookup. Fitting again drops the table.
+
+        :param method: predict_batch method, "exact", "statevector", "aer" or "sampler"
+        :param values: the possible ratings
+        :param options: other predict_batch arguments (backend, shots, encoder, engine)
+        """
+        if self.training is None:
+            raise ValueError("The model is not fitted: call fit(db_path) first")
+        self.lookup_table = RatingLookupTable(
+            lambda queries: self.predict_batch(None, queries, method=method, **options),
+            training_fingerprint(self.training),
+            values
+        )
+        return self.lookup_table
+
+    def predict_lookup(self, queries) -> np.ndarray:
+        """
+        predict_batch from the precomputed table, queries outside the rating grid
+        are computed with the same method (see precompute)
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0)
+        """
+        if self.lookup_table is None:
+            raise ValueError("No lookup table: call precompute() first")
+        return self.lookup_table.lookup(queries)
 
     def compute_initial_state(self, db_path, test_set) -> list:
+        if db_path is None: # fitted model, see fit()
+            return self.compute_initial_states(None, [test_set])[0].tolist()
         dataset = normalize_dataset(get_dataset(db_path))
         test = normalize_test_set(test_set)
-        initial_state = [ 
-            0,
-            dataset[0][0]/2,
-            0,
-            dataset[0][1]/2,
-            dataset[1][0]/2,
-            0,
-            dataset[1][1]/2,
-            0,
-            0,
-            test[0]/2,
-            0,
-            test[1]/2,
-            test[0]/2,
-            0,
-            test[1]/2,
-            0
-        ]
+        with span("state_encoding", queries=1):
+            initial_state = [ 
+                0,
+                dataset[0][0]/2,
+                0,
+                dataset[0][1]/2,
+                dataset[1][0]/2,
+                0,
+                dataset[1][1]/2,
+                0,
+                0,
+                test[0]/2,
+                0,
+                test[1]/2,
+                test[0]/2,
+                0,
+                test[1]/2,
+                0
+            ]
         return initial_state
 
+    def compute_initial_states(self, db_path, queries) -> np.ndarray:
+        """
+        Batched version of compute_initial_state: the dataset is read and
+        normalized once and one 16 amplitudes state vector is built per query.
+
+        :param db_path: path of the training dataset csv file, None to use the fitted model
+        :param queries: sequence of query points [[e, f], ...]
+        :return: array of shape (number of queries, 16)
+        """
+        if db_path is None:
+            if self.training_amplitudes is None:
+                raise ValueError("The model is not fitted: call fit(db_path) or pass a db_path")
+            amplitudes = self.training_amplitudes
+        else:
+            amplitudes = training_amplitudes(normalize_dataset(get_dataset(db_path)))
+        tests = normalize_points(queries)
+        with span("state_encoding", queries=len(tests)):
+            initial_states = np.zeros((len(tests), 16))
+            initial_states[:, :8] = amplitudes
+            initial_states[:, [9, 12]] = tests[:, [0]]/2
+            initial_states[:, [11, 14]] = tests[:, [1]]/2
+        return initial_states
+
     def knn_quantum_circuit(self, initial_state):
         """
         Initialize the 4 quibits Q3Q2Q1Q0 state vector with amplitude encoding
         see point 13. in the docstring. Here the vector has also been multiplied
         by the factor 1/2 from the 4qubits Hadamard operator.
         """
-        circuit = QuantumCircuit(4,2) # 4 qubits, 2 classical
-        circuit.initialize(initial_state)
-        circuit.h(3) # add Hadamart gate on qubit 3; 
-        circuit.measure(3,0) # Qubit Q3 measured value is stored into classical bit 0 
-        circuit.measure(0,1) # Qubit Q0 measured value is stored into classical bit 1
+        with span("circuit_build"):
+            circuit = QuantumCircuit(4,2) # 4 qubits, 2 classical
+            circuit.initialize(initial_state)
+            circuit.h(3) # add Hadamart gate on qubit 3; 
+            circuit.measure(3,0) # Qubit Q3 measured value is stored into classical bit 0 
+            circuit.measure(0,1) # Qubit Q0 measured value is stored into classical bit 1
         return circuit
 
-    def execute_knn_model_on_quantum_computer(self, backend, qc_transpiled):
+    def parameterized_knn_circuit(self) -> QuantumCircuit:
+        """
+        Same circuit as knn_quantum_circuit where circuit.initialize is replaced by
+        the fixed RY/CX amplitude encoding tree (see amplitude_encoding.py).
+        The 15 angles are circuit Parameters, bind them with encoding_angles(initial_states).
+        """
+        with span("circuit_build", parameterized=True):
+            circuit = QuantumCircuit(4,2) # 4 qubits, 2 classical
+            circuit.compose(amplitude_encoding_circuit(4), inplace=True)
+            circuit.h(3) # add Hadamart gate on qubit 3;
+            circuit.measure(3,0) # Qubit Q3 measured value is stored into classical bit 0
+            circuit.measure(0,1) # Qubit Q0 measured value is stored into classical bit 1
+        return circuit
+
+    def transpile_parameterized_circuit(self, backend=None):
+        """
+        Transpiles the parameterized KNN circuit once per backend,
+        later calls for the same backend return the stored transpiled circuit.
+        """
+        if backend is not None and backend.name in self.transpiled_circuits:
+            return backend, self.transpiled_circuits[backend.name]
+        backend, qc_transpiled = transpile_circuit(self.parameterized_knn_circuit(), backend=backend)
+        self.transpiled_circuits[backend.name] = qc_transpiled
+        return backend, qc_transpiled
+
+    def execute_knn_model_on_quantum_computer(
+            self,
+            backend,
+            qc_transpiled,
+            shots: int = 50,
+            per_shot_jobs: bool = False,
+            journal_path=None,
+            job_loader=None
+            ):
         """
         Execute on a Quantum Computer using the Sampler primitive
         Getting counts for separate registers
@@ -230,25 +475,41 @@ class QuantumKnnModel:
         and a denominator for the probability formula
         denominator is counted only when Q3 is zero (see explanation point 13.)
         under this condition the numerator is counted 
+
+        By default all the shots are sent in a single Sampler job, polled by
+        utils.job_manager.AsyncJobManager, and the probabilities are computed from the
+        joint (Q3, Q0) counts of that one result. With a journal_path a crashed run started
+        again retrieves the submitted job (job_loader) or its counts instead of submitting
+        again. With a readout_mitigator (see __init__) the joint distribution is corrected
+        before the post-selection, not in the per_shot_jobs mode.
+
+        :param backend: the backend the transpiled circuit has been built for
+        :param qc_transpiled: the KNN circuit transpiled for the backend
+        :param shots: number of shots used to estimate the probabilities
+        :param per_shot_jobs: compatibility mode, submit one single-shot job per shot
+        (one queue round trip each) as the original implementation did
+        :param journal_path: JSON lines journal of the job ID and counts, see predict_concurrent
+        :param job_loader: callable job_id -> job, by default the runtime service of the backend
+        :return p1, p2: probabilities P(1) and P(0) of Q0 post-selected on Q3 = 0
         """
-    
-        shots = 1
-        sampler = Sampler(mode=backend)
-        sampler.options.default_shots = shots  # Options can be set using auto-complete.
-        numerator = 0
-        denominator = 0
-        shots = 50
-        job_cnt = 0
-        for i in range(shots):
-            job = sampler.run([qc_transpiled])
-            job_cnt+=1
-            print(f"Job ID: {job.job_id()} | number: {job_cnt} | status: {job.status()}")
-            result = job.result()[0]
-            counts = result.join_data().get_counts()
-            if ("00" in counts or "10" in counts):
-                denominator += 1  # Increment denominator if condition is met
-                if "10" in counts :
-                    numerator += 1  # Increment numerator
+        if per_shot_jobs:
+            numerator, denominator = self._execute_per_shot_jobs(backend, qc_transpiled, shots)
+        else:
+            sampler = self.sampler(backend)
+            sampler.options.default_shots = shots
+            count("shots", shots)
+            # the journal keeps only the joint (c0, c1) counts
+            joint = np.array(run_job(
+                sampler, [qc_transpiled], journal_path=journal_path,
+                key=content_key("knn", backend, qc_transpiled, shots), job_loader=job_loader,
+                serialize=lambda result: joint_bit_counts(result[0].join_data()).tolist(), shots=shots
+            ))
+            with span("post_processing"):
+                p1, p2 = self._joint_probabilities(backend, qc_transpiled, joint)[0]
+            if np.isnan(p1):
+                print("Division by zero detected in probability formula")
+                return None
+            return p1, p2
 
         # for bitstring, count in counts.items():
         #     print(f"{bitstring}: {count}")
@@ -270,3 +531,339 @@ class QuantumKnnModel:
         else:
             print("Division by zero detected in probability formula")
 
+    def execute_adaptive(
+            self,
+            backend,
+            qc_transpiled,
+            initial_shots: int = 32,
+            max_shots: int = 4096,
+            growth: float = 2,
+            alpha: float = 0.01
+            ):
+        """
+        Adaptive version of execute_knn_model_on_quantum_computer: shots are submitted in
+        growing batches (initial_shots, initial_shots*growth, ...) and after each batch the
+        Wilson score interval of the post-selected P(1) is updated. Execution stops as soon
+        as the interval is entirely above or below 1/2, i.e. the decision P(1) >= P(0) is
+        settled, or when max_shots have been used.
+        Easy queries stop after a few shots, ambiguous ones get up to max_shots.
+        The interval is checked after every batch: alpha is split between the checks
+        (Bonferroni correction), the probability of a wrong early decision stays below alpha.
+        The number of shots spent is stored in self.shots_used.
+
+        :param initial_shots: shots of the first batch, at least 1
+        :param max_shots: shots budget, at least 1
+        :param growth: batch size factor, at least 1
+        :param alpha: error rate of the decision (0.01 -> 99% confidence)
+        :return p1, p2: probabilities P(1) and P(0) of Q0 post-selected on Q3 = 0
+        """
+        schedule = adaptive_schedule(initial_shots, max_shots, growth)
+        if not 0 < alpha < 1:
+            raise ValueError(f"alpha must be in (0, 1), got {alpha}")
+        z = NormalDist().inv_cdf(1 - alpha / (2 * len(schedule)))
+        sampler = Sampler(mode=self._sampler_mode(backend))
+        numerator = 0
+        denominator = 0
+        self.shots_used = 0
+        for batch_shots in schedule:
+            job = self._submit(sampler, [qc_transpiled], shots=batch_shots)
+            result = job_result(job)[0]
+            with span("post_processing"):
+                batch_numerator, batch_denominator = post_selected_bit_counts(result.join_data())
+            numerator += batch_numerator
+            denominator += batch_denominator
+            self.shots_used += batch_shots
+            lower, upper = wilson_interval(numerator, denominator, z)
+            print(f"Job ID: {job.job_id()} | shots: {self.shots_used} | P(1) in [{lower:.3f}, {upper:.3f}]")
+            if lower > 0.5 or upper < 0.5:
+                break
+        if denominator !=0:
+            p1 = numerator/denominator
+            return p1, 1 - p1
+        else:
+            print("Division by zero detected in probability formula")
+
+    def predict_batch(
+            self,
+            db_path,
+            queries,
+            backend=None,
+            shots: int = 50,
+            encoder: str = "initialize",
+            method: str = "sampler",
+            engine: AerEngine | None = None
+            ) -> np.ndarray:
+        """
+        Classify many query points with a single Sampler submission.
+        With method="exact" or method="statevector" nothing is submitted, see
+        exact_probabilities and statevector_probabilities; method="aer" simulates
+        the circuit locally, see predict_local.
+
+        encoder="initialize": one KNN circuit is built per query with circuit.initialize,
+        all the circuits are transpiled in one pass manager run and submitted together
+        as a list of PUBs.
+        encoder="ry_tree": the parameterized circuit is transpiled once per backend and
+        submitted as one PUB binding the encoding angles of every query.
+
+        :param db_path: path of the training dataset csv file, None to use the fitted model
+        :param queries: sequence of query points [[e, f], ...]
+        :param backend: target backend, if None the least busy one is used
+        :param shots: number of shots per query
+        :param encoder: state preparation, "initialize" or "ry_tree"
+        :param method: "sampler" (backend execution), "aer", "exact" or "statevector"
+        :param engine: local engine of method="aer", by default the shared engine
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0),
+        rows without post-selected shots are set to nan
+        """
+        if method == "exact":
+            return self.exact_probabilities(db_path, queries)
+        if method == "statevector":
+            return self.statevector_probabilities(db_path, queries)
+        if method == "aer":
+            return self.predict_local(db_path, queries, shots=shots, engine=engine)
+        if method != "sampler":
+            raise ValueError(f"Unknown method {method}, use 'sampler', 'aer', 'exact' or 'statevector'")
+        initial_states = self.compute_initial_states(db_path, queries)
+        if encoder == "initialize":
+            circuits = [self.knn_quantum_circuit(state) for state in initial_states]
+            # one circuit per query state, never transpiled again: kept out of the disk cache
+            backend, circuits_transpiled = transpile_circuit(circuits, backend=backend, persist=False)
+            pubs = circuits_transpiled
+        elif encoder == "ry_tree":
+            backend, qc_transpiled = self.transpile_parameterized_circuit(backend)
+            with span("state_encoding", encoder=encoder, queries=len(initial_states)):
+                angles = encoding_angles(initial_states)
+            pubs = [(qc_transpiled, angles)]
+        else:
+            raise ValueError(f"Unknown encoder {encoder}, use 'initialize' or 'ry_tree'")
+        sampler = self.sampler(backend)
+        sampler.options.default_shots = shots
+        job = self._submit(sampler, pubs, shots=shots, queries=len(initial_states))
+        print(f"Job ID: {job.job_id()} | queries: {len(initial_states)} | status: {job.status()}")
+        result = job_result(job)
+        # one PUB per query (initialize) or one PUB with one parameter set per query (ry_tree)
+        circuits = [pub[0] if isinstance(pub, tuple) else pub for pub in pubs]
+        with span("post_processing", queries=len(initial_states)):
+            return self._post_selected_probabilities(backend, circuits, result)
+
+    def predict_local(self, db_path, queries, shots: int = 50, engine: AerEngine | None = None) -> np.ndarray:
+        """
+        predict_batch(encoder="ry_tree") on the local Aer simulator (utils/aer_engine.py):
+        the parameterized circuit is transpiled once for Aer and the encoding angles
+        are split into chunks sampled by a pool of worker processes, each chunk with
+        batched parameter binds. The workers return only the post-selected counts.
+
+        :param engine: process and thread configuration, by default the shared engine
+        with one process per core (default_aer_engine)
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0),
+        rows without post-selected shots are set to nan
+        """
+        engine = engine if engine is not None else default_aer_engine()
+        _, qc_transpiled = self.transpile_parameterized_circuit(engine.backend())
+        initial_states = self.compute_initial_states(db_path, queries)
+        with span("state_encoding", encoder="ry_tree", queries=len(initial_states)):
+            angles = encoding_angles(initial_states)
+        count("shots", shots * len(angles))
+        with span("execution", engine="aer", queries=len(angles), processes=engine.processes):
+            counts = engine.sample(qc_transpiled, angles, shots=shots, reduce=post_selected_bit_counts)
+        print(f"Aer | queries: {len(angles)} | processes: {engine.processes} | threads: {engine.threads}")
+        with span("post_processing", queries=len(angles)):
+            return conditional_probabilities(
+                np.concatenate([numerator for numerator, _ in counts]),
+                np.concatenate([denominator for _, denominator in counts])
+            )
+
+    def predict_multiplexed(
+            self,
+            db_path,
+            queries,
+            backend,
+            shots: int = 50,
+            max_groups: int | None = None
+            ) -> np.ndarray:
+        """
+        Like predict_batch but packing many queries into each execution: the KNN circuit
+        is tiled onto disjoint groups of 4 connected qubits of the backend (see
+        multiplexing.py), each group with its own classical register. A 127 qubits
+        backend serves about 30 queries per shot instead of one.
+
+        :param db_path: path of the training dataset csv file, None to use the fitted model
+        :param queries: sequence of query points [[e, f], ...]
+        :param backend: target backend, its coupling map defines the qubit groups
+        :param shots: number of shots per query
+        :param max_groups: limit of queries packed into one execution
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0),
+        rows without post-selected shots are set to nan
+        """
+        key = (backend.name, "multiplexed", max_groups)
+        if key not in self.transpiled_circuits:
+            groups = find_qubit_groups(backend, max_groups=max_groups)
+            self.transpiled_circuits[key] = (len(groups), transpile_multiplexed_circuit(backend, groups))
+        num_groups, qc_transpiled = self.transpiled_circuits[key]
+        initial_states = self.compute_initial_states(db_path, queries)
+        with span("state_encoding", encoder="ry_tree", queries=len(initial_states)):
+            angles = encoding_angles(initial_states)
+        sampler = self.sampler(backend)
+        job = self._submit(
+            sampler, [(qc_transpiled, multiplexed_bindings(angles, num_groups))], shots=shots, queries=len(angles)
+        )
+        print(f"Job ID: {job.job_id()} | queries: {len(angles)} | groups: {num_groups} | status: {job.status()}")
+        result = job_result(job)[0]
+        with span("post_processing", queries=len(angles)):
+            return conditional_probabilities(
+                *demultiplex_post_selected_counts(result, len(angles), num_groups)
+            )
+
+    def predict_concurrent(
+            self,
+            db_path,
+            queries,
+            backend,
+            shots: int = 50,
+            batch_size: int = 1000,
+            journal_path=None,
+            max_concurrency: int = 4,
+            job_loader=None
+            ) -> np.ndarray:
+        """
+        Like predict_batch(encoder="ry_tree") for workloads too large for one job:
+        the queries are split into batches of batch_size, each batch is one job and the
+        jobs are submitted and polled concurrently by utils.job_manager.AsyncJobManager.
+        With a journal_path a crashed run started again with the same queries does not
+        submit the completed batches again; the journal keys hash the transpiled circuit,
+        the encoding angles of the batch and the shots.
+
+        :param journal_path: JSON lines journal of the job IDs and results
+        :param max_concurrency: maximum number of jobs in flight
+        :param job_loader: callable job_id -> job (e.g. QiskitRuntimeService.job) to
+        retrieve the jobs submitted before a crash
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0),
+        rows without post-selected shots are set to nan
+        """
+        backend, qc_transpiled = self.transpile_parameterized_circuit(backend)
+        angles = encoding_angles(self.compute_initial_states(db_path, queries))
+        # the journal keys identify the batch content: a run with other queries, shots,
+        # backend or training set never resumes the results of a previous run
+        batches = {}
+        for start in range(0, len(angles), batch_size):
+            batch_angles = angles[start:start + batch_size]
+            key = content_key(
+                f"queries_{start}_{start + len(batch_angles)}", backend, qc_transpiled, batch_angles, shots
+            )
+            batches[key] = [(qc_transpiled, batch_angles)]
+        manager = AsyncJobManager(
+            self.sampler(backend),
+            journal_path=journal_path,
+            max_concurrency=max_concurrency,
+            job_loader=job_loader,
+            # the journal keeps only the post-selected numerators and denominators
+            serialize=lambda result: np.stack(results_post_selected_counts(result)).tolist()
+        )
+        count("shots", shots * len(angles))
+        # submission, queue wait and execution overlap between the jobs
+        with span("execution", jobs=len(batches), queries=len(angles)):
+            results = manager.run(batches, shots=shots)
+        with span("post_processing", queries=len(angles)):
+            numerator, denominator = np.concatenate([results[key] for key in batches], axis=1)
+            return conditional_probabilities(numerator, denominator)
+
+    def exact_probabilities(self, db_path, queries) -> np.ndarray:
+        """
+        Analytic P(1) of the circuit, see point 14. of the module docstring:
+            P(1) = (1 + ae + bf) / (2 + ae + bf + ce + df)
+        computed for all the queries at once (no circuit, no sampling).
+
+        :param db_path: path of the training dataset csv file, None to use the fitted model
+        :param queries: sequence of query points [[e, f], ...]
+        :return: array of shape (number of queries, 2) with the columns P(1) and P(0)
+        """
+        if db_path is None:
+            if self.training is None:
+                raise ValueError("The model is not fitted: call fit(db_path) or pass a db_path")
+            training = np.asarray(self.training)
+        else:
+            training = normalize_points(load_training_array(db_path)[:2, :2])
+        dots = normalize_points(queries) @ training.T # columns ae + bf and ce + df
+        p1 = (1 + dots[:, 0]) / (2 + dots[:, 0] + dots[:, 1])
+        return np.column_stack((p1, 1 - p1))
+
+    def statevector_probabilities(self, db_path, queries) -> np.ndarray:
+        """
+        P(1) from the exact simulation of knn_quantum_circuit (qiskit Statevector):
+        probabilities of (Q3, Q0) post-selected on Q3 = 0. It validates the circuit
+        against exact_probabilities without any backend.
+        """
+        probabilities = []
+        for initial_state in self.compute_initial_states(db_path, queries):
+            circuit = self.knn_quantum_circuit(initial_state)
+            circuit.remove_final_measurements()
+            # qargs [0, 3]: index = 2*Q3 + Q0
+            p = Statevector(circuit).probabilities([0, 3])
+            probabilities.append((p[1], p[0]) / (p[0] + p[1]))
+        return np.array(probabilities).reshape(-1, 2)
+
+    def _execute_per_shot_jobs(self, backend, qc_transpiled, shots: int):
+        """
+        Legacy execution: one single-shot Sampler job per shot, each one blocking
+        on its own result. Kept only for comparison with the original runs
+        recorded in tests_console_log.md.
+        """
+        sampler = Sampler(mode=self._sampler_mode(backend))
+        sampler.options.default_shots = 1
+        numerator = 0
+        denominator = 0
+        job_cnt = 0
+        for i in range(shots):
+            job = self._submit(sampler, [qc_transpiled], shots=1)
+            job_cnt+=1
+            print(f"Job ID: {job.job_id()} | number: {job_cnt} | status: {job.status()}")
+            result = job_result(job)[0]
+            counts = result.join_data().get_counts()
+            shot_numerator, shot_denominator = post_selected_counts(counts)
+            numerator += shot_numerator
+            denominator += shot_denominator
+        return numerator, denominator
+
+
+def training_amplitudes(training) -> np.ndarray:
+    """
+    First half (Q3 = 0) of the state vector, see point 9.:
+    [0, a, 0, b, c, 0, d, 0]/2 for the normalized cases (a, b) and (c, d)
+    """
+    amplitudes = np.zeros(8)
+    amplitudes[[1, 3, 4, 6]] = np.array([
+        training[0][0], training[0][1], training[1][0], training[1][1]
+    ])/2
+    return amplitudes
+
+
+def adaptive_schedule(initial_shots: int, max_shots: int, growth: float) -> list:
+    """
+    Shots of each batch of execute_adaptive: initial_shots, initial_shots*growth, ...
+    until max_shots, every batch has at least 1 shot
+    """
+    if initial_shots < 1 or max_shots < 1:
+        raise ValueError(f"initial_shots and max_shots must be at least 1, got {initial_shots} and {max_shots}")
+    if growth < 1:
+        raise ValueError(f"growth must be at least 1, got {growth}")
+    schedule = []
+    total = 0
+    batch_shots = initial_shots
+    while total < max_shots:
+        schedule.append(max(1, min(int(batch_shots), max_shots - total)))
+        total += schedule[-1]
+        batch_shots *= growth
+    return schedule
+
+
+def wilson_interval(successes: int, trials: int, z: float = 2.576) -> tuple:
+    """
+    Wilson score confidence interval of a binomial proportion,
+    (0, 1) when there are no trials
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    proportion = successes/trials
+    center = (proportion + z**2/(2*trials)) / (1 + z**2/trials)
+    half_width = z*np.sqrt(proportion*(1 - proportion)/trials + z**2/(4*trials**2)) / (1 + z**2/trials)
+    return center - half_width, center + half_width
@@ -1,7 +1,14 @@
+import argparse
+import os
+import sys
 from pathlib import Path
-from ml_knn import KnnModel
-from qc_ml_knn import QuantumKnnModel
-from utils.save_account import transpile_circuit
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utils.instrumentation import default_instrumentation
+
+# the models are imported by the branches using them: the classic model and --help
+# do not import qiskit (see qc_ml_knn.EXECUTION_MODES for the execution modes)
+EXECUTION_MODES = ("job", "batch", "session")
 
 if __name__ == "__main__":
     """
@@ -11,23 +18,75 @@ if __name__ == "__main__":
         [4.5, 3, 1],
         [1, 1.5, 2]
     ]
+
+    Usage:
+    -----
+    python src/quantum_machine_learning/run_models.py --execution session --adaptive
+    python src/quantum_machine_learning/run_models.py --models classic
     """
+    parser = argparse.ArgumentParser(description="Run the classic and quantum Knn Models")
+    parser.add_argument(
+        "--models", choices=("classic", "quantum", "both"), default="both",
+        help="models to run, the classic one does not import qiskit"
+    )
+    parser.add_argument(
+        "--execution", choices=EXECUTION_MODES, default="job",
+        help="submit independent jobs, or group them in a runtime Batch or Session"
+    )
+    parser.add_argument("--shots", type=int, default=50, help="shots of the quantum execution")
+    parser.add_argument(
+        "--adaptive", action="store_true",
+        help="submit shots in growing batches until the decision is settled (up to --adaptive-max-shots)"
+    )
+    parser.add_argument(
+        "--adaptive-max-shots", type=int, default=4096, help="shots budget of the adaptive execution"
+    )
+    parser.add_argument(
+        "--mitigate-readout", action="store_true",
+        help="correct the readout errors with a calibration cached per backend calibration"
+    )
+    parser.add_argument(
+        "--instrumentation", action="store_true",
+        help="print the time spent in each stage (see utils/instrumentation.py)"
+    )
+    args = parser.parse_args()
+    if args.instrumentation:
+        default_instrumentation().enable()
+
     current_dir = Path(__file__).parent
     db_path = current_dir / "dataset.csv"
     test_set = [3.5, 2]
 
-    print("Running classic Knn Model")
-    ml_model_inst = KnnModel(db_path, test_set)
-    ml_model_inst.run()
+    if args.models in ("classic", "both"):
+        from ml_knn import KnnModel
+        print("Running classic Knn Model")
+        ml_model_inst = KnnModel(db_path, list(test_set))
+        ml_model_inst.run()
 
-    print("Running quantum Knn Model")
-    qc_knn_model = QuantumKnnModel()
-    initial_state = qc_knn_model.compute_initial_state(db_path, test_set)
-    circuit = qc_knn_model.knn_quantum_circuit(initial_state)
-    backend, qc_transpiled = transpile_circuit(circuit)
-    p1, p2 = qc_knn_model.execute_knn_model_on_quantum_computer(backend, qc_transpiled)
-    print(f"P(1) = {p1}, P(0)={p2}")
-    if p1>=p2:
-        print("Option 1 is better")
-    else:
-        print("Option 2 is better")
\ No newline at end of file
+    if args.models in ("quantum", "both"):
+        from qc_ml_knn import QuantumKnnModel
+        from utils.save_account import transpile_circuit
+        from utils.readout_mitigation import default_readout_mitigator
+        print("Running quantum Knn Model")
+        qc_knn_model = QuantumKnnModel(
+            readout_mitigator=default_readout_mitigator() if args.mitigate_readout else None
+        )
+        initial_state = qc_knn_model.compute_initial_state(db_path, list(test_set))
+        circuit = qc_knn_model.knn_quantum_circuit(initial_state)
+        backend, qc_transpiled = transpile_circuit(circuit)
+        with qc_knn_model.execution_mode(backend, args.execution):
+            if args.adaptive:
+                p1, p2 = qc_knn_model.execute_adaptive(
+                    backend, qc_transpiled, max_shots=args.adaptive_max_shots
+                )
+            else:
+                p1, p2 = qc_knn_model.execute_knn_model_on_quantum_computer(
+                    backend, qc_transpiled, shots=args.shots
+                )
+        print(f"P(1) = {p1}, P(0)={p2}")
+        if p1>=p2:
+            print("Option 1 is better")
+        else:
+            print("Option 2 is better")
+    if default_instrumentation().enabled:
+        default_instrumentation().print_summary()
@@ -0,0 +1,168 @@
+"""
+Streaming batch scoring of query rows
+
+The query rows (option_1, option_2[, other columns ignored]) are read from a csv file
+or stdin, grouped into micro-batches and each batch is dispatched to the selected engine:
+    -   classical: KnnModel.predict_batch (k nearest neighbours or all the dataset)
+    -   exact: analytic probabilities of the quantum circuit
+    -   simulator: QuantumKnnModel.predict_batch on the local Aer simulator
+    -   hardware: QuantumKnnModel.predict_batch on the least busy IBM backend
+At most max_in_flight batches are dispatched at a time and the predictions are written
+in the input order as soon as the batches complete: the query file is never held in
+memory, only (max_in_flight + 1) batches are.
+
+Output rows: option_1,option_2,p1,p0,prediction (1: option_1, 2: option_2, empty when
+no shot was post-selected).
+
+Usage:
+-----
+    python src/quantum_machine_learning/score_queries.py queries.csv --engine classical --k 5
+    cat queries.csv | python src/quantum_machine_learning/score_queries.py - --engine simulator \\
+        --batch-size 256 --max-in-flight 4 --output predictions.csv
+"""
+
+
+import argparse
+import contextlib
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from utils.instrumentation import default_instrumentation, span, count
+
+ENGINES = ("classical", "exact", "simulator", "hardware")
+DEFAULT_DB_PATH = Path(__file__).parent / "dataset.csv"
+
+
+def iter_query_batches(lines, batch_size: int = 256):
+    """
+    Yields float64 arrays of shape (at most batch_size, 2) from csv lines,
+    empty lines and a non numeric header line are skipped
+    """
+    batch = []
+    for number, line in enumerate(lines):
+        if not line.strip():
+            continue
+        fields = line.strip().split(",")
+        try:
+            batch.append((float(fields[0]), float(fields[1])))
+        except (ValueError, IndexError):
+            if number == 0:
+                continue # header
+            raise ValueError(f"Line {number + 1} is not a query row: {line.strip()!r}")
+        if len(batch) == batch_size:
+            yield np.array(batch)
+            batch = []
+    if batch:
+        yield np.array(batch)
+
+
+def format_predictions(queries: np.ndarray, probabilities: np.ndarray) -> str:
+    rows = []
+    for (option_1, option_2), (p1, p0) in zip(queries, probabilities):
+        prediction = "" if np.isnan(p1) else (1 if p1 >= p0 else 2)
+        rows.append(f"{option_1:g},{option_2:g},{p1:.6f},{p0:.6f},{prediction}\n")
+    return "".join(rows)
+
+
+def build_predict(engine: str, db_path=DEFAULT_DB_PATH, shots: int = 1000, k: int | None = None):
+    """
+    Returns the callable queries -> array (number of queries, 2) with the columns
+    P(1) and P(0) of the engine; the models are fitted (and the quantum circuit
+    transpiled) once here, not per batch
+    """
+    if engine == "classical":
+        from ml_knn import KnnModel
+        model = KnnModel().fit(db_path)
+        return lambda queries: model.predict_batch(queries, k=k)
+    from qc_ml_knn import QuantumKnnModel
+    model = QuantumKnnModel(use_result_cache=False)
+    model.fit(db_path)
+    if engine == "exact":
+        return lambda queries: model.predict_batch(None, queries, method="exact")
+    if engine == "simulator":
+        from qiskit_aer import AerSimulator
+        backend = AerSimulator()
+    elif engine == "hardware":
+        backend = None # least busy backend
+    else:
+        raise ValueError(f"Unknown engine {engine}, use one of {ENGINES}")
+    backend, _ = model.transpile_parameterized_circuit(backend)
+    return lambda queries: model.predict_batch(
+        None, queries, backend=backend, shots=shots, encoder="ry_tree"
+    )
+
+
+def score_stream(lines, output, predict, batch_size: int = 256, max_in_flight: int = 4) -> int:
+    """
+    Scores the query lines batch by batch and writes the predictions to output
+
+    :param lines: iterable of csv lines (e.g. an open file or sys.stdin)
+    :param output: text stream, flushed after each batch
+    :param predict: callable queries -> probabilities, see build_predict
+    :param max_in_flight: batches dispatched concurrently; reading the input waits
+    for the oldest batch when the limit is reached
+    :return: number of scored queries
+    """
+    scored = 0
+    pending = deque()
+
+    def write_oldest():
+        queries, future = pending.popleft()
+        probabilities = future.result()
+        with span("output", queries=len(queries)):
+            output.write(format_predictions(queries, probabilities))
+            output.flush()
+        count("queries_scored", len(queries))
+        return len(queries)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for queries in iter_query_batches(lines, batch_size):
+            if len(pending) == max_in_flight:
+                scored += write_oldest()
+            pending.append((queries, executor.submit(predict, queries)))
+        while pending:
+            scored += write_oldest()
+    return scored
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream query rows through a KNN model")
+    parser.add_argument("input", help="csv file of the query rows (option_1,option_2), - for stdin")
+    parser.add_argument("--engine", choices=ENGINES, default="classical", help="prediction engine")
+    parser.add_argument("--dataset", type=Path, default=DEFAULT_DB_PATH, help="training dataset csv file")
+    parser.add_argument("--output", default="-", help="predictions csv file, - for stdout")
+    parser.add_argument("--batch-size", type=int, default=256, help="queries per micro-batch")
+    parser.add_argument("--max-in-flight", type=int, default=4, help="batches dispatched concurrently")
+    parser.add_argument("--shots", type=int, default=1000, help="shots per query (simulator, hardware)")
+    parser.add_argument("--k", type=int, default=None, help="nearest neighbours voting (classical)")
+    parser.add_argument("--instrumentation", action="store_true", help="print the time spent in each stage")
+    args = parser.parse_args(argv)
+    if args.instrumentation:
+        default_instrumentation().enable()
+
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        # the messages of the models (job IDs, ...) go to stderr, stdout may be the output
+        with contextlib.redirect_stdout(sys.stderr):
+            predict = build_predict(args.engine, args.dataset, args.shots, args.k)
+            output_file.write("option_1,option_2,p1,p0,prediction\n")
+            scored = score_stream(input_file, output_file, predict, args.batch_size, args.max_in_flight)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+    print(f"{scored} queries scored with the {args.engine} engine", file=sys.stderr)
+    if default_instrumentation().enabled:
+        with contextlib.redirect_stdout(sys.stderr):
+            default_instrumentation().print_summary()
+
+
+if __name__ == "__main__":
+    main()
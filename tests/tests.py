@@ -1,9 +1,1116 @@
 """Unit tests module"""
 
+import os
+import sys
+import tempfile
+from pathlib import Path
+# Keep the on-disk caches of the test session out of the user cache directory
+os.environ.setdefault("QC_EXAMPLES_CACHE_DIR", tempfile.mkdtemp(prefix="qc_examples_cache_"))
+# Add the repository root and the quantum machine learning examples to the PYTHONPATH
+ROOT_DIR = Path(__file__).resolve().parent.parent
+QML_DIR = ROOT_DIR / "src" / "quantum_machine_learning"
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(QML_DIR))
+
+DB_PATH = QML_DIR / "dataset.csv"
+TEST_SET = [3.5, 2]
+
+
+def fake_backend():
+    """Returns a small noisy fake backend, the circuits run locally on Aer"""
+    from qiskit_ibm_runtime.fake_provider import FakeManilaV2
+    return FakeManilaV2()
+
+
+def simulator_backend():
+    """Returns a noiseless seeded Aer simulator, for assertions on the sampled probabilities"""
+    from qiskit_aer import AerSimulator
+    return AerSimulator(seed_simulator=42)
+
+
+def knn_circuit_for(backend, test_set=TEST_SET):
+    from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+    from qc_ml_knn import QuantumKnnModel
+    model = QuantumKnnModel()
+    circuit = model.knn_quantum_circuit(model.compute_initial_state(DB_PATH, list(test_set)))
+    pass_manager = generate_preset_pass_manager(backend=backend, optimization_level=1)
+    return model, pass_manager.run(circuit)
+
+
 class TestProject:
     """
     It groups test methods.
     """
 
     def test_method(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class TestQuantumKnnExecution:
+    """
+    Execution of the KNN circuit with the Sampler primitive on a fake backend.
+    """
+
+    def test_post_selected_counts(self):
+        from qc_ml_knn import post_selected_counts
+        assert post_selected_counts({"00": 3, "10": 5, "01": 1, "11": 2}) == (5, 8)
+        assert post_selected_counts({"01": 1}) == (0, 0)
+
+    def test_single_job_submission(self, monkeypatch):
+        import qc_ml_knn
+        # noiseless seeded simulator: the estimate is compared with the exact P(1) = 0.513
+        backend = simulator_backend()
+        model, qc_transpiled = knn_circuit_for(backend)
+        submitted = []
+        original_run = qc_ml_knn.Sampler.run
+
+        def counting_run(sampler, pubs, **kwargs):
+            submitted.append(kwargs.get("shots"))
+            return original_run(sampler, pubs, **kwargs)
+
+        monkeypatch.setattr(qc_ml_knn.Sampler, "run", counting_run)
+        p1, p2 = model.execute_knn_model_on_quantum_computer(backend, qc_transpiled, shots=20000)
+        assert submitted == [20000]
+        assert abs(p1 + p2 - 1) < 1e-9
+        exact_p1 = model.exact_probabilities(DB_PATH, [TEST_SET])[0, 0]
+        assert abs(p1 - exact_p1) < 0.02 # sampling error ~0.004, swapped outputs (0.487) fail
+
+    def test_per_shot_jobs_compatibility_mode(self):
+        backend = fake_backend()
+        model, qc_transpiled = knn_circuit_for(backend)
+        p1, p2 = model.execute_knn_model_on_quantum_computer(
+            backend, qc_transpiled, shots=3, per_shot_jobs=True
+        )
+        assert abs(p1 + p2 - 1) < 1e-9
+
+    def test_initial_states_match_single_query_encoding(self):
+        import numpy as np
+        from qc_ml_knn import QuantumKnnModel
+        model = QuantumKnnModel()
+        states = model.compute_initial_states(DB_PATH, [TEST_SET, [1, 4]])
+        assert states.shape == (2, 16)
+        assert np.allclose(states[0], model.compute_initial_state(DB_PATH, list(TEST_SET)))
+        assert np.allclose(np.sum(states**2, axis=1), 1)
+
+    def test_predict_batch_single_submission(self):
+        from qc_ml_knn import QuantumKnnModel
+        probabilities = QuantumKnnModel().predict_batch(
+            DB_PATH, [TEST_SET, [1, 4], [4, 4]], backend=simulator_backend(), shots=4000
+        )
+        assert probabilities.shape == (3, 2)
+        assert abs(probabilities.sum(axis=1) - 1).max() < 1e-9
+        assert probabilities[0, 0] > probabilities[1, 0]
+
+
+class TestAmplitudeEncoding:
+    """
+    Parameterized RY/CX tree state preparation.
+    """
+
+    def test_encoding_reproduces_state_vectors(self):
+        import numpy as np
+        from qiskit.quantum_info import Statevector
+        from amplitude_encoding import amplitude_encoding_circuit, encoding_angles
+        states = np.random.default_rng(7).normal(size=(4, 16))
+        states /= np.linalg.norm(states, axis=1, keepdims=True)
+        circuit = amplitude_encoding_circuit(4)
+        assert circuit.num_parameters == 15
+        for state, angles in zip(states, encoding_angles(states)):
+            assert np.allclose(Statevector(circuit.assign_parameters(angles)).data, state)
+
+    def test_parameterized_circuit_transpiled_once(self):
+        from qc_ml_knn import QuantumKnnModel
+        backend = simulator_backend()
+        model = QuantumKnnModel()
+        _, first = model.transpile_parameterized_circuit(backend)
+        _, second = model.transpile_parameterized_circuit(backend)
+        assert first is second
+        probabilities = model.predict_batch(
+            DB_PATH, [TEST_SET, [1, 4]], backend=backend, shots=4000, encoder="ry_tree"
+        )
+        assert probabilities.shape == (2, 2)
+        assert probabilities[0, 0] > probabilities[1, 0]
+
+
+class TestTranspileCache:
+    """
+    Memory and disk tiers of the transpiled circuits cache, offline on fake backends.
+    """
+
+    def test_structural_hash_ignores_circuit_name(self):
+        from qc_ml_knn import QuantumKnnModel
+        from utils.transpile_cache import circuit_hash
+        model = QuantumKnnModel()
+        first = model.parameterized_knn_circuit()
+        second = model.parameterized_knn_circuit()
+        assert first.name != second.name
+        assert circuit_hash(first) == circuit_hash(second)
+        second.x(1)
+        assert circuit_hash(first) != circuit_hash(second)
+
+    def test_memory_and_disk_tiers(self, tmp_path):
+        from qc_ml_knn import QuantumKnnModel
+        from utils.save_account import transpile_circuit
+        from utils.transpile_cache import TranspileCache
+        backend = fake_backend()
+        circuit = QuantumKnnModel().parameterized_knn_circuit()
+        cache = TranspileCache(tmp_path, max_memory_entries=1)
+        _, first = transpile_circuit(circuit, backend=backend, cache=cache)
+        _, second = transpile_circuit(circuit.copy(), backend=backend, cache=cache)
+        assert second is first
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert len(list(tmp_path.glob("*.qpy"))) == 1
+        # a new process only finds the QPY file
+        _, from_disk = transpile_circuit(circuit, backend=backend, cache=TranspileCache(tmp_path))
+        assert from_disk == first
+        assert from_disk.layout.final_index_layout() == first.layout.final_index_layout()
+        # other optimization level, other key
+        transpile_circuit(circuit, backend=backend, cache=cache, optimization_level=2)
+        assert len(list(tmp_path.glob("*.qpy"))) == 2
+
+    def test_bulk_parallel_transpilation(self, tmp_path):
+        from qiskit import QuantumCircuit
+        from qiskit.circuit.random import random_circuit
+        from utils.save_account import pass_manager, transpile_circuits
+        from utils.transpile_cache import TranspileCache
+        backend = fake_backend()
+        assert pass_manager(backend, 1) is pass_manager(fake_backend(), 1)
+        assert pass_manager(backend, 1) is not pass_manager(backend, 2)
+        bell = QuantumCircuit(2, name="bell")
+        bell.h(0)
+        bell.cx(0, 1)
+        circuits = [bell] + [random_circuit(4, depth, max_operands=2, seed=depth) for depth in range(2, 8)]
+        _, transpiled, metrics = transpile_circuits(
+            circuits, backend, num_processes=2, cache=TranspileCache(tmp_path)
+        )
+        assert len(transpiled) == len(metrics) == len(circuits)
+        assert metrics[0]["name"] == "bell" and metrics[0]["two_qubit_gates"] == 1
+        assert all(circuit.num_qubits == backend.num_qubits for circuit in transpiled)
+        assert all(metric["depth"] >= metric["two_qubit_depth"] for metric in metrics)
+
+    def test_disk_size_eviction(self, tmp_path):
+        from qiskit import QuantumCircuit
+        from utils.transpile_cache import TranspileCache
+        cache = TranspileCache(tmp_path, max_disk_bytes=1)
+        cache.put("first", QuantumCircuit(2))
+        cache.put("second", QuantumCircuit(3))
+        assert [path.stem for path in tmp_path.glob("*.qpy")] == []
+        cache = TranspileCache(tmp_path, max_memory_entries=1)
+        cache.put("first", QuantumCircuit(2))
+        cache.put("second", QuantumCircuit(3))
+        assert cache.get("first").num_qubits == 2
+        assert len(cache._memory) == 1
+
+    def test_bulk_writes_scan_the_directory_once(self, tmp_path, monkeypatch):
+        from pathlib import Path
+        from qiskit import QuantumCircuit
+        from utils import transpile_cache
+        from utils.save_account import pass_manager
+        from utils.transpile_cache import TranspileCache
+        backend = fake_backend()
+        circuits = []
+        for i in range(20):
+            circuit = QuantumCircuit(2)
+            circuit.rx(i / 10, 0)
+            circuits.append(circuit)
+        scans = []
+        glob = Path.glob
+        monkeypatch.setattr(Path, "glob", lambda path, pattern: scans.append(pattern) or glob(path, pattern))
+        fingerprints = []
+        backend_fingerprint = transpile_cache.backend_fingerprint
+        monkeypatch.setattr(
+            transpile_cache, "backend_fingerprint",
+            lambda backend: fingerprints.append(backend) or backend_fingerprint(backend)
+        )
+        cache = TranspileCache(tmp_path, max_disk_bytes=10**9)
+        cache.transpile(circuits, backend, lambda: pass_manager(backend, 1), 1)
+        assert len(list(glob(tmp_path, "*.qpy"))) == 20
+        assert len(fingerprints) == 1
+        assert len(scans) <= 2 # directory size, then none per circuit
+        assert cache._disk_bytes == sum(path.stat().st_size for path in glob(tmp_path, "*.qpy"))
+        # one-off circuits stay in memory
+        other = TranspileCache(tmp_path / "one_off")
+        other.transpile(circuits, backend, lambda: pass_manager(backend, 1), 1, persist=False)
+        assert not (tmp_path / "one_off").exists()
+        assert other.get(other.key(circuits[0], backend, 1)) is not None
+
+
+class TestKnnModel:
+    """
+    Classical KNN, loop implementation and vectorized engine.
+    """
+
+    def test_vectorized_matches_loop_weights(self):
+        import numpy as np
+        from data_processing import get_dataset, normalize_dataset, normalize_test_set
+        from ml_knn import KnnModel
+        model = KnnModel(DB_PATH, list(TEST_SET))
+        dataset = normalize_dataset(get_dataset(DB_PATH))
+        weight = model.weights_normalization(
+            model.compute_weights(dataset, normalize_test_set(list(TEST_SET)))
+        )
+        probabilities = model.predict_batch([TEST_SET, [1, 4]])
+        assert np.allclose(probabilities[0], weight)
+        assert probabilities[0, 0] > probabilities[1, 0]
+
+    def test_top_k(self):
+        import numpy as np
+        import pytest
+        from ml_knn import AngleIndex, knn_probabilities, top_k
+        weights = np.array([[0.1, 0.9, 0.5], [0.7, 0.2, 0.3]])
+        assert top_k(weights, 2).tolist() == [[1, 2], [0, 2]]
+        training = np.array([[1, 0], [0, 1], [0.6, 0.8]])
+        probabilities = knn_probabilities(training, [1, 2, 2], [[1, 0.1], [0.1, 1]], k=1)
+        assert probabilities.tolist() == [[1, 0], [0, 1]]
+        for k in (0, -1):
+            with pytest.raises(ValueError):
+                knn_probabilities(training, [1, 2, 2], [[1, 0.1]], k=k)
+            with pytest.raises(ValueError):
+                AngleIndex(training, np.array([1, 2, 2])).probabilities([[1, 0.1]], k)
+
+    def test_decision_sums_the_weights_of_each_label(self):
+        from ml_knn import KnnModel
+        model = KnnModel(DB_PATH, list(TEST_SET))
+        # the largest weight is the third row, but the option 1 rows outweigh it
+        assert model.decision([0.3, 0.3, 0.4], [1, 1, 2]) == "Option 1 is better"
+        assert model.decision([0.5, 0.1, 0.4], [1, 2, 2]) == "Option 1 is better"
+        assert model.decision([0.4, 0.2, 0.4], [1, 2, 2]) == "Option 2 is better"
+
+    def test_angle_index_matches_full_scan(self):
+        import numpy as np
+        from data_processing import normalize_points
+        from ml_knn import AngleIndex, knn_probabilities, top_k, weight_matrix
+        rng = np.random.default_rng(3)
+        angles = rng.uniform(-np.pi, np.pi, 200)
+        training = np.column_stack((np.cos(angles), np.sin(angles)))
+        labels = rng.integers(1, 3, 200)
+        # queries near -pi/pi exercise the wrap-around
+        queries = np.vstack((rng.normal(size=(50, 2)), [[-1, 1e-3], [-1, -1e-3]]))
+        index = AngleIndex(training, labels)
+        for k in (1, 5, 150, 300):
+            indices, weights = index.query(queries, k)
+            expected = top_k(weight_matrix(training, normalize_points(queries)), k)
+            assert np.array_equal(np.sort(indices, axis=1), np.sort(expected, axis=1))
+            assert np.allclose(
+                index.probabilities(queries, k), knn_probabilities(training, labels, queries, k)
+            )
+
+
+class TestDataProcessing:
+    """
+    Dataset loading and normalization.
+    """
+
+    def test_streaming_normalization_to_npy(self, tmp_path):
+        import numpy as np
+        from data_processing import (
+            get_dataset, iter_dataset_chunks, normalize_dataset, normalize_dataset_to_npy
+        )
+        db_path = tmp_path / "large.csv"
+        rows = np.random.default_rng(1).uniform(1, 4.5, size=(1001, 3))
+        rows[:, 2] = rows[:, 2] > 2.5
+        np.savetxt(db_path, rows, delimiter=",", header=",,", comments="")
+        chunks = list(iter_dataset_chunks(db_path, chunk_size=100))
+        assert [len(chunk) for chunk in chunks] == [100]*10 + [1]
+        assert all(chunk.dtype == np.float64 for chunk in chunks)
+        normalized = normalize_dataset_to_npy(db_path, tmp_path / "large.npy", chunk_size=100)
+        assert isinstance(normalized, np.memmap)
+        assert np.allclose(normalized, normalize_dataset(get_dataset(db_path)))
+
+
+class TestModelArtifact:
+    """
+    Fit once and predict many from a memory-mapped artifact.
+    """
+
+    def test_knn_model_fit_and_load(self, tmp_path):
+        import numpy as np
+        from ml_knn import KnnModel
+        expected = KnnModel(DB_PATH).predict_batch([TEST_SET, [1, 4]])
+        KnnModel().fit(DB_PATH, artifact_path=tmp_path / "knn")
+        model = KnnModel.load(tmp_path / "knn")
+        assert isinstance(model.training, np.memmap)
+        assert np.allclose(model.predict_batch([TEST_SET, [1, 4]]), expected)
+        assert np.allclose(model.predict_batch([TEST_SET, [1, 4]], k=2), expected)
+
+    def test_quantum_model_fit_and_load(self, tmp_path):
+        import json
+        import numpy as np
+        import pytest
+        from qc_ml_knn import QuantumKnnModel
+        expected = QuantumKnnModel().compute_initial_states(DB_PATH, [TEST_SET])
+        QuantumKnnModel().fit(DB_PATH, artifact_path=tmp_path / "qknn")
+        model = QuantumKnnModel.load(tmp_path / "qknn")
+        assert np.allclose(model.compute_initial_states(None, [TEST_SET]), expected)
+        metadata = json.loads((tmp_path / "qknn" / "metadata.json").read_text())
+        metadata["version"] += 1
+        (tmp_path / "qknn" / "metadata.json").write_text(json.dumps(metadata))
+        with pytest.raises(ValueError):
+            QuantumKnnModel.load(tmp_path / "qknn")
+
+
+class TestExactExecution:
+    """
+    Analytic and statevector probabilities, no backend involved.
+    """
+
+    def test_exact_matches_statevector(self):
+        import numpy as np
+        from qc_ml_knn import QuantumKnnModel
+        queries = [TEST_SET, [1, 4], [4, 4], [1, 1.5]]
+        model = QuantumKnnModel()
+        exact = model.predict_batch(DB_PATH, queries, method="exact")
+        statevector = model.predict_batch(DB_PATH, queries, method="statevector")
+        assert np.allclose(exact, statevector)
+        assert np.isclose(exact[0, 0], 0.5132581721760332)
+        fitted = QuantumKnnModel().fit(DB_PATH)
+        assert np.allclose(fitted.predict_batch(None, queries, method="exact"), exact)
+
+
+class TestAdaptiveExecution:
+    """
+    Sequential early stopping of the shots.
+    """
+
+    def test_wilson_interval(self):
+        from qc_ml_knn import wilson_interval
+        assert wilson_interval(0, 0) == (0.0, 1.0)
+        lower, upper = wilson_interval(50, 100, z=1.96)
+        assert 0.40 < lower < 0.5 < upper < 0.60
+        lower, upper = wilson_interval(100, 100)
+        assert lower > 0.9 and upper > 0.999
+
+    def test_easy_query_stops_early(self):
+        from qiskit import QuantumCircuit
+        from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+        from qc_ml_knn import QuantumKnnModel
+        backend = simulator_backend()
+        model = QuantumKnnModel()
+        pass_manager = generate_preset_pass_manager(backend=backend, optimization_level=1)
+        # Q0 = 1 and Q3 = 0 on every shot: the decision is settled after the first batch
+        easy = QuantumCircuit(4, 2)
+        easy.x(0)
+        easy.measure(3, 0)
+        easy.measure(0, 1)
+        p1, p2 = model.execute_adaptive(backend, pass_manager.run(easy), max_shots=4096)
+        assert (p1, p2) == (1, 0)
+        assert model.shots_used == 32
+        # the KNN example has P(1) = 0.513, too close to 1/2 for 500 shots
+        state = model.compute_initial_state(DB_PATH, list(TEST_SET))
+        ambiguous = pass_manager.run(model.knn_quantum_circuit(state))
+        model.execute_adaptive(backend, ambiguous, max_shots=500)
+        assert model.shots_used == 500
+
+    def test_schedule_validation_and_correction(self):
+        import pytest
+        from qc_ml_knn import QuantumKnnModel, adaptive_schedule
+        assert adaptive_schedule(32, 500, 2) == [32, 64, 128, 256, 20]
+        assert adaptive_schedule(1, 3, 1.5) == [1, 1, 1]
+        for initial_shots, max_shots, growth in ((0, 100, 2), (32, 0, 2), (32, 100, 0.5)):
+            with pytest.raises(ValueError):
+                adaptive_schedule(initial_shots, max_shots, growth)
+        with pytest.raises(ValueError):
+            QuantumKnnModel().execute_adaptive(simulator_backend(), None, growth=0.5)
+
+
+class TestExecutionMode:
+    """
+    Runtime Batch and Session execution modes, in local testing mode.
+    """
+
+    def test_batch_and_session_modes(self):
+        import pytest
+        from qiskit_ibm_runtime import Batch, Session
+        import qc_ml_knn
+        import run_models
+        assert run_models.EXECUTION_MODES == qc_ml_knn.EXECUTION_MODES
+        backend = fake_backend()
+        model, qc_transpiled = knn_circuit_for(backend)
+        with model.execution_mode(backend, "job") as mode:
+            assert mode is backend and model.execution_context is None
+        for name, context_class in (("batch", Batch), ("session", Session)):
+            with model.execution_mode(backend, name) as context:
+                assert isinstance(context, context_class)
+                assert model.execution_context is context
+                assert model._sampler_mode(backend) is context
+                p1, p2 = model.execute_knn_model_on_quantum_computer(backend, qc_transpiled, shots=100)
+                assert abs(p1 + p2 - 1) < 1e-9
+            assert model.execution_context is None
+        with pytest.raises(ValueError):
+            with model.execution_mode(backend, "dedicated"):
+                pass
+
+
+class TestAerEngine:
+    """
+    Local Aer execution fanned out over worker processes.
+    """
+
+    def test_chunks(self):
+        import numpy as np
+        from utils.aer_engine import AerEngine
+        chunks = AerEngine(processes=3, threads=1).chunks(np.zeros((7, 15)))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        assert AerEngine(processes=1, threads=1).chunks(None) == [None]
+
+    def test_process_pool_matches_exact_probabilities(self):
+        import numpy as np
+        from qc_ml_knn import QuantumKnnModel
+        from utils.aer_engine import AerEngine
+        queries = [TEST_SET, [1, 4], [4, 4], [4.5, 1]]
+        model = QuantumKnnModel()
+        with AerEngine(processes=2, threads=1, seed=42) as engine:
+            probabilities = model.predict_batch(DB_PATH, queries, shots=20000, method="aer", engine=engine)
+            executor = engine._executor
+            # the workers and the simulator are reused by the next calls
+            again = model.predict_batch(DB_PATH, queries, shots=20000, method="aer", engine=engine)
+            assert engine._executor is executor and engine.backend() is engine.backend()
+        assert engine._executor is None
+        assert np.array_equal(again, probabilities)
+        assert probabilities.shape == (4, 2)
+        assert np.abs(probabilities - model.exact_probabilities(DB_PATH, queries)).max() < 0.02
+        # same seeds, same chunks: the same counts in process
+        in_process = model.predict_local(DB_PATH, queries, shots=20000, engine=AerEngine(
+            processes=1, threads=1, chunk_size=2, seed=42
+        ))
+        assert np.array_equal(in_process, probabilities)
+
+
+class TestMultiplexing:
+    """
+    Many 4 qubits KNN circuits tiled on one wide backend.
+    """
+
+    def test_groups_on_127_qubits_backend(self):
+        from qiskit_ibm_runtime.fake_provider import FakeSherbrooke
+        from multiplexing import find_qubit_groups, transpile_multiplexed_circuit
+        backend = FakeSherbrooke()
+        groups = find_qubit_groups(backend)
+        assert len(groups) >= 28
+        assert len({qubit for group in groups for qubit in group}) == 4*len(groups)
+        edges = set(backend.coupling_map.get_edges())
+        for group in groups:
+            # connected: every qubit but the first is linked to a previous one
+            for i, qubit in enumerate(group[1:], 1):
+                assert any((qubit, other) in edges or (other, qubit) in edges for other in group[:i])
+        qc_transpiled = transpile_multiplexed_circuit(backend, groups)
+        assert len(qc_transpiled.cregs) == len(groups)
+
+    def test_demultiplexed_probabilities(self):
+        import numpy as np
+        from qiskit.providers.fake_provider import GenericBackendV2
+        from qc_ml_knn import QuantumKnnModel
+        backend = GenericBackendV2(12, noise_info=False, seed=5)
+        queries = [TEST_SET, [1, 1.5], [4, 4], [1, 4], [3, 1]]
+        model = QuantumKnnModel().fit(DB_PATH)
+        probabilities = model.predict_multiplexed(None, queries, backend, shots=4000)
+        assert model.transpiled_circuits[(backend.name, "multiplexed", None)][0] == 3
+        assert np.abs(probabilities - model.exact_probabilities(None, queries)).max() < 0.05
+
+
+class TestJobManager:
+    """
+    Concurrent submission and resumable journal, on a local simulator.
+    """
+
+    def test_concurrent_batches_and_resume(self, tmp_path):
+        import numpy as np
+        from qc_ml_knn import QuantumKnnModel
+        from utils.job_manager import JobJournal
+        queries = [TEST_SET, [1, 1.5], [4, 4], [1, 4], [3, 1]]
+        journal_path = tmp_path / "journal.jsonl"
+        model = QuantumKnnModel().fit(DB_PATH)
+        backend = simulator_backend()
+        probabilities = model.predict_concurrent(
+            None, queries, backend, shots=4000, batch_size=2, journal_path=journal_path
+        )
+        assert probabilities.shape == (5, 2)
+        assert np.abs(probabilities - model.exact_probabilities(None, queries)).max() < 0.05
+        entries = JobJournal(journal_path).load()
+        assert [key.rsplit("_", 1)[0] for key in sorted(entries)] == ["queries_0_2", "queries_2_4", "queries_4_5"]
+        assert all("job_id" in entry and "result" in entry for entry in entries.values())
+        # crashed run: the last batch was submitted but its result never written
+        lines = journal_path.read_text().splitlines()
+        last_result = max(i for i, line in enumerate(lines) if '"result"' in line)
+        journal_path.write_text("\n".join(lines[:last_result]) + "\n")
+        resumed = model.predict_concurrent(
+            None, queries, backend, shots=4000, batch_size=2, journal_path=journal_path
+        )
+        assert np.isfinite(resumed).all()
+        assert len(JobJournal(journal_path).load()) == 3
+
+    def test_changed_queries_are_submitted_again(self, tmp_path, monkeypatch):
+        import numpy as np
+        from qc_ml_knn import QuantumKnnModel
+        from utils.job_manager import AsyncJobManager
+        journal_path = tmp_path / "journal.jsonl"
+        model = QuantumKnnModel().fit(DB_PATH)
+        backend = simulator_backend()
+        submitted = []
+        original_run = AsyncJobManager.run
+        def counting_run(manager, batches, **kwargs):
+            results = original_run(manager, batches, **kwargs)
+            submitted.append(manager.submitted_jobs)
+            return results
+        monkeypatch.setattr(AsyncJobManager, "run", counting_run)
+        first_queries, second_queries = [[4.5, 1], [4.5, 1]], [[1, 4.5], [1, 4.5]]
+        model.predict_concurrent(None, first_queries, backend, shots=4000, journal_path=journal_path)
+        second = model.predict_concurrent(None, second_queries, backend, shots=4000, journal_path=journal_path)
+        assert np.abs(second - model.exact_probabilities(None, second_queries)).max() < 0.05
+        # same queries with other shots, then the same run: resumed from the journal
+        model.predict_concurrent(None, second_queries, backend, shots=2000, journal_path=journal_path)
+        model.predict_concurrent(None, second_queries, backend, shots=2000, journal_path=journal_path)
+        assert submitted == [1, 1, 1, 0]
+
+    def test_resume_submits_only_missing_batches(self, tmp_path):
+        from qiskit import QuantumCircuit
+        from qiskit_ibm_runtime import SamplerV2 as Sampler
+        from utils.job_manager import AsyncJobManager
+        circuit = QuantumCircuit(1, 1)
+        circuit.x(0)
+        circuit.measure(0, 0)
+        journal_path = tmp_path / "journal.jsonl"
+        manager = AsyncJobManager(Sampler(mode=simulator_backend()), journal_path, initial_poll_interval=0.01)
+        first = manager.run({"a": [circuit], "b": [circuit]}, shots=10)
+        assert first == {"a": [{"c": {"1": 10}}], "b": [{"c": {"1": 10}}]}
+        assert manager.submitted_jobs == 2
+        manager = AsyncJobManager(Sampler(mode=simulator_backend()), journal_path, initial_poll_interval=0.01)
+        second = manager.run({"a": [circuit], "b": [circuit], "c": [circuit]}, shots=10)
+        assert second["c"] == first["a"]
+        assert manager.submitted_jobs == 1
+
+    def test_run_job_resumes_the_journaled_job(self, tmp_path, monkeypatch):
+        from qiskit import QuantumCircuit
+        from qiskit.quantum_info import SparsePauliOp
+        from qiskit_aer.primitives import EstimatorV2
+        from utils.job_manager import AsyncJobManager, run_job
+        circuit = QuantumCircuit(1)
+        circuit.x(0)
+        pubs = [(circuit, SparsePauliOp("Z"))]
+        journal_path = tmp_path / "journal.jsonl"
+        submitted = []
+        original_run = AsyncJobManager.run
+        def counting_run(manager, batches, **kwargs):
+            results = original_run(manager, batches, **kwargs)
+            submitted.append(manager.submitted_jobs)
+            return results
+        monkeypatch.setattr(AsyncJobManager, "run", counting_run)
+        # the local estimator has no backend(): keyed by the primitive type
+        first = run_job(EstimatorV2(), pubs, journal_path=journal_path)
+        second = run_job(EstimatorV2(), pubs, journal_path=journal_path)
+        assert first == second == [{"evs": -1.0, "stds": 0.0}]
+        assert submitted == [1, 0]
+
+
+class TestResultCache:
+    """
+    Content-addressed cache of Sampler and Estimator results.
+    """
+
+    def test_cached_sampler(self, tmp_path):
+        from qiskit import QuantumCircuit
+        from qiskit_ibm_runtime import SamplerV2 as Sampler
+        from utils.result_cache import CachedJob, CachedSampler, ResultCache
+        circuit = QuantumCircuit(1, 1)
+        circuit.x(0)
+        circuit.measure(0, 0)
+        cache = ResultCache(tmp_path)
+        sampler = CachedSampler(Sampler(mode=fake_backend()), cache)
+        first = sampler.run([circuit], shots=100).result()
+        cached_job = sampler.run([circuit], shots=100)
+        assert isinstance(cached_job, CachedJob)
+        assert cached_job.result()[0].data.c.get_counts() == first[0].data.c.get_counts()
+        assert not isinstance(sampler.run([circuit], shots=200), CachedJob)
+        assert (cache.hits, cache.misses) == (1, 2)
+        expired = CachedSampler(Sampler(mode=fake_backend()), ResultCache(tmp_path, ttl=0))
+        assert not isinstance(expired.run([circuit], shots=100), CachedJob)
+
+    def test_cached_estimator(self, tmp_path):
+        import numpy as np
+        from qiskit import QuantumCircuit
+        from qiskit.quantum_info import SparsePauliOp
+        from qiskit_ibm_runtime import EstimatorV2 as Estimator
+        from utils.result_cache import CachedJob, CachedEstimator, ResultCache
+        circuit = QuantumCircuit(1)
+        circuit.x(0)
+        estimator = CachedEstimator(Estimator(mode=simulator_backend()), ResultCache(tmp_path))
+        evs = estimator.run([(circuit, SparsePauliOp("Z"))]).result()[0].data.evs
+        assert np.isclose(evs, -1)
+        assert isinstance(estimator.run([(circuit, SparsePauliOp("Z"))]), CachedJob)
+        assert not isinstance(estimator.run([(circuit, SparsePauliOp("X"))]), CachedJob)
+
+    def test_puts_scan_the_directory_only_over_the_limit(self, tmp_path, monkeypatch):
+        from pathlib import Path
+        from utils.result_cache import ResultCache
+        scans = []
+        glob = Path.glob
+        monkeypatch.setattr(Path, "glob", lambda path, pattern: scans.append(pattern) or glob(path, pattern))
+        cache = ResultCache(tmp_path, max_disk_bytes=10**9)
+        for i in range(50):
+            cache.put(f"key{i}", list(range(100)))
+        assert len(scans) == 1 # directory size, then a running total
+        assert cache._disk_bytes == sum(path.stat().st_size for path in glob(tmp_path, "*.pkl"))
+        # over the limit: the oldest files are removed down to it
+        cache.max_disk_bytes = cache._disk_bytes // 2
+        cache.put("key50", list(range(100)))
+        remaining = list(glob(tmp_path, "*.pkl"))
+        assert cache._disk_bytes == sum(path.stat().st_size for path in remaining) <= cache.max_disk_bytes
+        assert cache.get("key50") is not None and cache.get("key0") is None
+
+
+class TestPostProcessing:
+    """
+    Post-selection on the packed BitArray buffers.
+    """
+
+    def test_bit_counts_match_counts_dictionaries(self):
+        import numpy as np
+        from qiskit.primitives import BitArray
+        from post_processing import (
+            conditional_probabilities, post_selected_bit_counts, post_selected_counts
+        )
+        rng = np.random.default_rng(11)
+        # 3 parameter sets x 500 shots, 10 bits: c0 and c1 are the low bits
+        samples = rng.integers(0, 2**10, size=(3, 500, 1)).astype(np.uint16)
+        packed = np.unpackbits(samples.view(np.uint8)[..., ::-1], axis=-1)
+        bit_array = BitArray(np.packbits(packed, axis=-1), num_bits=10)
+        numerator, denominator = post_selected_bit_counts(bit_array)
+        for i in range(3):
+            counts = bit_array.slice_bits([0, 1]).get_counts(loc=i)
+            assert (numerator[i], denominator[i]) == post_selected_counts(counts)
+        probabilities = conditional_probabilities([1, 0], [4, 0])
+        assert probabilities[0].tolist() == [0.25, 0.75]
+        assert np.isnan(probabilities[1]).all()
+
+
+class TestLookupTable:
+    """
+    Precomputed predictions of the rating grid.
+    """
+
+    def test_lookup_matches_computed_predictions(self, tmp_path):
+        import numpy as np
+        from ml_knn import KnnModel
+        from qc_ml_knn import QuantumKnnModel
+        queries = [TEST_SET, [1, 4.5], [4.5, 4.5], [3.7, 2.2]]
+        knn = KnnModel(DB_PATH).fit()
+        knn.precompute()
+        assert knn.lookup_table.table.shape == (8, 8, 2)
+        assert np.allclose(knn.predict_lookup(queries), knn.predict_batch(queries))
+        quantum = QuantumKnnModel().fit(DB_PATH)
+        quantum.precompute()
+        assert np.allclose(
+            quantum.predict_lookup(queries), quantum.predict_batch(None, queries, method="exact")
+        )
+        assert quantum.lookup_table.is_valid(quantum.training)
+        db_path = tmp_path / "other.csv"
+        db_path.write_text(",,\n4.5,3,1\n2,4,2\n")
+        quantum.fit(db_path)
+        assert quantum.lookup_table is None
+
+
+class TestServiceProvider:
+    """
+    Shared service and cached backend metadata, with a local stand-in service.
+    """
+
+    class StandInService:
+        instances = 0
+
+        def __init__(self, **credentials):
+            TestServiceProvider.StandInService.instances += 1
+            self.credentials = credentials
+            self.calls = []
+
+        def backends(self, **filters):
+            self.calls.append(("backends", filters))
+            return [fake_backend()]
+
+        def least_busy(self, **filters):
+            self.calls.append(("least_busy", filters))
+            return fake_backend()
+
+        def backend(self, name):
+            self.calls.append(("backend", name))
+            return fake_backend()
+
+    def test_pooled_service_and_ttl(self):
+        from utils.service_provider import ServiceProvider
+        now = [0.0]
+        refreshed = []
+        TestServiceProvider.StandInService.instances = 0
+        provider = ServiceProvider(ttl=60, service_factory=self.StandInService, clock=lambda: now[0])
+        provider.add_refresh_hook(lambda: refreshed.append(True))
+        assert provider.service(token="a") is provider.service(token="a")
+        assert provider.service(token="a") is not provider.service(token="b")
+        assert TestServiceProvider.StandInService.instances == 2
+        first = provider.backends(token="a", operational=True)
+        assert provider.backends(token="a", operational=True) is first
+        provider.least_busy(token="a", simulator=False)
+        provider.least_busy(token="a", simulator=False)
+        assert len(provider.service(token="a").calls) == 2
+        now[0] = 61
+        provider.least_busy(token="a", simulator=False)
+        assert len(provider.service(token="a").calls) == 3
+        provider.refresh()
+        provider.backends(token="a", operational=True)
+        assert len(provider.service(token="a").calls) == 4
+        assert refreshed == [True]
+        backend = first[0]
+        assert provider.properties(backend) is provider.properties(backend)
+        assert provider.target(backend) is provider.target(backend)
+        assert provider.target(fake_backend()) is not provider.target(backend)
+
+    def test_saved_account_without_arguments(self):
+        from utils.service_provider import ServiceProvider
+        provider = ServiceProvider(service_factory=self.StandInService)
+        assert provider.service().credentials == {}
+        assert provider.service(token="a").credentials == {"token": "a"}
+        provider.least_busy(operational=True)
+        assert provider.service().calls == [("least_busy", {"operational": True})]
+
+    def test_default_backend_reused_between_runs(self, tmp_path, monkeypatch):
+        from types import SimpleNamespace
+        from utils import save_account, service_provider
+        from utils.service_provider import ServiceProvider
+        from utils.transpile_cache import backend_fingerprint
+        monkeypatch.setattr(save_account, "BACKEND_CHOICE_PATH", tmp_path / "backend_choice.json")
+        monkeypatch.delenv("QC_EXAMPLES_BACKEND", raising=False)
+        monkeypatch.delenv("IBM_QUANTUM_TOKEN", raising=False)
+        runs = []
+        for _ in range(2): # each run is a new process: a new provider
+            provider = ServiceProvider(service_factory=self.StandInService)
+            monkeypatch.setattr(service_provider, "_default_provider", provider)
+            backend = save_account._default_backend(None, True, False)
+            runs.append(provider.service().calls)
+        assert backend.name == "fake_manila"
+        assert [call[0] for call in runs[0]] == ["least_busy"]
+        assert runs[1] == [("backend", "fake_manila")]
+        monkeypatch.setenv("QC_EXAMPLES_BACKEND", "fake_other")
+        save_account._default_backend(None, True, False)
+        assert provider.service().calls[-1] == ("backend", "fake_other")
+        # a new calibration gives another fingerprint: the circuits are transpiled again
+        first = backend_fingerprint(backend)
+        monkeypatch.setattr(provider, "properties", lambda backend: SimpleNamespace(last_update_date="tomorrow"))
+        assert backend_fingerprint(backend) != first
+
+    def test_refresh_rebuilds_the_pass_managers(self):
+        from qiskit import QuantumCircuit
+        from utils.save_account import pass_manager, transpile_circuit
+        from utils.service_provider import default_service_provider
+        from utils.transpile_cache import default_transpile_cache
+        backend = fake_backend()
+        provider = default_service_provider()
+        assert provider.properties(backend) is not provider.properties(fake_backend())
+        first = pass_manager(backend, 1)
+        transpile_circuit(QuantumCircuit(2), backend=backend)
+        assert len(default_transpile_cache()._memory) > 0
+        provider.refresh()
+        assert len(default_transpile_cache()._memory) == 0
+        assert pass_manager(backend, 1) is not first
+
+    def test_target_readers_use_the_provider(self, monkeypatch):
+        from multiplexing import find_qubit_groups
+        from utils.save_account import pass_manager
+        from utils.service_provider import ServiceProvider
+        from utils import save_account, service_provider
+        provider = ServiceProvider()
+        monkeypatch.setattr(service_provider, "_default_provider", provider)
+        monkeypatch.setattr(save_account, "_pass_managers", {})
+        reads = []
+        target = provider.target
+        monkeypatch.setattr(provider, "target", lambda backend: reads.append(backend.name) or target(backend))
+        backend = fake_backend()
+        pass_manager(backend, 3)
+        find_qubit_groups(backend)
+        assert len(reads) == 3 # fingerprint, pass manager, multiplexing
+        assert len([key for key in provider._metadata if key[0] == "target"]) == 1
+
+
+class TestCancelJobs:
+    """
+    Paginated listing, status sweep and concurrent cancellation with stand-in jobs.
+    """
+
+    class StandInJob:
+        def __init__(self, job_id, status):
+            self._job_id = job_id
+            self._status = status
+            self.status_calls = 0
+
+        def job_id(self):
+            return self._job_id
+
+        def status(self):
+            self.status_calls += 1
+            return self._status
+
+        def cancel(self):
+            self._status = "CANCELLED"
+
+    class StandInApiClient:
+        """Listing of the runtime API: the status is part of each job entry"""
+
+        def __init__(self, jobs):
+            self.all_jobs = jobs
+            self.requests = []
+
+        def jobs_get(self, limit, skip, pending, **filters):
+            self.requests.append((limit, skip, pending, filters))
+            final = ("CANCELLED", "DONE", "ERROR")
+            selected = [
+                job for job in self.all_jobs
+                if pending is None or (job._status not in final) == pending
+            ][skip:skip + limit]
+            return {
+                "jobs": [{"id": job.job_id(), "state": {"status": job._status.capitalize()}} for job in selected],
+                "count": len(selected),
+            }
+
+    class StandInService:
+        def __init__(self, jobs):
+            self._active_api_client = TestCancelJobs.StandInApiClient(jobs)
+            self._jobs = {job.job_id(): job for job in jobs}
+
+        def _decode_job(self, raw_job):
+            return self._jobs[raw_job["id"]]
+
+    def test_sweep(self):
+        from datetime import datetime
+        from utils.cancel_jobs import sweep
+        jobs = [self.StandInJob(f"q{i}", "QUEUED") for i in range(25)]
+        jobs += [self.StandInJob("r0", "RUNNING")]
+        jobs += [self.StandInJob(f"c{i}", "CANCELLED") for i in range(30)]
+        service = self.StandInService(jobs)
+        since = datetime(2026, 1, 1)
+        report = sweep(
+            service, dry_run=True, page_size=10, show_cancelled=True, cancelled_limit=15, cancelled_since=since
+        )
+        assert len(report["queued"]) == 25 and report["running"] == ["r0"]
+        assert report["cancelled"] == [f"c{i}" for i in range(15)] and report["cancelled_now"] == {}
+        requests = service._active_api_client.requests
+        assert [skip for _, skip, pending, _ in requests if pending] == [0, 10, 20]
+        assert [(limit, skip) for limit, skip, pending, _ in requests if pending is False] == [(10, 0), (5, 10)]
+        assert all(filters["created_after"] == since for *_, pending, filters in requests if pending is False)
+        assert all(job.status_calls == 0 for job in jobs) # statuses read from the listing
+        report = sweep(service, page_size=10)
+        assert report["cancelled_now"] == {f"q{i}": None for i in range(25)}
+        assert all(job._status == "CANCELLED" for job in jobs[:25])
+
+
+class TestBenchmarks:
+    """
+    Benchmark suite measures and baseline comparison.
+    """
+
+    def test_suite_and_regression_threshold(self):
+        from benchmarks.run_benchmarks import run_suite, compare
+        results = run_suite(["exact", "classical_predict"], quick=True, repeats=2)
+        measures = results["results"]["exact[batch=1000]"]
+        assert measures["items"] == 1000 and measures["throughput"] > 0
+        assert measures["peak_memory_bytes"] > 0
+        faster = {"results": {key: {"latency_s": value["latency_s"] * 10} for key, value in results["results"].items()}}
+        assert compare(results, faster) == []
+        slower = {"results": {"exact[batch=1000]": {"latency_s": measures["latency_s"] / 10}}}
+        assert [key for key, _, _ in compare(results, slower, threshold=0.5)] == ["exact[batch=1000]"]
+
+
+class TestInstrumentation:
+    """
+    Stage spans and counters, disabled by default.
+    """
+
+    def test_disabled_records_nothing(self):
+        from utils.instrumentation import Instrumentation, _NULL_SPAN
+        instrumentation = Instrumentation()
+        with instrumentation.span("transpilation") as span:
+            assert span is _NULL_SPAN
+        instrumentation.count("shots", 10)
+        assert instrumentation.summary() == {"spans": {}, "counters": {}}
+
+    def test_pipeline_stages(self, tmp_path):
+        import json
+        from ml_knn import KnnModel
+        from qc_ml_knn import QuantumKnnModel
+        from utils.instrumentation import default_instrumentation
+        instrumentation = default_instrumentation()
+        instrumentation.reset()
+        instrumentation.enable()
+        try:
+            KnnModel(DB_PATH).fit().predict_batch([TEST_SET])
+            QuantumKnnModel(use_result_cache=False).predict_batch(
+                DB_PATH, [TEST_SET, [1, 4]], backend=simulator_backend(), shots=100
+            )
+        finally:
+            instrumentation.disable()
+        summary = instrumentation.summary()
+        assert {
+            "csv_load", "normalization", "state_encoding", "circuit_build", "transpilation",
+            "job_submission", "queue_wait", "execution", "post_processing", "knn_predict"
+        } <= set(summary["spans"])
+        assert summary["counters"]["shots"] == 200 and summary["counters"]["jobs_submitted"] == 1
+        parents = {entry["name"]: entry["parent"] for entry in instrumentation.spans}
+        assert parents["index_build"] is None and parents["circuit_build"] is None
+        instrumentation.export_json(tmp_path / "spans.json")
+        assert json.loads((tmp_path / "spans.json").read_text())["counters"] == summary["counters"]
+        instrumentation.reset()
+
+    def test_job_result_split_from_timestamps(self):
+        from utils.instrumentation import Instrumentation, job_result
+
+        class TimedJob:
+            def job_id(self):
+                return "job"
+
+            def result(self):
+                return "result"
+
+            def metrics(self):
+                return {"timestamps": {
+                    "created": "2025-01-01T00:00:00Z",
+                    "running": "2025-01-01T00:01:00Z",
+                    "finished": "2025-01-01T00:01:05Z",
+                }}
+
+        instrumentation = Instrumentation(enabled=True)
+        assert job_result(TimedJob(), instrumentation) == "result"
+        durations = {entry["name"]: entry["duration_s"] for entry in instrumentation.spans}
+        assert durations == {"queue_wait": 60.0, "execution": 5.0}
+
+
+class TestImportTime:
+    """
+    Import-time budget of the classical path and of the CLI help, in fresh interpreters.
+    """
+
+    IMPORT_BUDGET_S = 1.5 # generous: numpy alone takes ~0.1 s, qiskit_ibm_runtime more than 1 s
+
+    def run_python(self, code: str) -> dict:
+        import json
+        import subprocess
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=QML_DIR
+        ).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_classical_path_does_not_import_qiskit_or_pandas(self):
+        report = self.run_python(
+            "import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "from ml_knn import KnnModel\n"
+            "elapsed = time.perf_counter() - start\n"
+            "print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))"
+        )
+        assert not {"qiskit", "qiskit_ibm_runtime", "pandas"} & set(report["modules"])
+        assert report["elapsed"] < self.IMPORT_BUDGET_S
+
+    def test_cli_help_does_not_import_the_models(self):
+        report = self.run_python(
+            "import json, runpy, sys, time\n"
+            "sys.argv = ['run_models.py', '--help']\n"
+            "start = time.perf_counter()\n"
+            "try:\n"
+            "    runpy.run_path('run_models.py', run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "elapsed = time.perf_counter() - start\n"
+            "print(json.dumps({'elapsed': elapsed, 'modules': sorted(sys.modules)}))"
+        )
+        assert not {"qiskit", "pandas", "numpy", "ml_knn", "qc_ml_knn"} & set(report["modules"])
+        assert report["elapsed"] < self.IMPORT_BUDGET_S
+
+
+class TestScoreQueries:
+    """
+    Streaming micro-batch scoring of query rows.
+    """
+
+    def test_stream_matches_batch_predictions(self):
+        import io
+        import numpy as np
+        from score_queries import build_predict, score_stream
+        queries = np.random.default_rng(3).choice(np.arange(1, 5, 0.5), size=(23, 2))
+        lines = ["option_1,option_2\n"] + [f"{e},{f}\n" for e, f in queries] + ["\n"]
+        predict = build_predict("exact", DB_PATH)
+        output = io.StringIO()
+        assert score_stream(iter(lines), output, predict, batch_size=5, max_in_flight=2) == 23
+        rows = np.loadtxt(io.StringIO(output.getvalue()), delimiter=",")
+        assert np.allclose(rows[:, :2], queries)
+        assert np.allclose(rows[:, 2:4], predict(queries), atol=1e-6)
+        assert np.array_equal(rows[:, 4], np.where(rows[:, 2] >= rows[:, 3], 1, 2))
+        classical = build_predict("classical", DB_PATH, k=1)
+        assert classical(queries).shape == (23, 2)
+
+    def test_bounded_read_ahead(self):
+        import io
+        import numpy as np
+        from score_queries import score_stream
+        read = []
+        written = []
+
+        def lines():
+            for i in range(100):
+                read.append(i)
+                yield f"{1 + i % 4},2\n"
+
+        class Output(io.StringIO):
+            def write(self, text):
+                written.append(len(read))
+                return super().write(text)
+
+        def predict(queries):
+            return np.full((len(queries), 2), 0.5)
+
+        assert score_stream(lines(), Output(), predict, batch_size=10, max_in_flight=2) == 100
+        # the first batch is written when the third one is read: max_in_flight + 1 batches ahead
+        assert written[0] <= 30
+        assert len(written) == 10
+
+
+class TestReadoutMitigation:
+    """
+    Cached tensored readout-error mitigation on a noisy fake backend.
+    """
+
+    def test_calibration_inverts_assignment_errors(self):
+        import numpy as np
+        from utils.readout_mitigation import ReadoutCalibration
+        matrices = [[[0.97, 0.05], [0.03, 0.95]], [[0.9, 0.1], [0.1, 0.9]]]
+        calibration = ReadoutCalibration([3, 0], matrices)
+        true = np.array([[0.5, 0.0, 0.5, 0.0], [0.1, 0.2, 0.3, 0.4]])
+        # bit 0 is the fastest index of the joint outcomes
+        measured = true @ np.kron(np.array(matrices[1]), np.array(matrices[0])).T
+        assert np.allclose(calibration.apply(measured * 1000), true)
+        assert np.allclose(calibration.readout_errors(), [0.04, 0.1])
+
+    def test_mitigated_post_selection_on_fake_backend(self, tmp_path):
+        from qiskit import QuantumCircuit
+        from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+        from qc_ml_knn import QuantumKnnModel
+        from utils.readout_mitigation import ReadoutMitigator, measured_qubits
+        backend = fake_backend()
+        # Q0 = 1 and Q3 = 0 on every shot: P(1) = 1 up to the readout errors
+        circuit = QuantumCircuit(4, 2)
+        circuit.x(0)
+        circuit.measure(3, 0)
+        circuit.measure(0, 1)
+        qc_transpiled = generate_preset_pass_manager(backend=backend, optimization_level=1).run(circuit)
+        raw_p1, _ = QuantumKnnModel(use_result_cache=False).execute_knn_model_on_quantum_computer(
+            backend, qc_transpiled, shots=20000
+        )
+        mitigator = ReadoutMitigator(tmp_path, shots=20000)
+        model = QuantumKnnModel(use_result_cache=False, readout_mitigator=mitigator)
+        p1, p2 = model.execute_knn_model_on_quantum_computer(backend, qc_transpiled, shots=20000)
+        assert abs(p1 + p2 - 1) < 1e-9
+        assert 1 - p1 < (1 - raw_p1) / 2
+        # calibrated once per backend calibration, then from the memory and disk caches
+        model.execute_knn_model_on_quantum_computer(backend, qc_transpiled, shots=1000)
+        assert mitigator.calibrations_run == 1
+        reloaded = ReadoutMitigator(tmp_path, shots=20000)
+        calibration = reloaded.calibration(backend, measured_qubits(qc_transpiled), sampler=None)
+        assert reloaded.calibrations_run == 0
+        assert calibration.qubits == measured_qubits(qc_transpiled)
+        probabilities = model.predict_batch(
+            DB_PATH, [TEST_SET, [1, 4]], backend=backend, shots=1000, encoder="ry_tree"
+        )
+        assert probabilities.shape == (2, 2)
@@ -0,0 +1,173 @@
+"""
+Local execution engine on the Aer simulator
+
+Runs the Sampler and Estimator workloads on the machine instead of queueing them
+on hardware:
+    -   each chunk of parameter values is one Aer execution with batched parameter
+        binds (one circuit, one bind per parameter set)
+    -   the chunks are fanned out to a pool of worker processes, each one running
+        Aer with threads OpenMP threads, processes x threads defaults to the cores
+    -   a reduce function (e.g. post_processing.post_selected_bit_counts) is applied
+        in the workers, only the reduced arrays are sent back to the parent process
+    -   the worker processes and the simulator are kept for the lifetime of the engine:
+        close() it, or use it as a context manager
+
+Usage:
+-----
+    with AerEngine(processes=8, threads=2, seed=42) as engine:
+        outputs = engine.sample(circuit, parameter_values, shots=1000, reduce=post_selected_bit_counts)
+        estimator = engine.estimator()
+"""
+
+
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from qiskit_aer import AerSimulator
+from qiskit_aer.primitives import SamplerV2 as AerSampler, EstimatorV2 as AerEstimator
+
+
+def backend_options(threads: int | None = None) -> dict:
+    """
+    Aer options using threads OpenMP threads (None: all the cores); small circuits
+    are parallelized over the experiments (parameter binds) and the shots
+    """
+    threads = threads or 0 # 0: Aer uses all the cores
+    return {
+        "max_parallel_threads": threads,
+        "max_parallel_experiments": threads,
+        "max_parallel_shots": threads,
+    }
+
+
+def _run_chunk(circuit, parameter_values, shots: int, seed, threads, reduce):
+    """Worker: one Aer Sampler execution binding all the parameter values of the chunk"""
+    sampler = AerSampler(
+        default_shots=shots, seed=seed, options={"backend_options": backend_options(threads)}
+    )
+    pub = (circuit, parameter_values) if parameter_values is not None else (circuit,)
+    pub_result = sampler.run([pub], shots=shots).result()[0]
+    return reduce(pub_result.join_data()) if reduce is not None else pub_result.join_data()
+
+
+class AerEngine:
+    """
+    Aer Sampler fanning out the parameter sets of a circuit over worker processes
+    """
+
+    def __init__(
+            self,
+            processes: int | None = None,
+            threads: int | None = None,
+            chunk_size: int | None = None,
+            seed: int | None = None,
+            mp_context: str = "spawn"
+            ):
+        """
+        :param processes: worker processes, by default one per core; 1 runs in process
+        :param threads: OpenMP threads of each Aer execution, by default the cores
+        are shared between the processes
+        :param chunk_size: parameter sets per worker execution, by default the
+        parameter sets are split evenly between the processes
+        :param seed: seed of the simulator, chunk i uses seed + i
+        :param mp_context: start method of the workers, "spawn" does not inherit the
+        OpenMP state of the parent process
+        """
+        cores = os.cpu_count() or 1
+        self.processes = processes or cores
+        self.threads = threads or max(1, cores // self.processes)
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.mp_context = mp_context
+        self._backend = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def backend(self) -> AerSimulator:
+        """
+        Aer simulator with the engine options, e.g. the transpilation target. The same
+        instance is returned on every call: the target and pass manager caches are keyed
+        by the backend instance
+        """
+        with self._lock:
+            if self._backend is None:
+                self._backend = AerSimulator(seed_simulator=self.seed, **backend_options(self.threads))
+            return self._backend
+
+    def estimator(self, default_precision: float = 0.0) -> AerEstimator:
+        """Aer Estimator with the engine threads (exact expectation values by default)"""
+        return AerEstimator(options={
+            "backend_options": backend_options(self.threads),
+            "default_precision": default_precision,
+            "run_options": {"seed_simulator": self.seed},
+        })
+
+    def chunks(self, parameter_values) -> list:
+        """Splits the parameter sets (first axis) into the worker chunks"""
+        if parameter_values is None:
+            return [None]
+        parameter_values = np.asarray(parameter_values)
+        size = self.chunk_size or -(-len(parameter_values) // self.processes)
+        return [parameter_values[start:start + size] for start in range(0, len(parameter_values), max(size, 1))]
+
+    def _seed(self, index: int):
+        return None if self.seed is None else self.seed + index
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Worker processes, started by the first sample() and reused until close()"""
+        with self._lock:
+            if self._executor is None:
+                context = multiprocessing.get_context(self.mp_context)
+                self._executor = ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+            return self._executor
+
+    def close(self):
+        """Stops the worker processes, a later sample() starts new ones"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def sample(self, circuit, parameter_values=None, shots: int = 1024, reduce=None) -> list:
+        """
+        Samples the circuit for every parameter set
+
+        :param circuit: circuit transpiled for self.backend() (or with standard gates only)
+        :param parameter_values: array of shape (number of sets, circuit.num_parameters)
+        :param shots: shots per parameter set
+        :param reduce: picklable (module level) function applied by the workers to the
+        BitArray of each chunk, by default the BitArrays are returned
+        :return: one output per chunk, in the order of the parameter sets
+        """
+        chunks = self.chunks(parameter_values)
+        arguments = [
+            (circuit, chunk, shots, self._seed(index), self.threads, reduce)
+            for index, chunk in enumerate(chunks)
+        ]
+        if self.processes == 1 or len(chunks) == 1:
+            return [_run_chunk(*argument) for argument in arguments]
+        executor = self._pool()
+        futures = [executor.submit(_run_chunk, *argument) for argument in arguments]
+        return [future.result() for future in futures]
+
+
+_default_engine = None
+
+
+def default_aer_engine() -> AerEngine:
+    """Process wide engine, one process per core, closed at exit"""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = AerEngine()
+        atexit.register(_default_engine.close)
+    return _default_engine
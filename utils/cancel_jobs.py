@@ -1,18 +1,161 @@
-from qiskit_ibm_runtime import QiskitRuntimeService
+"""
+Cancel the queued jobs of the IBM Quantum account
 
+    -   only the pending jobs are listed (server-side filter), page by page
+    -   the status of each job is read from the listing, no request per job
+    -   the queued jobs are cancelled concurrently
+    -   --dry-run prints the report without cancelling anything
+    -   --show-cancelled lists at most --cancelled-limit finished jobs of the last
+        --cancelled-days days
 
-service = QiskitRuntimeService()
-all_jobs = service.jobs()
-pending_jobs = [job for job in all_jobs if job.status() == "QUEUED"]
-cancelled_jobs = [job for job in all_jobs if job.status() == "CANCELLED"]
+Usage:
+-----
+    python utils/cancel_jobs.py --dry-run
+    python utils/cancel_jobs.py --backend ibm_brisbane --workers 16
+    python utils/cancel_jobs.py --show-cancelled
+"""
 
-if pending_jobs:
-    for job in pending_jobs:
-        print(f"Job ID: {job.job_id()}")
-        job.cancel()
 
-if cancelled_jobs:
-    print("Cancelled jobs IDs:")
-    for job in cancelled_jobs:
-        print(f"{job.job_id()}")
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+# Add the parent directory to the PYTHONPATH
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.service_provider import default_service_provider
 
+
+def _status_name(status) -> str:
+    # runtime jobs return strings, local jobs JobStatus members
+    return getattr(status, "name", str(status))
+
+
+def _listing_page(service, limit: int, skip: int, pending: bool | None, **filters) -> list:
+    """
+    One page of (job, status name). QiskitRuntimeService.jobs() decodes the jobs without
+    the status of the listing response, hence the page of the same request is read from
+    the runtime API client; other services (local stand-ins) are asked the job status.
+    """
+    api_client = getattr(service, "_active_api_client", None)
+    if api_client is None or not hasattr(service, "_decode_job"):
+        jobs = service.jobs(limit=limit, skip=skip, pending=pending, **filters)
+        return [(job, _status_name(job.status())) for job in jobs]
+    from qiskit_ibm_runtime.runtime_job_v2 import API_TO_JOB_STATUS
+    response = api_client.jobs_get(limit=limit, skip=skip, pending=pending, **filters)
+    page = []
+    for raw_job in response["jobs"]:
+        status = raw_job.get("state", {}).get("status", "").upper()
+        page.append((service._decode_job(raw_job), API_TO_JOB_STATUS.get(status, status)))
+    return page
+
+
+def list_jobs(service, pending: bool | None = True, page_size: int = 100, max_jobs: int | None = None, **filters) -> list:
+    """
+    Lists the jobs and their status page by page with the server-side filters of service.jobs()
+
+    :param pending: True for queued and running jobs, False for finished ones, None for all
+    :param page_size: number of jobs per request
+    :param max_jobs: stop after this number of jobs
+    :param filters: other service.jobs() filters (backend_name, created_after, job_tags, ...)
+    :return: list of (job, status name)
+    """
+    jobs = []
+    while max_jobs is None or len(jobs) < max_jobs:
+        limit = page_size if max_jobs is None else min(page_size, max_jobs - len(jobs))
+        page = _listing_page(service, limit, len(jobs), pending, **filters)
+        jobs.extend(page)
+        if len(page) < limit:
+            break
+    return jobs
+
+
+def cancel_jobs(jobs: list, max_workers: int = 8) -> dict:
+    """
+    Cancels the jobs concurrently
+    :return: job ID -> None when cancelled, or the error message
+    """
+    def cancel(job):
+        try:
+            job.cancel()
+        except Exception as error:
+            return job.job_id(), str(error)
+        return job.job_id(), None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(cancel, jobs))
+
+
+def sweep(
+        service,
+        dry_run: bool = False,
+        max_workers: int = 8,
+        page_size: int = 100,
+        show_cancelled: bool = False,
+        cancelled_limit: int = 100,
+        cancelled_since: datetime | None = None,
+        **filters
+        ) -> dict:
+    """
+    Cancels the queued jobs and returns the report:
+        {"queued": [job IDs], "running": [job IDs], "cancelled_now": {job ID: error},
+         "cancelled": [job IDs already cancelled, only with show_cancelled]}
+
+    :param cancelled_limit: finished jobs listed by show_cancelled
+    :param cancelled_since: finished jobs created after this date, by default 7 days ago
+    """
+    pending_jobs = list_jobs(service, pending=True, page_size=page_size, **filters)
+    queued_jobs = [job for job, status in pending_jobs if status == "QUEUED"]
+    report = {
+        "queued": [job.job_id() for job in queued_jobs],
+        "running": [job.job_id() for job, status in pending_jobs if status == "RUNNING"],
+        "cancelled_now": {} if dry_run else cancel_jobs(queued_jobs, max_workers),
+    }
+    if show_cancelled:
+        created_after = cancelled_since if cancelled_since is not None else datetime.now() - timedelta(days=7)
+        finished_jobs = list_jobs(
+            service, pending=False, page_size=page_size, max_jobs=cancelled_limit,
+            **{"created_after": created_after, **filters}
+        )
+        report["cancelled"] = [job.job_id() for job, status in finished_jobs if status == "CANCELLED"]
+    return report
+
+
+def print_report(report: dict, dry_run: bool):
+    action = "would be cancelled (dry run)" if dry_run else "cancelled"
+    print(f"{len(report['queued'])} queued jobs {action}, {len(report['running'])} running jobs left")
+    for job_id in report["queued"]:
+        error = report["cancelled_now"].get(job_id)
+        print(f"Job ID: {job_id}" + (f" | cancel failed: {error}" if error else ""))
+    if "cancelled" in report:
+        print("Cancelled jobs IDs:")
+        for job_id in report["cancelled"]:
+            print(f"{job_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cancel the queued IBM Quantum jobs")
+    parser.add_argument("--dry-run", action="store_true", help="report without cancelling")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent status and cancel requests")
+    parser.add_argument("--page-size", type=int, default=100, help="jobs listed per request")
+    parser.add_argument("--backend", default=None, help="only the jobs of this backend")
+    parser.add_argument("--show-cancelled", action="store_true", help="also list the cancelled jobs")
+    parser.add_argument("--cancelled-limit", type=int, default=100, help="finished jobs listed by --show-cancelled")
+    parser.add_argument("--cancelled-days", type=float, default=7, help="age of the jobs listed by --show-cancelled")
+    args = parser.parse_args()
+
+    filters = {"backend_name": args.backend} if args.backend else {}
+    report = sweep(
+        default_service_provider().service(),
+        dry_run=args.dry_run,
+        max_workers=args.workers,
+        page_size=args.page_size,
+        show_cancelled=args.show_cancelled,
+        cancelled_limit=args.cancelled_limit,
+        cancelled_since=datetime.now() - timedelta(days=args.cancelled_days),
+        **filters
+    )
+    print_report(report, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
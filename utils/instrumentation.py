@@ -0,0 +1,241 @@
+"""
+Spans and counters of the quantum pipeline stages
+
+    -   span(name, **attributes): context manager timing a stage (csv_load,
+        normalization, state_encoding, circuit_build, service_connection,
+        transpilation, job_submission, queue_wait, execution, post_processing, ...),
+        spans opened inside another span record it as their parent
+    -   count(name, value): counters (rows read, circuits transpiled, shots, ...)
+    -   job_result(job): job.result() recorded as queue wait and execution, split with
+        the runtime job timestamps when the job provides them
+    -   exporters: summary() / print_summary() in process, export_json(path) structured
+
+Instrumentation is disabled by default: span() then returns a shared no-op context
+manager and count() returns at once, nothing is allocated or timed.
+Set QC_EXAMPLES_INSTRUMENTATION=1 to enable it for a run, and
+QC_EXAMPLES_INSTRUMENTATION_JSON=<path> to export the records when the process exits.
+
+Usage:
+-----
+    instrumentation = default_instrumentation()
+    instrumentation.enable()
+    with span("transpilation", circuits=10):
+        ...
+    instrumentation.print_summary()
+"""
+
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class _NullSpan:
+    """Span of the disabled instrumentation"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    def __init__(self, instrumentation, name: str, attributes: dict):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = None
+
+    def set(self, **attributes):
+        """Adds attributes known only inside the span (e.g. a job ID)"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.instrumentation._stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        self.instrumentation._stack().pop()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.instrumentation.record(self.name, duration, parent=self.parent, start=self.start, **self.attributes)
+        return False
+
+
+class Instrumentation:
+    """
+    Thread safe collector of span records and counters
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans: list = []
+        self.counters: dict = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self.counters = {}
+        self._origin = time.perf_counter()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attributes)
+
+    def record(self, name: str, duration: float, parent=None, start=None, **attributes):
+        """Records a span measured elsewhere (e.g. from job timestamps)"""
+        if not self.enabled:
+            return
+        entry = {
+            "name": name,
+            "duration_s": duration,
+            "start_s": (start if start is not None else time.perf_counter() - duration) - self._origin,
+            "parent": parent,
+            "thread": threading.get_ident(),
+            "attributes": attributes,
+        }
+        with self._lock:
+            self.spans.append(entry)
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> dict:
+        """
+        :return: {"spans": {name: {"count", "total_s", "mean_s", "max_s"}}, "counters": {...}}
+        """
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+        stages = {}
+        for entry in spans:
+            stage = stages.setdefault(entry["name"], {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            stage["count"] += 1
+            stage["total_s"] += entry["duration_s"]
+            stage["max_s"] = max(stage["max_s"], entry["duration_s"])
+        for stage in stages.values():
+            stage["mean_s"] = stage["total_s"] / stage["count"]
+        return {"spans": stages, "counters": counters}
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"{'stage':<24}{'count':>8}{'total ms':>12}{'mean ms':>12}{'max ms':>12}")
+        for name, stage in sorted(summary["spans"].items(), key=lambda item: -item[1]["total_s"]):
+            print(
+                f"{name:<24}{stage['count']:>8}{stage['total_s']*1e3:>12.3f}"
+                f"{stage['mean_s']*1e3:>12.3f}{stage['max_s']*1e3:>12.3f}"
+            )
+        for name, value in sorted(summary["counters"].items()):
+            print(f"{name}: {value}")
+
+    def export_json(self, path):
+        """Writes the span records, the counters and the summary as JSON"""
+        with self._lock:
+            records = {"spans": list(self.spans), "counters": dict(self.counters)}
+        records["summary"] = self.summary()["spans"]
+        Path(path).write_text(json.dumps(records, indent=2, default=str))
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def job_result(job, instrumentation: Instrumentation | None = None):
+    """
+    job.result() recorded as queue wait and execution. Runtime jobs report their
+    created, running and finished timestamps (job.metrics()), local jobs do not:
+    the whole wait is then recorded as execution.
+    """
+    instrumentation = instrumentation if instrumentation is not None else default_instrumentation()
+    if not instrumentation.enabled:
+        return job.result()
+    start = time.perf_counter()
+    result = job.result()
+    record_job_wait(job, time.perf_counter() - start, instrumentation)
+    return result
+
+
+def record_job_wait(job, wait: float, instrumentation: Instrumentation | None = None):
+    """
+    Records the wait for a job result (e.g. measured by a polling loop) as queue wait
+    and execution, split with the runtime job timestamps when the job provides them
+    """
+    instrumentation = instrumentation if instrumentation is not None else default_instrumentation()
+    if not instrumentation.enabled:
+        return
+    job_id = job.job_id() if hasattr(job, "job_id") else None
+    try:
+        timestamps = job.metrics()["timestamps"]
+        running = _timestamp(timestamps["running"])
+        queue_wait = (running - _timestamp(timestamps["created"])).total_seconds()
+        execution = (_timestamp(timestamps["finished"]) - running).total_seconds()
+    except Exception: # local jobs, cached results or missing timestamps
+        queue_wait, execution = 0.0, wait
+    instrumentation.record("queue_wait", queue_wait, job_id=job_id)
+    instrumentation.record("execution", execution, job_id=job_id)
+
+
+_default_instrumentation = None
+
+
+def default_instrumentation() -> Instrumentation:
+    """
+    Process wide instrumentation, enabled by the QC_EXAMPLES_INSTRUMENTATION
+    environment variable; with QC_EXAMPLES_INSTRUMENTATION_JSON the records are
+    exported to that path when the process exits
+    """
+    global _default_instrumentation
+    if _default_instrumentation is None:
+        _default_instrumentation = Instrumentation(
+            enabled=os.getenv("QC_EXAMPLES_INSTRUMENTATION", "").lower() in ("1", "true", "yes")
+        )
+        json_path = os.getenv("QC_EXAMPLES_INSTRUMENTATION_JSON")
+        if json_path:
+            atexit.register(_default_instrumentation.export_json, json_path)
+    return _default_instrumentation
+
+
+def span(name: str, **attributes):
+    """span() of the process wide instrumentation"""
+    return default_instrumentation().span(name, **attributes)
+
+
+def count(name: str, value: float = 1):
+    """count() of the process wide instrumentation"""
+    default_instrumentation().count(name, value)
@@ -0,0 +1,271 @@
+"""
+Asynchronous job manager
+
+Submits many independent PUB batches to a primitive (Sampler or Estimator)
+concurrently instead of blocking on each job.result() in turn:
+    -   submissions run in worker threads, at most max_concurrency jobs in flight
+    -   jobs are polled with exponential backoff (no tight job.status() loops)
+    -   every submitted job ID and every completed result is appended to a
+        JSON lines journal; a crashed run started again with the same journal
+        returns the completed results and retrieves (job_loader) the submitted
+        jobs instead of submitting them again
+
+Usage:
+-----
+    sampler = Sampler(mode=backend)
+    manager = AsyncJobManager(sampler, journal_path="run.jsonl", job_loader=service.job)
+    results = manager.run({"batch_0": pubs_0, "batch_1": pubs_1}, shots=1000)
+
+    # one job, e.g. the examples: polled, and resumed from the journal after a crash
+    pub_result = run_job(estimator, [(isa_circuit, observables)], journal_path="run.jsonl")[0]
+
+Results are returned in the serialized (JSON) form of serialize_result. The journal keys
+must identify the content of the batches, see content_key.
+"""
+
+
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.primitives import BaseEstimatorV2, BitArray
+from qiskit.primitives.containers.estimator_pub import EstimatorPub
+from qiskit.primitives.containers.sampler_pub import SamplerPub
+from utils.transpile_cache import circuit_hash
+from utils.result_cache import result_key
+from utils.instrumentation import span, count, record_job_wait
+
+
+def _serialize_value(value):
+    if isinstance(value, BitArray):
+        if value.shape == ():
+            return value.get_counts()
+        return [value.get_counts(loc=index) for index in np.ndindex(value.shape)]
+    return np.asarray(value).tolist()
+
+
+def serialize_result(result) -> list:
+    """
+    JSON friendly form of a primitive result: one dictionary per PUB mapping each
+    data field to its counts (BitArray, a list of counts in C order for PUBs with
+    parameter bindings) or to its values as nested lists (e.g. Estimator evs and stds)
+    """
+    return [
+        {name: _serialize_value(value) for name, value in pub_result.data.items()}
+        for pub_result in result
+    ]
+
+
+def content_key(prefix: str, backend, *parts) -> str:
+    """
+    Journal key of a batch: the prefix and a hash of the backend name and the parts
+    (circuits by structural hash, arrays by value, other parts by repr), a run with
+    other circuits, parameters or options never resumes the results of another run
+    """
+    digest = hashlib.sha256(getattr(backend, "name", str(backend)).encode())
+    for part in parts:
+        if isinstance(part, QuantumCircuit):
+            digest.update(f"|circuit:{circuit_hash(part)}".encode())
+        elif isinstance(part, np.ndarray):
+            part = np.ascontiguousarray(part)
+            digest.update(f"|array:{part.dtype}:{part.shape}|".encode())
+            digest.update(part.tobytes())
+        else:
+            digest.update(f"|{part!r}".encode())
+    return f"{prefix}_{digest.hexdigest()[:16]}"
+
+
+class JobJournal:
+    """
+    Append only JSON lines file with two kinds of records:
+        {"key": ..., "job_id": ...}   written when a job is submitted
+        {"key": ..., "result": ...}   written when its result is available
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self) -> dict:
+        """Returns key -> {"job_id": ..., "result": ...} from the records written so far"""
+        entries = {}
+        if not self.path.exists():
+            return entries
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError: # last line of a crashed run
+                    continue
+                entries.setdefault(record["key"], {}).update(
+                    {name: value for name, value in record.items() if name != "key"}
+                )
+        return entries
+
+    def append(self, **record):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+
+
+class AsyncJobManager:
+    """
+    Concurrent submission and polling of primitive jobs with a resumable journal
+    """
+
+    def __init__(
+            self,
+            primitive,
+            journal_path=None,
+            max_concurrency: int = 4,
+            job_loader=None,
+            initial_poll_interval: float = 0.5,
+            max_poll_interval: float = 30.0,
+            backoff: float = 2.0,
+            serialize=serialize_result
+            ):
+        """
+        :param primitive: Sampler or Estimator instance, its run(pubs, **options) submits a job
+        :param journal_path: JSON lines journal file, None disables resuming
+        :param max_concurrency: maximum number of jobs submitted and not completed
+        :param job_loader: callable job_id -> job used on resume (e.g. QiskitRuntimeService.job),
+        without it the jobs submitted by a crashed run are submitted again
+        :param initial_poll_interval: seconds before the first status check
+        :param max_poll_interval: upper bound of the polling interval
+        :param backoff: factor applied to the polling interval after each check
+        :param serialize: callable converting a job result into the JSON form stored in the journal
+        """
+        self.primitive = primitive
+        self.journal = JobJournal(journal_path) if journal_path is not None else None
+        self.max_concurrency = max_concurrency
+        self.job_loader = job_loader
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.serialize = serialize
+        self.submitted_jobs = 0
+
+    async def _wait(self, job):
+        start = time.perf_counter()
+        interval = self.initial_poll_interval
+        while not await asyncio.to_thread(job.in_final_state):
+            await asyncio.sleep(interval)
+            interval = min(interval*self.backoff, self.max_poll_interval)
+        result = await asyncio.to_thread(job.result)
+        record_job_wait(job, time.perf_counter() - start)
+        return result
+
+    def _submit(self, key: str, pubs, options: dict):
+        count("jobs_submitted")
+        with span("job_submission", batch=key, pubs=len(pubs)) as submission:
+            job = self.primitive.run(pubs, **options)
+            submission.set(job_id=job.job_id())
+        return job
+
+    def _load_job(self, job_id: str):
+        if self.job_loader is None:
+            return None
+        try:
+            return self.job_loader(job_id)
+        except Exception as error:
+            print(f"Job ID: {job_id} could not be retrieved ({error}), submitting again")
+            return None
+
+    async def _run_batch(self, key: str, pubs, entry: dict, semaphore: asyncio.Semaphore, options: dict):
+        if "result" in entry:
+            return entry["result"]
+        async with semaphore:
+            job = None
+            if "job_id" in entry:
+                job = await asyncio.to_thread(self._load_job, entry["job_id"])
+            if job is None:
+                job = await asyncio.to_thread(self._submit, key, pubs, options)
+                self.submitted_jobs += 1
+                if self.journal is not None:
+                    self.journal.append(key=key, job_id=job.job_id())
+            print(f"Job ID: {job.job_id()} | batch: {key}")
+            result = self.serialize(await self._wait(job))
+        if self.journal is not None:
+            self.journal.append(key=key, result=result)
+        return result
+
+    async def run_async(self, batches: dict, **options) -> dict:
+        """
+        :param batches: key -> list of PUBs, keys must be unique and stable across runs
+        :param options: options of primitive.run (e.g. shots or precision)
+        :return: key -> serialized result
+        """
+        entries = self.journal.load() if self.journal is not None else {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        keys = list(batches)
+        results = await asyncio.gather(*(
+            self._run_batch(key, batches[key], entries.get(key, {}), semaphore, options)
+            for key in keys
+        ))
+        return dict(zip(keys, results))
+
+    def run(self, batches: dict, **options) -> dict:
+        """Blocking entry point of run_async"""
+        return asyncio.run(self.run_async(batches, **options))
+
+
+def job_key(primitive, pubs, **options) -> str:
+    """
+    Journal key of one job: the result_key (utils/result_cache.py) of the coerced PUBs,
+    the backend, its calibration and the run options
+    """
+    if isinstance(getattr(primitive, "primitive", primitive), BaseEstimatorV2): # CachedEstimator
+        name = "estimator"
+        coerced = [EstimatorPub.coerce(pub, precision=options.get("precision")) for pub in pubs]
+    else:
+        name = "sampler"
+        coerced = [SamplerPub.coerce(pub, shots=options.get("shots")) for pub in pubs]
+    backend = _primitive_backend(primitive)
+    backend = backend if backend is not None else type(primitive).__name__ # local primitives
+    return f"job_{result_key(name, coerced, backend, options)[:16]}"
+
+
+def _primitive_backend(primitive):
+    """Backend of a runtime primitive, None for the local primitives without backend()"""
+    try:
+        return primitive.backend()
+    except AttributeError:
+        return None
+
+
+def _job_loader(primitive):
+    """service.job of the runtime backend of the primitive, None for local backends"""
+    service = getattr(_primitive_backend(primitive), "service", None)
+    return service.job if service is not None else None
+
+
+def run_job(
+        primitive,
+        pubs,
+        journal_path=None,
+        key: str | None = None,
+        job_loader=None,
+        serialize=serialize_result,
+        **options
+        ):
+    """
+    One job through AsyncJobManager instead of a blocking job.result(): the job is polled
+    with backoff and, with a journal_path, a crashed run started again retrieves the
+    submitted job or the stored result instead of submitting again
+
+    :param key: journal key, by default job_key of the PUBs and the options
+    :param job_loader: by default the job retrieval of the runtime service of the backend
+    :return: the serialized result (serialize_result: one dictionary per PUB)
+    """
+    if key is None:
+        key = job_key(primitive, pubs, **options) if journal_path is not None else "job"
+    manager = AsyncJobManager(
+        primitive,
+        journal_path=journal_path,
+        job_loader=job_loader if job_loader is not None else _job_loader(primitive),
+        serialize=serialize
+    )
+    return manager.run({key: pubs}, **options)[key]
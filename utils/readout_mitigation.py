@@ -0,0 +1,194 @@
+"""
+Cached readout-error mitigation
+
+Measurement errors bias the measured distribution of each classical bit. Assuming
+independent errors per qubit (tensored model), each measured physical qubit q has a
+2x2 assignment matrix A_q[measured, prepared] calibrated by two circuits: every
+measured qubit prepared in |0>, and every measured qubit prepared in |1>. The joint
+distribution of n measured bits is corrected by the inverse of A_{n-1} x ... x A_0,
+one matrix product for all the parameter sets of a batch; the quasi-probabilities are
+clipped to 0 and normalized.
+
+Calibrations are cached in memory and on disk (JSON) by backend name, calibration
+timestamp (properties last_update_date), physical qubits and shots: they are run once
+per backend calibration window.
+
+Usage:
+-----
+    mitigator = default_readout_mitigator()
+    calibration = mitigator.calibration(backend, measured_qubits(qc_transpiled), sampler)
+    probabilities = calibration.apply(joint_counts)
+"""
+
+
+import hashlib
+import json
+import os
+import threading
+from functools import reduce
+from pathlib import Path
+import numpy as np
+from qiskit import QuantumCircuit
+from utils.transpile_cache import DEFAULT_CACHE_DIR
+from utils.result_cache import calibration_timestamp
+from utils.save_account import transpile_circuit
+
+
+def measured_qubits(circuit: QuantumCircuit) -> list:
+    """Physical qubit measured into each classical bit of a transpiled circuit (None if unused)"""
+    qubits = [None] * circuit.num_clbits
+    for instruction in circuit.data:
+        if instruction.operation.name == "measure":
+            qubits[circuit.find_bit(instruction.clbits[0]).index] = circuit.find_bit(instruction.qubits[0]).index
+    return qubits
+
+
+def calibration_circuits(num_qubits: int, qubits: list) -> list:
+    """
+    The two calibration circuits on a backend of num_qubits qubits:
+    all the measured qubits prepared in |0>, then in |1>
+    """
+    circuits = []
+    for prepared in (0, 1):
+        circuit = QuantumCircuit(num_qubits, len(qubits), name=f"readout_calibration_{prepared}")
+        if prepared:
+            circuit.x(qubits)
+        circuit.measure(qubits, range(len(qubits)))
+        circuits.append(circuit)
+    return circuits
+
+
+class ReadoutCalibration:
+    """
+    Assignment matrices of the measured qubits, matrices[j] is the matrix of the qubit
+    measured into bit j: matrices[j][measured, prepared] = P(measured | prepared)
+    """
+
+    def __init__(self, qubits: list, matrices):
+        self.qubits = list(qubits)
+        self.matrices = np.asarray(matrices, dtype=np.float64)
+        # outcome index sum(bit_j << j): bit 0 is the last (fastest) factor of the product
+        self.mitigation_matrix = np.linalg.inv(reduce(np.kron, self.matrices[::-1]))
+
+    @classmethod
+    def from_counts(cls, qubits: list, counts_0: np.ndarray, counts_1: np.ndarray):
+        """
+        :param counts_0: (number of bits, 2) counts of each bit measured 0 and 1, qubits prepared in |0>
+        :param counts_1: same with the qubits prepared in |1>
+        """
+        counts_0 = np.asarray(counts_0, dtype=np.float64)
+        counts_1 = np.asarray(counts_1, dtype=np.float64)
+        matrices = np.stack((
+            counts_0 / counts_0.sum(axis=1, keepdims=True),
+            counts_1 / counts_1.sum(axis=1, keepdims=True),
+        ), axis=-1) # [bit, measured, prepared]
+        return cls(qubits, matrices)
+
+    def readout_errors(self) -> np.ndarray:
+        """Mean assignment error of each measured qubit"""
+        return (self.matrices[:, 1, 0] + self.matrices[:, 0, 1]) / 2
+
+    def apply(self, joint_counts) -> np.ndarray:
+        """
+        :param joint_counts: counts (or probabilities) of the joint outcomes, shape (..., 2**n)
+        :return: mitigated probabilities of the same shape
+        """
+        joint_counts = np.asarray(joint_counts, dtype=np.float64)
+        totals = joint_counts.sum(axis=-1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            quasi = (joint_counts / totals) @ self.mitigation_matrix.T
+        quasi = np.clip(quasi, 0, None)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return quasi / quasi.sum(axis=-1, keepdims=True)
+
+    def to_dict(self) -> dict:
+        return {"qubits": self.qubits, "matrices": self.matrices.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["qubits"], data["matrices"])
+
+
+class ReadoutMitigator:
+    """
+    Runs and caches the readout calibrations
+    """
+
+    def __init__(self, cache_dir: Path | str | None = DEFAULT_CACHE_DIR / "readout", shots: int = 4096):
+        """
+        :param cache_dir: directory of the JSON calibrations, None keeps them in memory only
+        :param shots: shots of each calibration circuit
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.shots = shots
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.calibrations_run = 0
+
+    def key(self, backend, qubits: list) -> str:
+        description = json.dumps({
+            "backend": getattr(backend, "name", str(backend)),
+            "calibration": calibration_timestamp(backend),
+            "qubits": list(qubits),
+            "shots": self.shots,
+        }, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def calibration(self, backend, qubits: list, sampler) -> ReadoutCalibration:
+        """
+        Returns the calibration of the physical qubits, from the cache or run once
+
+        :param qubits: physical qubit of each classical bit, see measured_qubits
+        :param sampler: Sampler running the calibration circuits on the backend
+        """
+        key = self.key(backend, qubits)
+        with self._lock:
+            if key in self._memory:
+                return self._memory[key]
+            if self.cache_dir is not None and self._path(key).exists():
+                try:
+                    calibration = ReadoutCalibration.from_dict(json.loads(self._path(key).read_text()))
+                except (ValueError, KeyError): # corrupted file
+                    self._path(key).unlink(missing_ok=True)
+                else:
+                    self._memory[key] = calibration
+                    return calibration
+            calibration = self.calibrate(backend, qubits, sampler)
+            self._memory[key] = calibration
+            if self.cache_dir is not None:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                temporary_path = self._path(key).with_suffix(f".{os.getpid()}.tmp")
+                temporary_path.write_text(json.dumps(calibration.to_dict()))
+                os.replace(temporary_path, self._path(key))
+            return calibration
+
+    def calibrate(self, backend, qubits: list, sampler) -> ReadoutCalibration:
+        """Runs the two calibration circuits in one job"""
+        # full width circuits with native gates: the optimization level 0 keeps the qubits
+        _, circuits = transpile_circuit(
+            calibration_circuits(backend.num_qubits, qubits), backend=backend, optimization_level=0
+        )
+        if any(measured_qubits(circuit) != list(qubits) for circuit in circuits):
+            raise ValueError(f"The calibration circuits of the qubits {qubits} were remapped")
+        result = sampler.run(circuits, shots=self.shots).result()
+        self.calibrations_run += 1
+        counts = []
+        for pub_result in result:
+            bits = pub_result.join_data()
+            ones = np.array([bits.slice_bits(bit).bitcount().sum() for bit in range(len(qubits))])
+            counts.append(np.column_stack((bits.num_shots - ones, ones)))
+        return ReadoutCalibration.from_counts(qubits, counts[0], counts[1])
+
+
+_default_mitigator = None
+
+
+def default_readout_mitigator() -> ReadoutMitigator:
+    """Process wide mitigator sharing the on-disk calibrations"""
+    global _default_mitigator
+    if _default_mitigator is None:
+        _default_mitigator = ReadoutMitigator()
+    return _default_mitigator
@@ -0,0 +1,258 @@
+"""
+Content-addressed cache of primitive results
+
+Running the same circuits with the same parameters, observables and shots on the
+same backend calibration gives statistically equivalent results, hence regression
+runs do not need to queue them again. The key of a submission hashes:
+    -   the structural hash of each (transpiled) circuit, see utils/transpile_cache.py
+    -   the parameter values and, for the Estimator, the observables
+    -   the shots (Sampler) or the precision (Estimator)
+    -   the backend name and its calibration timestamp (properties last_update_date)
+Results (PrimitiveResult with counts, BitArrays or expectation values) are pickled
+on disk; entries older than ttl seconds are ignored and the least recently used files
+are removed once the directory is larger than max_disk_bytes. As in the transpile cache
+the size of the directory is kept as a running total, rescanned only over the limit.
+
+CachedSampler and CachedEstimator wrap a primitive and keep its run(pubs, ...) interface,
+a cache hit returns a CachedJob whose result() is immediate.
+"""
+
+
+import hashlib
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+import numpy as np
+from qiskit.primitives.containers.estimator_pub import EstimatorPub
+from qiskit.primitives.containers.sampler_pub import SamplerPub
+from utils.transpile_cache import DEFAULT_CACHE_DIR, circuit_hash
+from utils.service_provider import calibration_timestamp
+
+
+def _pub_token(pub) -> str:
+    parameter_values = pub.parameter_values.as_array()
+    token = {
+        "circuit": circuit_hash(pub.circuit),
+        "parameters": hashlib.sha256(np.ascontiguousarray(parameter_values).tobytes()).hexdigest(),
+        "parameters_shape": list(parameter_values.shape),
+    }
+    if isinstance(pub, EstimatorPub):
+        token["observables"] = [json.dumps(obs, sort_keys=True) for obs in pub.observables.ravel().tolist()]
+        token["observables_shape"] = list(pub.observables.shape)
+        token["precision"] = pub.precision
+    else:
+        token["shots"] = pub.shots
+    return json.dumps(token, sort_keys=True)
+
+
+def result_key(primitive: str, pubs: list, backend, options=None) -> str:
+    """
+    :param primitive: "sampler" or "estimator"
+    :param pubs: coerced SamplerPub or EstimatorPub instances
+    :param backend: the backend the pubs are run on
+    :param options: primitive options (resilience, twirling, ...), part of the key by repr
+    """
+    description = json.dumps({
+        "primitive": primitive,
+        "pubs": [_pub_token(pub) for pub in pubs],
+        "options": repr(options),
+        "backend": getattr(backend, "name", str(backend)),
+        "calibration": calibration_timestamp(backend),
+    }, sort_keys=True)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Disk cache of primitive results with time to live and size based eviction
+    """
+
+    def __init__(
+            self,
+            cache_dir: Path | str = DEFAULT_CACHE_DIR / "results",
+            ttl: float = 7*24*3600,
+            max_disk_bytes: int = 512 * 1024**2
+            ):
+        """
+        :param cache_dir: directory of the pickled results
+        :param ttl: seconds after which a result is not returned anymore
+        :param max_disk_bytes: size limit of the cache directory
+        """
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self._disk_bytes = None # running size of the cache directory, None until scanned
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.pkl"
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception: # corrupted file or classes not compatible anymore
+            path.unlink(missing_ok=True)
+            self._disk_bytes = None
+            self.misses += 1
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            path.unlink(missing_ok=True)
+            self._disk_bytes = None
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return entry["result"]
+
+    def put(self, key: str, result):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        disk_bytes = self._disk_usage()
+        path = self._path(key)
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_path, "wb") as file:
+            pickle.dump({"created": time.time(), "result": result}, file)
+        size = temporary_path.stat().st_size
+        try:
+            disk_bytes -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+        os.replace(temporary_path, path)
+        self._disk_bytes = disk_bytes + size
+        self._evict_files()
+
+    def _disk_usage(self) -> int:
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*.pkl"))
+        return self._disk_bytes
+
+    def _evict_files(self):
+        # other processes sharing the directory are accounted for at each rescan
+        if self._disk_usage() <= self.max_disk_bytes:
+            return
+        files = [(path.stat(), path) for path in self.cache_dir.glob("*.pkl")]
+        total_size = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            if total_size <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+        self._disk_bytes = total_size
+
+    def clear(self):
+        for path in self.cache_dir.glob("*.pkl"):
+            path.unlink(missing_ok=True)
+        self._disk_bytes = None
+
+
+class CachedJob:
+    """Job like object returned for a cache hit"""
+
+    def __init__(self, key: str, result):
+        self._key = key
+        self._result = result
+
+    def job_id(self) -> str:
+        return f"cached-{self._key[:16]}"
+
+    def status(self) -> str:
+        return "DONE"
+
+    def done(self) -> bool:
+        return True
+
+    def in_final_state(self) -> bool:
+        return True
+
+    def result(self):
+        return self._result
+
+
+class _CachingJob:
+    """Wraps a submitted job, its result is stored in the cache when retrieved"""
+
+    def __init__(self, job, cache: ResultCache, key: str):
+        self._job = job
+        self._cache = cache
+        self._key = key
+        self._stored = False
+
+    def result(self):
+        result = self._job.result()
+        if not self._stored:
+            self._cache.put(self._key, result)
+            self._stored = True
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._job, name)
+
+
+class _CachedPrimitive:
+    primitive_name = ""
+
+    def __init__(self, primitive, cache: ResultCache | None = None):
+        """
+        :param primitive: Sampler or Estimator instance
+        :param cache: the cache to use, by default the process wide one
+        """
+        self.primitive = primitive
+        self.cache = cache if cache is not None else default_result_cache()
+
+    @property
+    def options(self):
+        return self.primitive.options
+
+    def backend(self):
+        return self.primitive.backend()
+
+    def _coerce(self, pubs, kwargs):
+        raise NotImplementedError
+
+    def run(self, pubs, **kwargs):
+        coerced = self._coerce(pubs, kwargs)
+        key = result_key(
+            self.primitive_name, coerced, self.primitive.backend(), self.primitive.options
+        )
+        result = self.cache.get(key)
+        if result is not None:
+            return CachedJob(key, result)
+        return _CachingJob(self.primitive.run(pubs, **kwargs), self.cache, key)
+
+
+class CachedSampler(_CachedPrimitive):
+    """Sampler returning the cached result of identical submissions"""
+    primitive_name = "sampler"
+
+    def _coerce(self, pubs, kwargs):
+        shots = kwargs.get("shots")
+        if shots is None:
+            shots = self.primitive.options.default_shots
+        shots = shots if isinstance(shots, int) else None
+        return [SamplerPub.coerce(pub, shots=shots) for pub in pubs]
+
+
+class CachedEstimator(_CachedPrimitive):
+    """Estimator returning the cached result of identical submissions"""
+    primitive_name = "estimator"
+
+    def _coerce(self, pubs, kwargs):
+        return [EstimatorPub.coerce(pub, precision=kwargs.get("precision")) for pub in pubs]
+
+
+_default_cache = None
+
+
+def default_result_cache() -> ResultCache:
+    """Process wide cache shared by the cached primitives"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
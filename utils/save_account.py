@@ -1,7 +1,32 @@
+import json
 import os
+import threading
+import time
+from contextlib import nullcontext
 from qiskit import QuantumCircuit
 from qiskit_ibm_runtime import QiskitRuntimeService, ibm_backend
 from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
+from qiskit.utils import should_run_in_parallel
+from utils.transpile_cache import TranspileCache, DEFAULT_CACHE_DIR, default_transpile_cache, backend_fingerprint
+from utils.service_provider import default_service_provider
+from utils.instrumentation import span, count
+
+# preset pass managers reused per (backend target, optimization level), see pass_manager()
+_pass_managers: dict = {}
+_pass_managers_lock = threading.Lock()
+# backend chosen by the previous runs without an explicit backend, see _default_backend()
+BACKEND_CHOICE_PATH = DEFAULT_CACHE_DIR / "backend_choice.json"
+
+def _clear_transpilation_caches():
+    """
+    Refresh hook of the service provider: the pass managers hold the Target (error rates)
+    they were built with and the in-memory transpiled circuits were laid out on it
+    """
+    with _pass_managers_lock:
+        _pass_managers.clear()
+    default_transpile_cache().clear_memory()
+
+default_service_provider().add_refresh_hook(_clear_transpilation_caches)
 
 def save_account(token, channel: str="ibm_quantum"):
     """
@@ -16,41 +41,172 @@ def save_account(token, channel: str="ibm_quantum"):
         else:
             print("token is already saved")
 
-def get_first_available_backend(token:str, channel: str="ibm_quantum") -> ibm_backend.IBMBackend:
+def get_first_available_backend(token: str | None = None, channel: str | None = None) -> ibm_backend.IBMBackend:
     """
     Returns the first available quantum computing machine backend handler
     compatible with the user requirements including its IBM quantum account.
 
-    :param token: the user's IBM QUantum account token
-    :param channel: the communication channel to use for connecting with IBM Quantum services.
-    the default value "ibm_quantum" specifies cloud services.
+    :param token: the user's IBM QUantum account token, None for the saved account
+    :param channel: the communication channel to use for connecting with IBM Quantum services,
+    None for the channel of the saved account
     :return backend: name of the first available quantum computing machine
     """
 
-    service = QiskitRuntimeService(channel=channel, token=token)
-    backends = service.backends(simulator=False, operational=True, min_num_qubits=127)
-    for backend in backends:
-        if backend:
-            print({backend.name: f"available with {backend.num_qubits} qubits"})
-            break
+    with span("service_connection"):
+        backends = default_service_provider().backends(
+            channel, token, simulator=False, operational=True, min_num_qubits=127
+        )
+    backend = backends[0] if backends else None
+    if backend:
+        print({backend.name: f"available with {backend.num_qubits} qubits"})
+    return backend
+
+def pass_manager(backend, optimization_level: int = 1):
+    """
+    Returns the preset pass manager of the backend and optimization level,
+    built once per backend target and calibration (see backend_fingerprint) and reused
+    by every transpilation; the service provider refresh() drops them
+    """
+    key = (backend_fingerprint(backend), optimization_level)
+    with _pass_managers_lock:
+        if key not in _pass_managers:
+            _pass_managers[key] = generate_preset_pass_manager(
+                target=default_service_provider().target(backend), optimization_level=optimization_level
+            )
+        return _pass_managers[key]
+
+def _default_backend(channel: str | None, operational: bool, simulator: bool):
+    """
+    Backend of the runs without an explicit backend:
+        -   the backend named by the QC_EXAMPLES_BACKEND environment variable
+        -   else the least busy backend chosen by a previous run less than
+            QC_EXAMPLES_BACKEND_TTL seconds ago (default one day), see BACKEND_CHOICE_PATH
+        -   else the least busy backend, remembered for the next runs
+    Reusing the same backend skips the least busy search (a status request per backend)
+    and keeps the transpile cache keys stable between runs.
+    """
+    token  = os.getenv('IBM_QUANTUM_TOKEN') # getting the custom env variable that stores my IBM token
+    provider = default_service_provider()
+    name = os.getenv("QC_EXAMPLES_BACKEND")
+    choice = f"{channel}|{operational}|{simulator}"
+    if not name:
+        try:
+            entry = json.loads(BACKEND_CHOICE_PATH.read_text())[choice]
+            if time.time() - entry["time"] < float(os.getenv("QC_EXAMPLES_BACKEND_TTL", 86400)):
+                name = entry["name"]
+        except (OSError, ValueError, KeyError):
+            pass
+    with span("service_connection", backend=name):
+        if name:
+            return provider.backend(name, channel, token)
+        # shared service and cached least busy backend, see utils/service_provider.py
+        backend = provider.least_busy(channel, token, operational=operational, simulator=simulator)
+    try:
+        choices = json.loads(BACKEND_CHOICE_PATH.read_text())
+    except (OSError, ValueError):
+        choices = {}
+    choices[choice] = {"name": backend.name, "time": time.time()}
+    BACKEND_CHOICE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    BACKEND_CHOICE_PATH.write_text(json.dumps(choices))
     return backend
 
 def transpile_circuit(
-        circuit: QuantumCircuit,
-        channel: str = "ibm_quantum",
+        circuit: QuantumCircuit | list,
+        channel: str | None = None,
         operational: bool = True,
         simulator: bool = False,
-        optimization_level: int = 1
+        optimization_level: int = 1,
+        backend: ibm_backend.IBMBackend | None = None,
+        use_cache: bool = True,
+        cache: TranspileCache | None = None,
+        num_processes: int | None = None,
+        persist: bool = True
         )->QuantumCircuit:
     """
     Performs all the necessary steps to generate a transpiled circuit to run on a real IBM quantum computer
     including:
         -   getting user account token
         -   instantiating the service, backend and pass manager
+
+    A list of circuits is transpiled in a single pass manager run and returned as a list.
+    When a backend is given (e.g. a fake backend for local runs) the service is not contacted,
+    otherwise the backend of the previous runs is reused, see _default_backend().
+
+    Transpiled circuits are cached in memory and on disk (see utils/transpile_cache.py),
+    a circuit already transpiled for the same backend target and optimization level
+    is not run through the pass manager again.
+    :param use_cache: set to False to always run the pass manager
+    :param cache: the cache to use, by default the process wide one
+    :param num_processes: processes transpiling a list of circuits, see transpile_circuits
+    :param persist: set to False to keep one-off circuits out of the disk cache
     """
-    token  = os.getenv('IBM_QUANTUM_TOKEN') # getting the custom env variable that stores my IBM token
-    service = QiskitRuntimeService(channel=channel, token=token)
-    backend = service.least_busy(operational=operational, simulator=simulator)
-    pass_manager = generate_preset_pass_manager(backend=backend, optimization_level=optimization_level)
-    qc_transpiled = pass_manager.run(circuit)
-    return backend, qc_transpiled
\ No newline at end of file
+    if backend is None:
+        backend = _default_backend(channel, operational, simulator)
+    def pass_manager_factory():
+        return pass_manager(backend, optimization_level)
+    circuits = 1 if isinstance(circuit, QuantumCircuit) else len(circuit)
+    count("circuits_transpiled", circuits)
+    with span("transpilation", backend=backend.name, circuits=circuits, cached=use_cache):
+        if not use_cache:
+            return backend, pass_manager_factory().run(circuit, num_processes=num_processes)
+        cache = cache if cache is not None else default_transpile_cache()
+        qc_transpiled = cache.transpile(
+            circuit, backend, pass_manager_factory, optimization_level, num_processes, persist
+        )
+    return backend, qc_transpiled
+
+def circuit_metrics(circuit: QuantumCircuit) -> dict:
+    """
+    Depth and two-qubit gate counts of a transpiled circuit:
+        depth: circuit depth
+        two_qubit_gates: number of two-qubit gates
+        two_qubit_depth: depth counting only the two-qubit gates
+        size: number of operations
+    """
+    def is_two_qubit_gate(instruction):
+        return instruction.operation.num_qubits == 2 and instruction.operation.name != "barrier"
+    return {
+        "name": circuit.name,
+        "depth": circuit.depth(),
+        "two_qubit_gates": sum(1 for instruction in circuit.data if is_two_qubit_gate(instruction)),
+        "two_qubit_depth": circuit.depth(is_two_qubit_gate),
+        "size": circuit.size(),
+    }
+
+def transpile_circuits(
+        circuits: list,
+        backend: ibm_backend.IBMBackend | None = None,
+        optimization_level: int = 1,
+        num_processes: int | None = None,
+        use_cache: bool = True,
+        cache: TranspileCache | None = None,
+        channel: str | None = None,
+        operational: bool = True,
+        simulator: bool = False
+        ) -> tuple:
+    """
+    Bulk transpilation of many structurally different circuits: the circuits
+    missing from the cache are run through the shared pass manager of the backend
+    and optimization level (see pass_manager()) in parallel worker processes.
+
+    Usage:
+    -----
+        backend, transpiled, metrics = transpile_circuits(circuits, backend, num_processes=8)
+        print(max(metric["two_qubit_gates"] for metric in metrics))
+
+    :param circuits: list of circuits
+    :param backend: target backend, if None see _default_backend()
+    :param num_processes: worker processes, by default one per core; with more than
+    one process the pass manager runs in parallel whatever the qiskit parallel settings
+    :return: (backend, transpiled circuits, circuit_metrics of each transpiled circuit)
+    """
+    circuits = list(circuits)
+    if backend is None:
+        backend = _default_backend(channel, operational, simulator)
+    parallel = num_processes is not None and num_processes > 1
+    with should_run_in_parallel.override(True) if parallel else nullcontext():
+        _, transpiled = transpile_circuit(
+            circuits, backend=backend, optimization_level=optimization_level,
+            use_cache=use_cache, cache=cache, num_processes=num_processes
+        )
+    return backend, transpiled, [circuit_metrics(circuit) for circuit in transpiled]
@@ -0,0 +1,139 @@
+"""
+Shared QiskitRuntimeService provider
+
+Creating a QiskitRuntimeService authenticates against IBM Quantum and listing the
+backends is another round trip, hence the scripts and utilities share:
+    -   one service instance per (channel, token)
+    -   the backend lists, the least busy backend, the backends by name, the backend
+        targets and properties, cached for ttl seconds
+refresh() drops the cached metadata (not the services) and calls the registered
+refresh hooks, e.g. to invalidate caches built on the backend calibration.
+
+Usage:
+-----
+    provider = default_service_provider()
+    backend = provider.least_busy(operational=True, simulator=False) # saved account
+"""
+
+
+import os
+import threading
+import time
+from qiskit_ibm_runtime import QiskitRuntimeService
+
+
+class ServiceProvider:
+    """
+    Pool of runtime services with a time to live cache of the backend metadata
+    """
+
+    def __init__(self, ttl: float = 300.0, service_factory=None, clock=time.monotonic):
+        """
+        :param ttl: seconds the backend metadata is reused before asking the service again
+        :param service_factory: callable (channel=..., token=...) -> service, by default
+        QiskitRuntimeService; tests pass a local stand-in
+        :param clock: time source of the TTL
+        """
+        self.ttl = ttl
+        self.service_factory = service_factory
+        self.clock = clock
+        self._services = {}
+        self._metadata = {}
+        self._refresh_hooks = []
+        self._lock = threading.RLock()
+
+    def service(self, channel: str | None = None, token: str | None = None):
+        """
+        Returns the shared service of the channel and token. The channel and the token
+        are passed to the service only when given: without them the service uses the
+        saved default account (see QiskitRuntimeService.save_account)
+        """
+        key = (channel, token)
+        with self._lock:
+            if key not in self._services:
+                factory = self.service_factory or QiskitRuntimeService
+                credentials = {name: value for name, value in (("channel", channel), ("token", token)) if value is not None}
+                self._services[key] = factory(**credentials)
+            return self._services[key]
+
+    def _cached(self, key, compute):
+        with self._lock:
+            entry = self._metadata.get(key)
+            if entry is not None and self.clock() - entry[0] < self.ttl:
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._metadata[key] = (self.clock(), value)
+        return value
+
+    def backends(self, channel: str | None = None, token: str | None = None, **filters) -> list:
+        """Cached service.backends(**filters)"""
+        service = self.service(channel, token)
+        key = ("backends", id(service), tuple(sorted(filters.items())))
+        return self._cached(key, lambda: list(service.backends(**filters)))
+
+    def least_busy(self, channel: str | None = None, token: str | None = None, **filters):
+        """Cached service.least_busy(**filters)"""
+        service = self.service(channel, token)
+        key = ("least_busy", id(service), tuple(sorted(filters.items())))
+        return self._cached(key, lambda: service.least_busy(**filters))
+
+    def backend(self, name: str, channel: str | None = None, token: str | None = None):
+        """Cached service.backend(name)"""
+        service = self.service(channel, token)
+        return self._cached(("backend", id(service), name), lambda: service.backend(name))
+
+    def target(self, backend):
+        """
+        Cached backend.target, read by the pass managers, the transpile cache keys and the
+        qubit multiplexing. The key is the backend instance (the cache entry keeps it
+        alive): local simulators with different configurations can share a name.
+        """
+        key = ("target", backend.name, id(backend))
+        return self._cached(key, lambda: (backend, backend.target))[1]
+
+    def properties(self, backend):
+        """Cached backend.properties(), None for backends without properties (simulators)"""
+        def compute():
+            try:
+                return backend.properties()
+            except Exception:
+                return None
+        # keyed by backend instance like target(), the entry keeps the backend alive
+        key = ("properties", backend.name, id(backend))
+        return self._cached(key, lambda: (backend, compute()))[1]
+
+    def add_refresh_hook(self, hook):
+        """hook() is called by refresh()"""
+        self._refresh_hooks.append(hook)
+
+    def refresh(self):
+        """Drops the cached backend metadata and calls the refresh hooks"""
+        with self._lock:
+            self._metadata.clear()
+        for hook in self._refresh_hooks:
+            hook()
+
+
+def calibration_timestamp(backend) -> str | None:
+    """Last calibration date of the backend, None when it has no properties (simulators)"""
+    if not hasattr(backend, "properties"): # e.g. the name of a local primitive
+        return None
+    properties = default_service_provider().properties(backend)
+    if properties is None:
+        return None
+    return str(properties.last_update_date)
+
+
+_default_provider = None
+
+
+def default_service_provider() -> ServiceProvider:
+    """
+    Process wide provider, its TTL is read from the QC_EXAMPLES_SERVICE_TTL
+    environment variable (seconds, default 300)
+    """
+    global _default_provider
+    if _default_provider is None:
+        _default_provider = ServiceProvider(ttl=float(os.getenv("QC_EXAMPLES_SERVICE_TTL", 300)))
+    return _default_provider
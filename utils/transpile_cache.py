@@ -0,0 +1,249 @@
+"""
+Cache of transpiled circuits
+
+Transpiling the same circuit for the same backend gives an equivalent result,
+hence the transpiled circuit is stored and reused. The key is a structural hash of
+the circuit (operations, parameters and qubits, not the circuit auto-generated name),
+the backend target (name, number of qubits, operations, coupling map and calibration
+date) and the optimization level. The calibration date keeps the layouts chosen on the
+error rates of a past calibration from being served: a backend calibrated daily
+transpiles each circuit again once a day.
+
+Two tiers:
+    -   in memory: least recently used circuits, up to max_memory_entries
+    -   on disk: one QPY file per key in cache_dir, the least recently used files
+        are removed once the directory is larger than max_disk_bytes. The size of the
+        directory is scanned once and then kept as a running total, the directory is
+        rescanned only when the total exceeds the limit, once per transpile() call.
+"""
+
+
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from qiskit import QuantumCircuit, qpy
+from qiskit.circuit import ParameterExpression
+from qiskit.circuit.library import get_standard_gate_name_mapping
+from utils.service_provider import default_service_provider, calibration_timestamp
+
+DEFAULT_CACHE_DIR = Path(
+    os.getenv("QC_EXAMPLES_CACHE_DIR", Path.home() / ".cache" / "quantum_computing_examples")
+)
+_NON_GATE_INSTRUCTIONS = {"measure", "reset", "barrier", "delay", "initialize", "state_preparation"}
+
+
+def _param_token(param) -> str:
+    if isinstance(param, ParameterExpression):
+        return f"expr:{param}"
+    if isinstance(param, np.ndarray):
+        return f"array:{param.dtype}:{param.shape}:{param.tobytes().hex()}"
+    if isinstance(param, QuantumCircuit):
+        return f"circuit:{circuit_hash(param)}"
+    if isinstance(param, (int, float, complex, np.number)):
+        return repr(complex(param))
+    return repr(param)
+
+
+def _update_circuit_hash(digest, circuit: QuantumCircuit):
+    digest.update(f"{circuit.num_qubits}|{circuit.num_clbits}|{_param_token(circuit.global_phase)}".encode())
+    for register in circuit.cregs:
+        digest.update(f"creg:{register.name}:{register.size}".encode())
+    standard_gates = get_standard_gate_name_mapping()
+    for instruction in circuit.data:
+        operation = instruction.operation
+        qubits = [circuit.find_bit(qubit).index for qubit in instruction.qubits]
+        clbits = [circuit.find_bit(clbit).index for clbit in instruction.clbits]
+        params = [_param_token(param) for param in operation.params]
+        digest.update(f"{operation.name}|{qubits}|{clbits}|{params}".encode())
+        # custom gates can share a name with different definitions
+        if operation.name not in standard_gates and operation.name not in _NON_GATE_INSTRUCTIONS:
+            definition = getattr(operation, "definition", None)
+            if definition is not None:
+                _update_circuit_hash(digest, definition)
+
+
+def circuit_hash(circuit: QuantumCircuit) -> str:
+    """Structural hash of a circuit, independent from its name and metadata"""
+    digest = hashlib.sha256()
+    _update_circuit_hash(digest, circuit)
+    return digest.hexdigest()
+
+
+def backend_fingerprint(backend) -> str:
+    """Identifies the backend target the circuits are transpiled for"""
+    target = default_service_provider().target(backend)
+    coupling_map = target.build_coupling_map()
+    edges = sorted(coupling_map.get_edges()) if coupling_map else []
+    description = (
+        f"{backend.name}|{target.num_qubits}|{sorted(target.operation_names)}|{edges}"
+        f"|{calibration_timestamp(backend)}"
+    )
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class TranspileCache:
+    """
+    Two tier (memory LRU and disk QPY) cache of transpiled circuits.
+    Returned circuits are shared with the cache, copy them before modifying them.
+    """
+
+    def __init__(
+            self,
+            cache_dir: Path | str | None = DEFAULT_CACHE_DIR / "transpiled",
+            max_memory_entries: int = 128,
+            max_disk_bytes: int = 256 * 1024**2
+            ):
+        """
+        :param cache_dir: directory of the QPY files, None keeps the cache in memory only
+        :param max_memory_entries: number of circuits kept in memory
+        :param max_disk_bytes: size limit of the cache directory
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: OrderedDict = OrderedDict()
+        self._disk_bytes = None # running size of the cache directory, None until scanned
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(circuit: QuantumCircuit, backend, optimization_level: int, fingerprint: str | None = None) -> str:
+        """
+        :param fingerprint: backend_fingerprint(backend), computed here when not given
+        """
+        fingerprint = fingerprint if fingerprint is not None else backend_fingerprint(backend)
+        description = f"{circuit_hash(circuit)}|{fingerprint}|{optimization_level}"
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.qpy"
+
+    def get(self, key: str) -> QuantumCircuit | None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key]
+        if self.cache_dir is not None and self._path(key).exists():
+            path = self._path(key)
+            try:
+                with open(path, "rb") as file:
+                    circuit = qpy.load(file)[0]
+            except Exception: # corrupted file or QPY version not supported anymore
+                path.unlink(missing_ok=True)
+                self._disk_bytes = None
+            else:
+                os.utime(path)
+                self._remember(key, circuit)
+                self.hits += 1
+                return circuit
+        self.misses += 1
+        return None
+
+    def put(self, key: str, circuit: QuantumCircuit, persist: bool = True):
+        """
+        :param persist: False keeps the circuit in memory only (circuits never reused)
+        """
+        self._remember(key, circuit)
+        if self.cache_dir is not None and persist:
+            self._write_file(key, circuit)
+            self._evict_files()
+
+    def _write_file(self, key: str, circuit: QuantumCircuit):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        disk_bytes = self._disk_usage()
+        path = self._path(key)
+        temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_path, "wb") as file:
+            qpy.dump(circuit, file)
+        size = temporary_path.stat().st_size
+        try:
+            disk_bytes -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+        os.replace(temporary_path, path)
+        self._disk_bytes = disk_bytes + size
+
+    def _remember(self, key: str, circuit: QuantumCircuit):
+        self._memory[key] = circuit
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_usage(self) -> int:
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*.qpy"))
+        return self._disk_bytes
+
+    def _evict_files(self):
+        # other processes sharing the directory are accounted for at each rescan
+        if self._disk_usage() <= self.max_disk_bytes:
+            return
+        files = [(path.stat(), path) for path in self.cache_dir.glob("*.qpy")]
+        total_size = sum(stat.st_size for stat, _ in files)
+        for stat, path in sorted(files, key=lambda item: item[0].st_mtime):
+            if total_size <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+        self._disk_bytes = total_size
+
+    def clear_memory(self):
+        """Drops the in-memory tier, the QPY files are kept"""
+        self._memory.clear()
+
+    def clear(self):
+        self._memory.clear()
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob("*.qpy"):
+                path.unlink(missing_ok=True)
+            self._disk_bytes = 0
+
+    def transpile(
+            self,
+            circuits,
+            backend,
+            pass_manager_factory,
+            optimization_level: int,
+            num_processes: int | None = None,
+            persist: bool = True
+            ):
+        """
+        Returns the transpiled circuits, only the circuits missing from the cache
+        are run through the pass manager (built lazily by pass_manager_factory()).
+
+        :param circuits: a circuit or a list of circuits
+        :param num_processes: processes of the pass manager run of the missing circuits
+        :param persist: False keeps the transpiled circuits in memory only, for one-off
+        circuits (e.g. one initialize circuit per query) never transpiled again
+        :return: a transpiled circuit or a list of transpiled circuits
+        """
+        single = isinstance(circuits, QuantumCircuit)
+        circuits = [circuits] if single else list(circuits)
+        fingerprint = backend_fingerprint(backend)
+        keys = [self.key(circuit, backend, optimization_level, fingerprint) for circuit in circuits]
+        transpiled = [self.get(key) for key in keys]
+        missing = [i for i, circuit in enumerate(transpiled) if circuit is None]
+        if missing:
+            results = pass_manager_factory().run([circuits[i] for i in missing], num_processes=num_processes)
+            # all the files are written first, the directory is evicted once
+            for i, circuit in zip(missing, results):
+                self._remember(keys[i], circuit)
+                if self.cache_dir is not None and persist:
+                    self._write_file(keys[i], circuit)
+                transpiled[i] = circuit
+            if self.cache_dir is not None and persist:
+                self._evict_files()
+        return transpiled[0] if single else transpiled
+
+
+_default_cache = None
+
+
+def default_transpile_cache() -> TranspileCache:
+    """Process wide cache shared by transpile_circuit"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = TranspileCache()
+    return _default_cache